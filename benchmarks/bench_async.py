@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the throughput of I/O bound handlers: sync handlers served by a fixed pool of WSGI worker threads, and
+async handlers served by the ASGI adapter's event loop
+
+    PYTHONPATH=src python benchmarks/bench_async.py
+
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+
+from rapidrest import asgi
+from rapidrest.apiresource import ApiResource, ApiResponse
+
+REQUESTS = 2000
+CONCURRENCY = 200
+WSGI_THREADS = 16
+IO_WAIT = 0.02
+
+
+class SyncWait(ApiResource):
+    endpoint_name = "sync_wait"
+
+    def get(self):
+        time.sleep(IO_WAIT)
+        return ApiResponse(body={"waited": IO_WAIT}, status_code=200)
+
+
+class AsyncWait(ApiResource):
+    endpoint_name = "async_wait"
+
+    async def get(self):
+        await asyncio.sleep(IO_WAIT)
+        return ApiResponse(body={"waited": IO_WAIT}, status_code=200)
+
+
+def _app(resource_class, is_async:bool=False) -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.config["api_config"] = {"security": {"whitelist": False}}
+    app.add_url_rule("/wait", view_func=resource_class.as_view(resource_class.endpoint_name))
+    if is_async:
+        app.config["async_routes"] = {(resource_class.endpoint_name, "GET")}
+    return app
+
+
+def _bench_wsgi() -> float:
+    app = _app(SyncWait)
+
+    def _get(_):
+        # A new client per request, test clients are not thread-safe
+        return app.test_client().get("/wait").status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WSGI_THREADS) as pool:
+        assert all(status == 200 for status in pool.map(_get, range(REQUESTS)))
+    return REQUESTS / (time.perf_counter() - started)
+
+
+def _bench_asgi() -> float:
+    asgi_app = asgi.AsgiApplication(_app(AsyncWait, is_async=True), max_threads=WSGI_THREADS)
+    scope = {"type": "http", "method": "GET", "path": "/wait", "query_string": b"", "headers": []}
+
+    async def _get(limit):
+        statuses = []
+
+        async def _receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        async with limit:
+            await asgi_app(scope, _receive, _send)
+        return statuses[0]
+
+    async def _run():
+        limit = asyncio.Semaphore(CONCURRENCY)
+        return await asyncio.gather(*(_get(limit) for _ in range(REQUESTS)))
+
+    started = time.perf_counter()
+    assert all(status == 200 for status in asyncio.run(_run()))
+    return REQUESTS / (time.perf_counter() - started)
+
+
+def main():
+    print(f"{REQUESTS} requests, each waiting {IO_WAIT * 1e3:.0f} ms on I/O")
+    print(f"sync handlers, {WSGI_THREADS} WSGI threads:     {_bench_wsgi():8.0f} requests/s")
+    print(f"async handlers, ASGI ({CONCURRENCY} in flight): {_bench_asgi():8.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Compares serializing large nested payloads with Flask's jsonify and with the codecs
+
+    PYTHONPATH=src python benchmarks/bench_json.py
+
+"""
+import timeit
+
+import flask
+
+from rapidrest import codec
+
+ROUNDS = 50
+
+
+def _payload(items:int) -> dict:
+    return {
+        "data": [
+            {
+                "type": "pants",
+                "id": str(idx),
+                "attributes": {
+                    "size": idx % 40,
+                    "price": idx * 1.25,
+                    "colours": ["blue", "black", "grey"],
+                    "description": "A pair of pants, suitable for wearing on the legs " * 2,
+                    "tags": {f"tag{tag}": tag % 2 == 0 for tag in range(10)},
+                },
+                "relationships": {"owner": {"data": {"type": "people", "id": str(idx % 100)}}},
+            }
+            for idx in range(items)
+        ],
+        "meta": {"count": items},
+    }
+
+
+def main():
+    app = flask.Flask(__name__)
+    codecs = [("stdlib codec", codec.create_codec("stdlib"))]
+    if codec.orjson is not None:
+        codecs.append(("orjson codec", codec.create_codec("orjson")))
+
+    with app.app_context():
+        for items in (100, 1000, 10000):
+            payload = _payload(items)
+            elapsed = timeit.timeit(lambda: flask.jsonify(payload).get_data(), number=ROUNDS)
+            results = [f"jsonify {elapsed / ROUNDS * 1e3:8.2f} ms"]
+            for label, json_codec in codecs:
+                elapsed = timeit.timeit(lambda: json_codec.dumps(payload), number=ROUNDS)
+                results.append(f"{label} {elapsed / ROUNDS * 1e3:8.2f} ms")
+
+            size = len(codecs[0][1].dumps(payload)) // 1024
+            print(f"{items:6d} items ({size:6d} KiB): {'   '.join(results)}")
+
+
+if __name__ == "__main__":
+    main()
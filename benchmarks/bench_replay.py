@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the per-request overhead of the replay protection check
+
+    PYTHONPATH=src python benchmarks/bench_replay.py
+
+"""
+import secrets
+import time
+import timeit
+
+from rapidrest.security.replay import ReplayCache
+
+REQUESTS = 200000
+PRINCIPALS = 100
+
+
+def main():
+    cache = ReplayCache(skew_window=300, bucket_seconds=10, max_nonces_per_bucket=REQUESTS)
+    now = int(time.time())
+    requests = [(f"principal-{idx % PRINCIPALS}", secrets.token_hex(16)) for idx in range(REQUESTS)]
+
+    fresh = iter(requests)
+    elapsed = timeit.timeit(lambda: _check(cache, next(fresh), now), number=REQUESTS)
+    print(f"fresh nonces:    {elapsed / REQUESTS * 1e9:8.0f} ns/request")
+
+    replayed = iter(requests)
+    elapsed = timeit.timeit(lambda: _check(cache, next(replayed), now), number=REQUESTS)
+    print(f"replayed nonces: {elapsed / REQUESTS * 1e9:8.0f} ns/request")
+
+    baseline = iter(requests)
+    elapsed = timeit.timeit(lambda: next(baseline), number=REQUESTS)
+    print(f"loop baseline:   {elapsed / REQUESTS * 1e9:8.0f} ns/request")
+    print(cache.stats())
+
+
+def _check(cache, request, now):
+    principal, nonce = request
+    return cache.check(principal, now, nonce)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the per-request cost of the resource layer with a resource instance per request and with singleton resources
+
+    PYTHONPATH=src python benchmarks/bench_resource_alloc.py
+
+"""
+import timeit
+import tracemalloc
+
+import flask
+
+from rapidrest.apiresource import ApiResource
+
+REQUESTS = 100000
+
+
+class Ping(ApiResource):
+    endpoint_name = "ping"
+    response = flask.Response(b"{}", mimetype="application/json")
+
+    def get(self):
+        self._current_request.flask_request
+        return self.response
+
+
+class SingletonPing(Ping):
+    init_every_request = False
+
+
+def main():
+    for label, resource_class in (("instance per request", Ping), ("singleton", SingletonPing)):
+        app = flask.Flask(__name__)
+        app.config["api_config"] = {"security": {"whitelist": False}}
+        view = resource_class.as_view(resource_class.endpoint_name)
+        app.add_url_rule("/ping", view_func=view)
+
+        with app.test_request_context("/ping"):
+            elapsed = timeit.timeit(view, number=REQUESTS)
+            peak = _peak_bytes(view)
+
+        print(f"{label:22} {elapsed / REQUESTS * 1e9:8.0f} ns/request {peak:6d} peak bytes/request")
+
+
+def _peak_bytes(view, rounds=1000) -> float:
+    """
+    Peak traced memory while serving a request, above what was live before it
+    """
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(rounds):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            view()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return total // rounds
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Compares URL matching cost of Werkzeug's matcher and the prefix tree matcher, for APIs of different sizes.  Each
+match binds the map to the request's environ first, like Flask does for every request.
+
+    PYTHONPATH=src python benchmarks/bench_router.py
+
+"""
+import random
+import timeit
+
+from werkzeug.routing import Map, Rule
+from werkzeug.test import create_environ
+
+from rapidrest.router import RadixMap
+
+MATCHES = 50000
+
+
+def _rules(resources:int) -> list:
+    """
+    Rules shaped like routebuilder's, ten resources per package
+    """
+    rules = []
+    for idx in range(resources):
+        url = f"/v1/pkg{idx // 10}/res{idx}"
+        rules.append(Rule(url, endpoint=f"res{idx}", methods=["GET", "POST"]))
+        rules.append(Rule(f"{url}/<obj_id>", endpoint=f"res{idx}", methods=["GET", "DELETE"]))
+    return rules
+
+
+def main():
+    rng = random.Random(42)
+    for resources in (10, 100, 1000):
+        environs = []
+        for _ in range(MATCHES):
+            idx = rng.randrange(resources)
+            suffix = f"/{rng.randrange(100000)}" if rng.random() < 0.5 else ""
+            environs.append(create_environ(f"/v1/pkg{idx // 10}/res{idx}{suffix}", "http://localhost/"))
+
+        results = []
+        for label, map_class in (("werkzeug", Map), ("radix", RadixMap)):
+            url_map = map_class(_rules(resources))
+            url_map.bind_to_environ(environs[0]).match()
+            requests = iter(environs)
+            elapsed = timeit.timeit(lambda: url_map.bind_to_environ(next(requests)).match(return_rule=True),
+                                    number=MATCHES)
+            results.append(f"{label} {elapsed / MATCHES * 1e9:7.0f} ns/request")
+
+        print(f"{resources:5d} resources: {'   '.join(results)}")
+
+
+if __name__ == "__main__":
+    main()
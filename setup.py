@@ -26,6 +26,8 @@ setup(
     install_requires = import_requires(),
     extras_require = {
         "Vault": ["hvac>=0.7.2"],
+        "orjson": ["orjson>=3.6"],
+        "compression": ["brotli>=1.0", "zstandard>=0.15"],
         "tests": ["nose2", "WebTest"]
     },
     classifiers=[
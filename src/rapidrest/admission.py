@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control: rate limits and load shedding, applied to every request once it has been authenticated.
+
+Each principal and each configured endpoint gets a token bucket, refilled at `rate` tokens a second up to `burst`.  A
+request that finds its bucket empty is rejected with a 429 and a Retry-After of when the bucket will have a token
+again.  A worker that already has `max_in_flight` requests in progress, or that only gets to a request more than
+`max_queue_latency` seconds after it arrived, sheds it with a 503 instead of letting its queue grow.  Configured in
+`api_config.yml`:
+
+    admission:
+      enabled: true
+      principal: {rate: 100, burst: 200}    # Every authenticated principal
+      principals:
+        "reporting": {rate: 5, burst: 10}   # Overrides for single principals
+      endpoint_control:
+        "/v1/pants":
+          POST: {rate: 50, burst: 50}       # Shared by every caller of the endpoint
+      max_in_flight: 256                    # Requests in progress per worker, 0 for no limit
+      max_queue_latency: 2                  # Seconds, 0 for no limit
+      retry_after: 1                        # Seconds, sent with 503s
+      shared_state:                         # File holding the buckets, e.g. /dev/shm/myapi-admission
+      shared_slots: 65536
+
+Queue latency is measured from when the ASGI adapter received the request, or from an `X-Request-Start` header set by
+the load balancer (`t=<unix seconds>`, in seconds, milliseconds or microseconds).
+
+Buckets are per worker unless `shared_state` is set, in which case the workers of a host share them through a memory
+mapped file, each bucket locked on its own (this needs fcntl, so isn't available on Windows).  In-flight requests are
+always counted per worker.  A per-worker bucket is dropped once it has refilled (it is then no different from a new
+one), and the least recently used ones are dropped beyond `DEFAULT_MAX_BUCKETS`.
+
+"""
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+import flask
+
+from rapidrest import asgi, httperrors
+from rapidrest.exceptions import RapidRestError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_BUCKETS = 65536
+DEFAULT_RETRY_AFTER = 1
+DEFAULT_SHARED_SLOTS = 65536
+REQUEST_START_HEADER = "X-Request-Start"
+
+# Lock stripes of the per-worker bookkeeping, so concurrent requests rarely contend on the same lock
+_STRIPES = 64
+# Slots probed for a key in the shared file before falling back to a per-worker bucket
+_MAX_PROBES = 8
+# key hash, tokens, last refill
+_SLOT = struct.Struct("<Qdd")
+
+
+class AdmissionError(RapidRestError): pass
+
+
+def _refill(tokens:float, last:float, now:float, rate:float, burst:float) -> tuple:
+    """
+    Refills a bucket and takes a token from it if it has one
+
+    :return: (tokens left, seconds until a token is available, 0 if one was taken)
+    """
+    tokens = min(burst, tokens + max(0.0, now - last) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBuckets:
+    """
+    Token buckets held by this worker
+    """
+
+    def __init__(self, clock=time.monotonic, max_buckets:int=DEFAULT_MAX_BUCKETS):
+        """
+        :param clock: Monotonic clock (overridable for tests)
+        :param max_buckets: Most buckets held, the least recently used are dropped beyond it
+        """
+        self._clock = clock
+        # Each stripe's buckets, least recently used first, as key: (tokens, last refill, when it will be full)
+        self._buckets = [OrderedDict() for _ in range(_STRIPES)]
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        self._stripe_max = max(1, max_buckets // _STRIPES)
+
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets in self._buckets)
+
+
+    def take(self, key:str, rate:float, burst:float) -> float:
+        """
+        Takes a token from a bucket, creating it full
+
+        :param key: The bucket's key
+        :param rate: Tokens added per second
+        :param burst: Most tokens the bucket holds
+
+        :return: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        stripe = hash(key) % _STRIPES
+        buckets = self._buckets[stripe]
+        with self._locks[stripe]:
+            now = self._clock()
+            tokens, last, _ = buckets.pop(key, (burst, now, now))
+            tokens, wait = _refill(tokens, last, now, rate, burst)
+            buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+            # A bucket that has refilled would be created the same, so only recently used ones are kept
+            while buckets:
+                oldest = next(iter(buckets))
+                if buckets[oldest][2] > now and len(buckets) <= self._stripe_max:
+                    break
+                del buckets[oldest]
+        return wait
+
+
+class SharedTokenBuckets:
+    """
+    Token buckets held in a memory mapped file, shared by the workers of a host.  Slots are found by open addressing
+    on a stable hash of the key, and each is locked with a record lock while it is updated.
+    """
+
+    def __init__(self, path:str, slots:int=DEFAULT_SHARED_SLOTS, clock=time.monotonic):
+        """
+        :param path: The file, created if it doesn't exist
+        :param slots: Number of buckets the file holds
+        :param clock: Monotonic clock, which must be the same for every process (CLOCK_MONOTONIC is system-wide)
+        """
+        if fcntl is None:
+            raise AdmissionError("Shared admission state needs fcntl, which this platform doesn't have")
+
+        self.slots = slots
+        self._clock = clock
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * _SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # Record locks only exclude other processes, threads of this one take the slot's stripe lock first
+        self._locks = [threading.Lock() for _ in range(_STRIPES)]
+        self._local = TokenBuckets(clock)
+
+
+    def take(self, key:str, rate:float, burst:float) -> float:
+        """
+        Takes a token from a bucket, creating it full (see TokenBuckets.take)
+        """
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+        for probe in range(_MAX_PROBES):
+            slot = (key_hash + probe) % self.slots
+            offset = slot * _SLOT.size
+            with self._locks[slot % _STRIPES]:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset, os.SEEK_SET)
+                try:
+                    slot_hash, tokens, last = _SLOT.unpack_from(self._map, offset)
+                    if slot_hash not in (0, key_hash):
+                        continue
+                    now = self._clock()
+                    # A new bucket, or one from before a reboot (the clock restarted), starts full
+                    if slot_hash == 0 or last > now:
+                        tokens, last = burst, now
+                    tokens, wait = _refill(tokens, last, now, rate, burst)
+                    _SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+                    return wait
+                finally:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset, os.SEEK_SET)
+
+        # The neighbourhood is full, this key gets a bucket of its own in this worker
+        return self._local.take(key, rate, burst)
+
+
+def request_start(request:flask.Request) -> float or None:
+    """
+    Gets when a request arrived, as unix epoch seconds
+
+    :param request: The current request
+
+    :return: The time, or None if it isn't known
+    """
+    received_at = request.environ.get(asgi.RECEIVED_AT_KEY)
+    if received_at is not None:
+        return received_at
+
+    header = request.headers.get(REQUEST_START_HEADER)
+    if not header:
+        return None
+    try:
+        start = float(header[2:] if header.startswith("t=") else header)
+    except ValueError:
+        return None
+
+    # Load balancers disagree on the unit
+    while start > 1e11:
+        start /= 1000
+    return start
+
+
+class AdmissionController:
+    """
+    Decides whether a worker takes on a request
+    """
+
+    def __init__(self, principal_limit:tuple=None, principal_limits:dict=None, endpoint_limits:dict=None,
+                 max_in_flight:int=0, max_queue_latency:float=0, retry_after:int=DEFAULT_RETRY_AFTER, buckets=None,
+                 clock=time.time):
+        """
+        :param principal_limit: (rate, burst) of every principal, None for no limit
+        :param principal_limits: Mapping of principal names to their own (rate, burst)
+        :param endpoint_limits: Mapping of (endpoint, rule, method) to the endpoint's (rate, burst)
+        :param max_in_flight: Requests in progress before new ones are shed, 0 for no limit
+        :param max_queue_latency: Seconds a request may wait before it is shed, 0 for no limit
+        :param retry_after: Seconds clients are told to wait after a 503
+        :param buckets: TokenBuckets or SharedTokenBuckets, per worker ones by default
+        :param clock: Wall clock, as unix epoch seconds (overridable for tests)
+        """
+        self.principal_limit = principal_limit
+        self._principal_limits = MappingProxyType(principal_limits or {})
+        self._endpoint_limits = MappingProxyType(endpoint_limits or {})
+        self.max_in_flight = max_in_flight
+        self.max_queue_latency = max_queue_latency
+        self.retry_after = retry_after
+        self._buckets = buckets if buckets is not None else TokenBuckets()
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"admitted": 0, "throttled_principal": 0, "throttled_endpoint": 0, "shed_concurrency": 0,
+                         "shed_latency": 0}
+
+
+    def _count(self, counter:str):
+        with self._lock:
+            self.counters[counter] += 1
+
+
+    def _throttle(self, counter:str, wait:float, detail:str):
+        self._count(counter)
+        raise httperrors.TooManyRequests(detail, retry_after=max(1, math.ceil(wait)))
+
+
+    def _shed(self, counter:str, detail:str):
+        self._count(counter)
+        raise httperrors.ServiceUnavailable(detail, retry_after=self.retry_after)
+
+
+    def admit(self, request:flask.Request):
+        """
+        Admits a request, which must be released when it ends.  Aborts with a 503 or 429 if it isn't admitted.
+
+        :param request: The current (authenticated) request
+        """
+        if self.max_queue_latency:
+            started = request_start(request)
+            if started is not None and self._clock() - started > self.max_queue_latency:
+                self._shed("shed_latency", "The server is overloaded, try again later")
+
+        rule = request.url_rule
+        limit = self._endpoint_limits.get((rule.endpoint, rule.rule, request.method)) if rule is not None else None
+        if limit is not None:
+            wait = self._buckets.take(f"endpoint:{rule.endpoint}:{request.method}", *limit)
+            if wait:
+                self._throttle("throttled_endpoint", wait, "Too many requests to this endpoint")
+
+        principal = flask.g.get("principal")
+        if principal is not None:
+            limit = self._principal_limits.get(principal.name, self.principal_limit)
+            if limit is not None:
+                wait = self._buckets.take(f"principal:{principal.name}", *limit)
+                if wait:
+                    self._throttle("throttled_principal", wait, "Too many requests from this principal")
+
+        with self._lock:
+            admitted = not self.max_in_flight or self.in_flight < self.max_in_flight
+            if admitted:
+                self.in_flight += 1
+                self.counters["admitted"] += 1
+        if not admitted:
+            self._shed("shed_concurrency", "The server is overloaded, try again later")
+
+
+    def release(self):
+        """
+        Ends an admitted request
+        """
+        with self._lock:
+            self.in_flight -= 1
+
+
+    def stats(self) -> dict:
+        """
+        Gets the admission counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = self.in_flight
+        return stats
+
+
+def admit(app:flask.Flask, request:flask.Request) -> AdmissionController or None:
+    """
+    Runs a request through the application's admission control, if it has any
+
+    :param app: The application
+    :param request: The current (authenticated) request
+
+    :return: The controller to release the request with when it ends, or None if there is nothing to release
+    """
+    controller = app.config.get("admission")
+    if controller is None:
+        return None
+
+    controller.admit(request)
+    return controller
+
+
+def _limit(cfg, name:str) -> tuple:
+    if not isinstance(cfg, dict) or "rate" not in cfg:
+        raise AdmissionError(f"{name} must be a mapping with a 'rate' (and optionally a 'burst')")
+
+    rate = float(cfg["rate"])
+    burst = float(cfg.get("burst", max(1.0, rate)))
+    if rate <= 0 or burst < 1:
+        raise AdmissionError(f"{name} needs a positive rate and a burst of at least 1")
+    return rate, burst
+
+
+def from_api_config(api_config:dict, registered_rules:list, log=_LOGGER) -> AdmissionController or None:
+    """
+    Creates the admission controller described by the API config, checking its endpoint config against the
+    registered routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The admission controller, or None if admission control is not enabled
+    """
+    admission_cfg = api_config.get("admission") or {}
+    if not admission_cfg.get("enabled", False):
+        return None
+
+    endpoint_control = admission_cfg.get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise AdmissionError("'admission.endpoint_control' must be a mapping of URL rules")
+
+    endpoint_limits = {}
+    for endpoint, url_rule, methods in registered_rules:
+        for method, method_cfg in (endpoint_control.get(url_rule) or {}).items():
+            if method in methods:
+                endpoint_limits[(endpoint, url_rule, method)] = _limit(method_cfg, f"Admission config for "
+                                                                                   f"{method} {url_rule}")
+
+    registered = {url_rule for _, url_rule, _ in registered_rules}
+    for url_rule in endpoint_control:
+        if url_rule not in registered:
+            log.warning(f"Admission config for '{url_rule}' does not match any registered route")
+
+    principal_cfg = admission_cfg.get("principal")
+    principal_limits = {name: _limit(cfg, f"Admission config for principal '{name}'")
+                        for name, cfg in (admission_cfg.get("principals") or {}).items()}
+
+    buckets = None
+    if admission_cfg.get("shared_state"):
+        try:
+            buckets = SharedTokenBuckets(admission_cfg["shared_state"],
+                                         slots=admission_cfg.get("shared_slots", DEFAULT_SHARED_SLOTS))
+        except OSError as e:
+            raise AdmissionError(f"Failed to open the shared admission state: {e}")
+
+    controller = AdmissionController(
+        principal_limit=_limit(principal_cfg, "'admission.principal'") if principal_cfg else None,
+        principal_limits=principal_limits,
+        endpoint_limits=endpoint_limits,
+        max_in_flight=admission_cfg.get("max_in_flight", 0),
+        max_queue_latency=admission_cfg.get("max_queue_latency", 0),
+        retry_after=admission_cfg.get("retry_after", DEFAULT_RETRY_AFTER),
+        buckets=buckets,
+    )
+    _LOGGER.info("Admission control enabled%s", ", with state shared by the host's workers" if buckets else "")
+    return controller
@@ -3,26 +3,277 @@
 Subclasses Flask's MethodView to provide some extra functionality (and enforce some things)
 
 """
+import asyncio
+import inspect
 from collections import namedtuple
-from flask import current_app, request, Response, abort, make_response, jsonify
+from contextvars import ContextVar
+from datetime import datetime
+from flask import current_app, request, Response, abort, make_response
 from flask.views import MethodView
 
+from rapidrest import admission, asgi, coalescing, codec, compression, deadlines, http_caching, response_cache, streaming
 from rapidrest.security import authentication
 
 ApiResponse = namedtuple("ApiResponse", field_names=("body", "status_code", "headers"), defaults=({},))
-ApiRequest = namedtuple("ApiRequest", field_names=("headers", "body", "flask_request"))
+
+_UNRESOLVED = object()
+
+
+class ApiRequest:
+    """
+    @brief      Per-request state handed to resource handlers (as `self._current_request`)
+
+    Keeps the `ApiRequest(headers, body, flask_request)` namedtuple interface (indexing, unpacking, `_replace`,
+    `_asdict`), except that the body, when it isn't given, is only parsed when the handler first uses it.
+    """
+    __slots__ = ("flask_request", "_headers", "_app_config", "_raw_body", "_body", "_vault")
+    _fields = ("headers", "body", "flask_request")
+
+    def __init__(self, headers=None, body=_UNRESOLVED, flask_request=None, app_config=None):
+        """
+        @param      headers         The request headers, defaults to the Flask request's
+        @param      body            The parsed body, parsed from the Flask request on first use if not given
+        @param      flask_request   The Flask request
+        @param      app_config      The Flask app config, defaults to the current app's
+        """
+        self.flask_request = flask_request
+        self._headers = headers
+        self._app_config = app_config
+        self._raw_body = _UNRESOLVED
+        self._body = body
+        self._vault = _UNRESOLVED
+
+
+    @classmethod
+    def for_request(cls, flask_request, app_config) -> "ApiRequest":
+        """
+        @brief      Creates the state of the request being dispatched
+
+        @param      flask_request   The Flask request
+        @param      app_config      The Flask app config
+
+        @return     The ApiRequest
+        """
+        return cls(flask_request=flask_request, app_config=app_config)
+
+
+    @property
+    def headers(self):
+        return self._headers if self._headers is not None else self.flask_request.headers
+
+
+    @property
+    def app_config(self) -> dict:
+        return self._app_config if self._app_config is not None else current_app.config
+
+
+    @property
+    def api_config(self) -> dict:
+        return self.app_config["api_config"]
+
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+
+    def __iter__(self):
+        return iter((self.headers, self.body, self.flask_request))
+
+
+    def __len__(self):
+        return len(self._fields)
+
+
+    def __eq__(self, other):
+        if isinstance(other, ApiRequest):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return f"ApiRequest(headers={self.headers!r}, body={self.body!r}, flask_request={self.flask_request!r})"
+
+
+    def _asdict(self) -> dict:
+        return dict(zip(self._fields, self))
+
+
+    def _replace(self, **kwargs) -> "ApiRequest":
+        unknown = set(kwargs).difference(self._fields)
+        if unknown:
+            raise ValueError(f"Got unexpected field names: {sorted(unknown)}")
+
+        fields = {"headers": self._headers, "body": self._body, "flask_request": self.flask_request}
+        fields.update(kwargs)
+        return type(self)(app_config=self._app_config, **fields)
+
+
+    @property
+    def raw_body(self) -> bytes:
+        """
+        The raw request body, decompressed if it was sent with a Content-Encoding.  Werkzeug caches the body as it
+        was received on the request, so the bytes authentication already read (and verified) are reused.
+        """
+        if self._raw_body is _UNRESOLVED:
+            self._check_body_size()
+            data = self.flask_request.get_data(cache=True)
+            if self.flask_request.content_encoding:
+                settings = self.app_config.get("compression")
+                max_size = settings.max_request_size if settings is not None else \
+                    self.flask_request.max_content_length
+                data = compression.decode_body(data, self.flask_request.content_encoding, max_size)
+            self._raw_body = data
+        return self._raw_body
+
+
+    @property
+    def body(self):
+        """
+        The parsed JSON body, or None if the request isn't JSON.  Parsed on first access, from the cached raw body.
+        """
+        if self._body is _UNRESOLVED:
+            if self.flask_request.is_json and self.flask_request.content_encoding:
+                try:
+                    self._body = codec.get_codec().loads(self.raw_body)
+                except ValueError as e:
+                    abort(400, f"Failed to decode JSON object: {e}")
+            elif self.flask_request.is_json:
+                self._check_body_size()
+                self._body = self.flask_request.get_json(cache=True)
+            else:
+                # Newer Flask versions raise a 415 from get_json() when the body isn't JSON, rather than returning None
+                self._body = None
+        return self._body
+
+
+    def _check_body_size(self):
+        """
+        Rejects a declared oversized body before it is read, Werkzeug's limited input stream catches the rest
+        """
+        max_size = self.flask_request.max_content_length
+        if max_size is not None and (self.flask_request.content_length or 0) > max_size:
+            abort(413, f"The request body is larger than the maximum of {max_size} bytes")
+
+
+    @property
+    def time_remaining(self) -> float or None:
+        """
+        Seconds left before the request's deadline (see rapidrest.deadlines), None if it has none
+        """
+        return deadlines.remaining()
+
+
+    @property
+    def vault(self):
+        """
+        The Vault access layer, resolved on first use so handlers that never touch Vault don't pay for it
+        """
+        if self._vault is _UNRESOLVED:
+            self._vault = self.app_config["vault_fetcher"]()
+        return self._vault
+
+
+    @vault.setter
+    def vault(self, vault):
+        self._vault = vault
+
+
+_DEFAULT_CACHE_POLICY = http_caching.CachePolicy({})
+
+# Request state lives here rather than on the resource, so a resource instance can serve concurrent requests
+_CURRENT_REQUEST = ContextVar("rapidrest_current_request", default=None)
+
 
 class ApiResource(MethodView):
     """
     @brief      Class for api resource.
+
+    Setting `init_every_request = False` on a resource (or `routing.singleton_resources` in the API config for all
+    of them) creates a single instance per worker instead of one per request.  Such resources must keep any
+    per-request state in `self._current_request`, not in instance attributes.
+
+    Setting `response_cache_ttl` caches the resource's GET responses server-side for that many seconds (see
+    rapidrest.response_cache), setting `coalesce_requests` lets identical concurrent GETs share one handler call
+    (see rapidrest.coalescing).
+
+    Handlers of long-running requests can return `self._start_job(func, ...)`, which runs `func` in the job pool
+    named by `job_executor` ("thread" or "process") and returns a 202 pointing at the job (see rapidrest.jobs).
     """
+    response_cache_ttl = None
+    response_cache_per_principal = True
+    coalesce_requests = False
+    coalesce_per_principal = True
+    job_executor = "thread"
+
+    @property
+    def _current_request(self) -> ApiRequest:
+        return _CURRENT_REQUEST.get()
+
+
+    @_current_request.setter
+    def _current_request(self, api_request:ApiRequest):
+        # Set for the current context only, like the request state dispatch sets
+        _CURRENT_REQUEST.set(api_request)
+
+
+    @property
+    def _api_config(self) -> dict:
+        return _CURRENT_REQUEST.get().api_config
+
+
+    @property
+    def _vault(self):
+        return _CURRENT_REQUEST.get().vault
+
+
+    @_vault.setter
+    def _vault(self, vault):
+        api_request = _CURRENT_REQUEST.get()
+        # Outside a request (e.g. a subclass' __init__) there is nothing to set it on
+        if api_request is not None:
+            api_request.vault = vault
+
+
+    def _start_job(self, func, *args, **kwargs) -> ApiResponse:
+        """
+        Runs `func(*args, **kwargs)` as an asynchronous job
+
+        @param      func    The callable doing the work, which must be picklable with a "process" job_executor
+        @param      args    Its arguments
+        @param      kwargs  Its keyword arguments
+
+        @return     The 202 ApiResponse pointing at the job
+        """
+        manager = current_app.config.get("jobs")
+        if manager is None:
+            abort(500, "Asynchronous jobs are not enabled")
+        return manager.start(type(self), func, *args, **kwargs)
+
+
+    def get_etag(self, **kwargs) -> str or None:
+        """
+        Override to provide a strong ETag for GET responses without building them (e.g. from a row version).  When
+        it matches the client's If-None-Match, a 304 is returned and `get` is not called.
 
-    def __init__(self, *args, **kwargs):
-        self._current_request = None
-        self._vault = None
-        self._api_config = None
+        @param      kwargs  The arguments `get` will be called with
 
-        super().__init__(*args, **kwargs)
+        @return     The (unquoted) ETag, or None to compute it from the serialized body
+        """
+        return None
+
+
+    def get_last_modified(self, **kwargs) -> datetime or None:
+        """
+        Override to provide when the resource last changed, checked against If-Modified-Since like `get_etag`
+
+        @param      kwargs  The arguments `get` will be called with
+
+        @return     An aware datetime, or None
+        """
+        return None
 
 
     def dispatch_request(self, *args, **kwargs):
@@ -34,26 +285,297 @@ class ApiResource(MethodView):
 
         @return     { description_of_the_return_value }
         """
-        # Tie in authentication and authorization
-        if not authentication.authenticate_endpoint(current_app, request):
-            abort(403, "Authentication Failed")
+        handler = self._handler()
+        # Under the ASGI adapter, `async def` handlers are awaited on the event loop (see rapidrest.asgi)
+        if inspect.iscoroutinefunction(handler) and asgi.on_event_loop(request):
+            return self._dispatch_async(handler, kwargs)
+
+        deadline_token = deadlines.start(current_app, request)
+        try:
+            deadlines.check(deadlines.AUTHENTICATION)
+            # Tie in authentication and authorization
+            if not authentication.authenticate_endpoint(current_app, request):
+                abort(403, "Authentication Failed")
+
+            dispatch = _Dispatch(self, kwargs)
+            admitted = admission.admit(current_app, request)
+            token = _CURRENT_REQUEST.set(ApiRequest.for_request(request, current_app.config))
+            try:
+                resp = dispatch.early_response()
+                if resp is not None:
+                    return resp
+
+                resp = dispatch.cached_response()
+                flight = dispatch.waiting_flight()
+                if flight is not None:
+                    resp = dispatch.followed(flight.wait(dispatch.wait_timeout()))
+                if resp is None:
+                    deadlines.check(deadlines.HANDLER)
+                    if inspect.iscoroutinefunction(handler):
+                        # No event loop to share under a WSGI server, the handler gets one of its own
+                        resp = dispatch.handled(asyncio.run(handler(**kwargs)))
+                    else:
+                        resp = dispatch.handled(handler(**kwargs))
+
+                return dispatch.finish(resp)
+            finally:
+                _CURRENT_REQUEST.reset(token)
+                dispatch.land()
+                if admitted is not None:
+                    admitted.release()
+        finally:
+            deadlines.reset(deadline_token)
+
+
+    async def _dispatch_async(self, handler, kwargs:dict):
+        """
+        @brief      Dispatches a request to an `async def` handler, on the event loop
 
-        self._current_request = ApiRequest(body=request.get_json(), headers=request.headers, flask_request=request)
-        self._vault = current_app.config["vault_fetcher"]()
-        self._api_config = current_app.config["api_config"]
+        @param      handler The handler
+        @param      kwargs  The kwargs
+
+        @return     The response
+        """
+        deadline_token = deadlines.start(current_app, request)
+        try:
+            deadlines.check(deadlines.AUTHENTICATION)
+            # Authentication may have to ask Vault, which would block the loop
+            authenticated = await asgi.run_blocking(authentication.authenticate_endpoint,
+                                                    current_app._get_current_object(), request._get_current_object())
+            if not authenticated:
+                abort(403, "Authentication Failed")
 
-        resp = super().dispatch_request(*args, **kwargs)
+            dispatch = _Dispatch(self, kwargs)
+            admitted = admission.admit(current_app, request)
+            token = _CURRENT_REQUEST.set(ApiRequest.for_request(request, current_app.config))
+            try:
+                resp = dispatch.early_response()
+                if resp is not None:
+                    return resp
+
+                resp = dispatch.cached_response()
+                flight = dispatch.waiting_flight()
+                if flight is not None:
+                    resp = dispatch.followed(await asgi.run_blocking(flight.wait, dispatch.wait_timeout()))
+                if resp is None:
+                    deadlines.check(deadlines.HANDLER)
+                    resp = dispatch.handled(await handler(**kwargs))
+
+                return dispatch.finish(resp)
+            finally:
+                _CURRENT_REQUEST.reset(token)
+                dispatch.land()
+                if admitted is not None:
+                    admitted.release()
+        finally:
+            deadlines.reset(deadline_token)
+
+
+    def _handler(self):
+        """
+        @brief      Gets the method handling the current request, like MethodView does
+
+        @return     The bound handler
+        """
+        handler = getattr(self, request.method.lower(), None)
+        # If the request method is HEAD and we don't have a handler for it retry with GET
+        if handler is None and request.method == "HEAD":
+            handler = getattr(self, "get", None)
+
+        assert handler is not None, f"Unimplemented method {request.method!r}"
+        return handler
+
+
+    @staticmethod
+    def _conditional_response(response:Response, cache_cfg, etag:str=None, last_modified:datetime=None,
+                              hash_body:bool=True) -> Response:
+        """
+        Adds validators and Cache-Control to a successful GET response, and turns it into a 304 if the client's
+        copy is current
+
+        @param      response        The response
+        @param      cache_cfg       The endpoint's caching config
+        @param      etag            The ETag from `get_etag`, computed from the body if None and the response has none
+        @param      last_modified   The time from `get_last_modified`
+        @param      hash_body       Whether the ETag may be computed from the body
+
+        @return     The response
+        """
+        if etag is None and hash_body and cache_cfg["etag"] and "ETag" not in response.headers and \
+                not response.is_streamed and not response.direct_passthrough:
+            etag = http_caching.body_etag(response.get_data())
+
+        http_caching.apply_headers(response, cache_cfg, etag, last_modified)
+        if http_caching.not_modified(request, response.get_etag()[0], last_modified):
+            return http_caching.not_modified_response(response)
+
+        return response
+
+
+class _Dispatch:
+    """
+    @brief      The steps of dispatching a request around the handler call, shared by sync and async handlers
+    """
+    __slots__ = ("resource", "kwargs", "cache_cfg", "validators", "resp_cache", "cache_settings", "cache_key",
+                 "single_flight", "flight_key", "flight", "leading")
+
+    def __init__(self, resource:ApiResource, kwargs:dict):
+        self.resource = resource
+        self.kwargs = kwargs
+        self.validators = (None, None)
+        self.cache_cfg = None
+        if request.method in http_caching.CONDITIONAL_METHODS:
+            self.cache_cfg = current_app.config.get("cache_policy", _DEFAULT_CACHE_POLICY).lookup(request.url_rule,
+                                                                                               request.method)
+
+        self.resp_cache = current_app.config.get("response_cache")
+        self.cache_settings = self.cache_key = None
+        if self.cache_cfg is not None and self.resp_cache is not None:
+            self.cache_settings = self.resp_cache.settings(type(resource), request.url_rule)
+            if self.cache_settings is not None:
+                self.cache_key = self.resp_cache.key(request, per_principal=self.cache_settings[1])
+
+        self.single_flight = current_app.config.get("single_flight")
+        self.flight_key = self.flight = None
+        self.leading = False
+        if self.single_flight is not None and request.method in coalescing.COALESCED_METHODS:
+            coalesce_settings = self.single_flight.settings(type(resource), request.url_rule)
+            if coalesce_settings is not None:
+                self.flight_key = response_cache.request_key(request, per_principal=coalesce_settings[1])
+
+
+    def early_response(self) -> Response or None:
+        """
+        @brief      Asks the resource's validator hooks whether the client's copy is current
 
+        @return     The final (304) response, or None to call the handler
+        """
+        if self.cache_cfg is not None:
+            self.validators = http_caching.resource_validators(self.resource, self.kwargs)
+            if http_caching.not_modified(request, *self.validators):
+                return self.resource._conditional_response(current_app.response_class(), self.cache_cfg,
+                                                           *self.validators, hash_body=False)
+        return None
+
+
+    def cached_response(self) -> Response or None:
+        """
+        @brief      Gets the response from the response cache, on a miss joins the flight of identical requests
+
+        @return     The response, or None to call the handler
+        """
+        resp = None
+        if self.cache_key is not None:
+            resp = self.resp_cache.get(self.cache_key)
+            if resp is not None:
+                self.cache_key = None
+
+        if resp is None and self.flight_key is not None:
+            self.flight, self.leading = self.single_flight.join(self.flight_key)
+        return resp
+
+
+    def waiting_flight(self):
+        """
+        @brief      Gets the flight this request has to wait on
+
+        @return     The flight, or None if the request runs the handler
+        """
+        return self.flight if self.flight is not None and not self.leading else None
+
+
+    def followed(self, shared) -> Response or None:
+        """
+        @brief      Takes what the flight's leader produced
+
+        @param      shared  What the wait returned
+
+        @return     The response, or None to call the handler
+        """
+        resp = self.single_flight.followed(self.flight, shared)
+        if resp is not None:
+            # The leader stores its response in the response cache
+            self.cache_key = None
+        return resp
+
+
+    def wait_timeout(self) -> float:
+        """
+        @brief      Gets how long to wait on the flight's leader, no longer than the request's deadline allows
+
+        @return     Seconds
+        """
+        remaining = deadlines.remaining()
+        return self.single_flight.timeout if remaining is None else min(self.single_flight.timeout, remaining)
+
+
+    def land(self, resp:Response=None):
+        """
+        @brief      Releases the requests waiting on this one, if it leads a flight
+
+        @param      resp    The response, None if there is none to share
+        """
+        if self.leading:
+            self.leading = False
+            self.single_flight.land(self.flight_key, self.flight, resp)
+
+
+    @staticmethod
+    def handled(resp):
+        """
+        @brief      Takes what the handler returned, must be called while the request state is set
+
+        @param      resp    The handler's return value
+
+        @return     The handler's return value
+        """
+        # Streamed items are produced after the handler returns, they need the request state captured now
+        if isinstance(resp, ApiResponse) and streaming.is_stream(resp.body):
+            resp = resp._replace(body=streaming.StreamedItems(resp.body))
+        return resp
+
+
+    def finish(self, resp) -> Response:
+        """
+        @brief      Builds the response, and applies the caching rules to it
+
+        @param      resp    The handler's (or the response cache's) response
+
+        @return     The response
+        """
         if isinstance(resp, Response):
-            return resp
+            actual_resp = resp
 
         elif isinstance(resp, ApiResponse):
-            body = jsonify(resp.body) if isinstance(resp.body, dict) else resp.body
+            deadlines.check(deadlines.SERIALIZATION)
+            if isinstance(resp.body, streaming.StreamedItems):
+                mimetype = streaming.negotiate_mimetype(request)
+                chunks = streaming.stream_items(resp.body, codec.get_codec(),
+                                                ndjson=mimetype == streaming.NDJSON_MIMETYPE)
+                actual_resp:Response = current_app.response_class(streaming.stream_body(chunks),
+                                                                  status=resp.status_code, mimetype=mimetype)
+                actual_resp.vary.add("Accept")
+            else:
+                body = codec.get_codec().dumps(resp.body) if isinstance(resp.body, (dict, list)) else resp.body
 
-            actual_resp:Response = make_response((body, resp.status_code))
-            actual_resp.headers["Content-Type"] = "application/json"
+                actual_resp:Response = make_response((body, resp.status_code))
+                actual_resp.headers["Content-Type"] = "application/json"
             actual_resp.headers.extend(resp.headers)
 
-            return actual_resp
+        else:
+            abort(500, "API resource did not return a known response type")
+
+        if self.resp_cache is not None and request.method in response_cache.WRITE_METHODS and \
+                200 <= actual_resp.status_code < 300:
+            self.resp_cache.invalidate(request.url_rule.endpoint)
+
+        if self.cache_cfg is not None and actual_resp.status_code == 200:
+            conditional_resp = self.resource._conditional_response(actual_resp, self.cache_cfg, *self.validators)
+            # Stored (and shared) with the validators set, so cache hits don't hash the body again
+            if self.cache_key is not None:
+                self.resp_cache.put(self.cache_key, actual_resp, self.cache_settings[0])
+            self.land(actual_resp)
+            return conditional_resp
 
-        abort(500, "API resource did not return a known response type")
+        self.land(actual_resp)
+        return actual_resp
@@ -8,10 +8,11 @@ import importlib
 import logging
 import os
 import yaml
-from functools import partial
 from logging.config import dictConfig
 
 from rapidrest import utils, routebuilder, errorhandlers, integrations, vault_integration
+from rapidrest import asgi, batch, codec, compression, jobs, manifest, startup_trace
+from rapidrest.security import keycache, replay, tokens
 
 def _init_logging(level:str="DEBUG", log_format:str="%(asctime)s - %(name)s - %(levelname)s - %(message)s"):
     """
@@ -79,11 +80,14 @@ def start(*_):
     
     @return     WSGI application
     """
+    tracer = startup_trace.from_environment()
+
     api_root = os.environ.get("API_ROOT", None)
     if os.environ.get("API_ROOT", None) is None:
         # We set the environment in this case for the tests
         api_root = os.environ["API_ROOT"] = "rapidrest_dummyapi.v1"
-    api_cfg = load_api_config(api_root)
+    with tracer.phase("load_api_config"):
+        api_cfg = load_api_config(api_root)
     if not api_cfg:
         exit(3)
 
@@ -94,24 +98,76 @@ def start(*_):
     app = flask.Flask(api_cfg["api_name"])
     app.logger.name = api_root
     errorhandlers.register_handlers(app)
+    try:
+        codec.install(app, codec.from_api_config(api_cfg))
+    except codec.CodecError as e:
+        app.logger.error("Invalid JSON configuration: %s", e)
+        exit(3)
+    try:
+        compression.install(app, compression.from_api_config(api_cfg))
+    except compression.CompressionError as e:
+        app.logger.error("Invalid compression configuration: %s", e)
+        exit(3)
 
     app.config["api_config"] = api_cfg
-    app.config["vault_fetcher"] = partial(vault_integration.load_vault, app)
+    app.config["startup_tracer"] = tracer
+    # Enforced by Werkzeug on every read of the body, including authentication's
+    app.config["MAX_CONTENT_LENGTH"] = api_cfg.get("requests", {}).get("max_body_size")
+    app.config["vault_fetcher"] = vault_integration.VaultHandle(app).get
+    with tracer.phase("security"):
+        app.config["key_cache"] = keycache.from_api_config(api_cfg, app.config["vault_fetcher"])
+        app.config["replay_cache"] = replay.from_api_config(api_cfg)
+        app.config["token_issuer"] = tokens.from_api_config(api_cfg, app.config["vault_fetcher"])
+
+    app.config["batch"] = batch.from_api_config(api_cfg)
+    app.config["jobs"] = jobs.from_api_config(api_cfg)
 
     # Load the API before we load secrets, so we know what the API needs
     integration_modules = list()
     try:
-        integration_modules = routebuilder.load_api(app, api_root)
+        with tracer.phase("load_api"):
+            route_manifest = manifest.load_fresh_manifest(api_root, api_cfg)
+            if route_manifest is not None:
+                integration_modules = routebuilder.load_api_from_manifest(app, route_manifest)
+            else:
+                integration_modules = routebuilder.load_api(app, api_root)
     except routebuilder.RouteBuilderError as e:
         app.logger.error("Failed to load API: %s", e)
         exit(2)
 
-    ints_loaded = integrations.initialize_api_integrations(
-        integration_modules,
-        app.config["api_config"],
-        app.config["vault_fetcher"]()
-    )
+    with tracer.phase("vault"):
+        vault = app.config["vault_fetcher"]()
+
+    with tracer.phase("integrations"):
+        ints_loaded = integrations.initialize_api_integrations(
+            integration_modules,
+            app.config["api_config"],
+            vault,
+            tracer=tracer
+        )
     if not ints_loaded:
         exit(4)
 
+    app.config["secrets_refresher"] = vault_integration.start_secrets_refresher(
+        app,
+        on_refresh=lambda _: integrations.notify_secrets_refreshed(
+            integration_modules, app.config["api_config"], app.config["vault_fetcher"]()),
+        reloaders=[lambda: tokens.reload_keys(
+            app.config["token_issuer"], app.config["api_config"], app.config["vault_fetcher"]())],
+    )
+
+    if not startup_trace.finish(tracer, api_cfg):
+        exit(5)
+
     return app
+
+
+def start_asgi():
+    """
+    @brief      Entry point for an ASGI server like uvicorn, which lets `async def` handlers share its event loop (see
+                rapidrest.asgi)
+
+    @return     ASGI application
+    """
+    app = start()
+    return asgi.from_api_config(app, app.config["api_config"])
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI adapter for RapidRest applications, so handlers that mostly wait on I/O can be written as `async def` and share
+one event loop instead of each holding a worker thread.  Created by `application.start_asgi`, e.g.:
+
+    uvicorn --factory rapidrest.application:start_asgi
+
+Requests for `async def` handlers are dispatched on the server's event loop: the handler is awaited there, and the
+response is built and serialized there.  Authentication runs in a worker thread, as it may have to ask Vault.
+Requests for regular handlers are dispatched in a worker thread, as under a WSGI server, so an API can mix both.
+Streamed bodies are iterated in worker threads too.  Configured in `api_config.yml`:
+
+    asgi:
+      max_threads: 32   # Worker threads for regular handlers, authentication and streamed bodies
+
+Under a WSGI server `async def` handlers still work, each one runs on an event loop of its own.
+
+"""
+import asyncio
+import contextvars
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+from flask.signals import request_started
+
+DEFAULT_MAX_THREADS = 32
+ENVIRON_KEY = "rapidrest.asgi"
+EVENT_LOOP_KEY = "rapidrest.asgi.event_loop"
+# When the request was received, as unix epoch seconds (see rapidrest.admission)
+RECEIVED_AT_KEY = "rapidrest.received_at"
+
+
+def on_event_loop(request:flask.Request) -> bool:
+    """
+    Checks whether a request is being dispatched on the ASGI adapter's event loop
+
+    :param request: The current request
+
+    :return: True if its handler may be awaited
+    """
+    return request.environ.get(EVENT_LOOP_KEY, False)
+
+
+async def run_blocking(func, *args):
+    """
+    Runs a blocking call in one of the adapter's worker threads, with the caller's context (Flask's request and
+    application contexts included)
+
+    :param func: The callable
+    :param args: Its arguments
+
+    :return: What it returned
+    """
+    executor = flask.request.environ[ENVIRON_KEY].executor if flask.has_request_context() else None
+    return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+
+def build_environ(scope:dict, body:bytes) -> dict:
+    """
+    Creates the WSGI environment of an ASGI HTTP request
+
+    :param scope: The ASGI connection scope
+    :param body: The request body
+
+    :return: The WSGI environment
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        RECEIVED_AT_KEY: time.time(),
+    }
+
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        if name == "content-length":
+            # The body has already been read, its actual length is what Werkzeug needs to check
+            continue
+        elif name == "content-type":
+            environ["CONTENT_TYPE"] = value
+            continue
+
+        key = f"HTTP_{name.upper().replace('-', '_')}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+class AsgiApplication:
+    """
+    ASGI application serving a RapidRest (Flask) application
+    """
+
+    def __init__(self, app:flask.Flask, max_threads:int=DEFAULT_MAX_THREADS):
+        """
+        :param app: The application
+        :param max_threads: Worker threads for blocking work
+        """
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="rapidrest-asgi")
+
+
+    async def __call__(self, scope:dict, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1003})
+
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+    async def _read_body(self, receive) -> bytes or None:
+        """
+        Reads the request body, stopping once it is over the application's size limit (Werkzeug rejects it)
+
+        :return: The body, or None if the client disconnected
+        """
+        max_size = self.app.config.get("MAX_CONTENT_LENGTH")
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+
+            body += message.get("body", b"")
+            if not message.get("more_body", False) or (max_size is not None and len(body) > max_size):
+                return bytes(body)
+
+
+    async def _http(self, scope:dict, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        environ = build_environ(scope, body)
+        environ[ENVIRON_KEY] = self
+        started = []
+
+        def _start_response(status:str, headers:list, exc_info=None):
+            started[:] = [status, headers]
+
+        app_iter, streamed = await self._call_app(environ, _start_response)
+        status, headers = started
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        })
+
+        # Every step of a streamed body runs in the same context, stream_with_context pushes the request context in
+        # one step and pops it in another
+        stream_context = contextvars.copy_context()
+        try:
+            if streamed:
+                chunks = iter(app_iter)
+                while True:
+                    chunk = await self._run(next, chunks, None, context=stream_context)
+                    if chunk is None:
+                        break
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            else:
+                for chunk in app_iter:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(app_iter, "close"):
+                await self._run(app_iter.close, context=stream_context)
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+    async def _run(self, func, *args, context:contextvars.Context=None):
+        """
+        Runs a blocking call in a worker thread, in a copy of the current context unless given one
+        """
+        context = context or contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+
+
+    async def _call_app(self, environ:dict, start_response) -> tuple:
+        """
+        Flask's `wsgi_app`, dispatching on the event loop when the route's handler is `async def`
+
+        :return: (WSGI app iterable, whether the body is streamed)
+        """
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                request = ctx.request
+                rule = request.url_rule
+                if rule is not None and (rule.endpoint, request.method) in app.config.get("async_routes", ()):
+                    environ[EVENT_LOOP_KEY] = True
+                    response = await self._full_dispatch_request()
+                else:
+                    response = await self._run(app.full_dispatch_request)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            return response(environ, start_response), response.is_streamed
+        finally:
+            if error is not None and app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+
+
+    async def _full_dispatch_request(self) -> flask.Response:
+        """
+        Flask's `full_dispatch_request`, awaiting the view if it returns an awaitable
+        """
+        app = self.app
+        app._got_first_request = True
+        try:
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = app.dispatch_request()
+                if asyncio.iscoroutine(rv):
+                    rv = await rv
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+
+
+def from_api_config(app:flask.Flask, api_config:dict) -> AsgiApplication:
+    """
+    Creates the ASGI application described by the API config
+
+    :param app: The application
+    :param api_config: The API configuration dictionary
+
+    :return: The ASGI application
+    """
+    asgi_cfg = api_config.get("asgi") or {}
+    return AsgiApplication(app, max_threads=asgi_cfg.get("max_threads", DEFAULT_MAX_THREADS))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Batch endpoint, which runs many sub-requests in one round trip.
+
+A client POSTs a list of sub-requests to `/_batch`:
+
+    [
+      {"method": "GET", "path": "/v1/pants/1"},
+      {"method": "POST", "path": "/v1/pants", "body": {"size": 32}}
+    ]
+
+The batch request is authenticated once, then every sub-request is dispatched in-process through the URL map and its
+resource, as if it had been sent on its own by the batch's principal: each one is still subject to its endpoint's
+security config (so whitelisting applies), without being signed itself.  Results are streamed back in request order
+as `{"status": <code>, "headers": {...}, "body": <JSON or text>}` items, in a JSON array (or NDJSON, see
+rapidrest.streaming).  Configured in `api_config.yml`:
+
+    batch:
+      enabled: true
+      max_items: 50     # Larger batches are rejected with a 413
+      max_workers: 4    # Sub-requests dispatched in parallel (across all batches of a worker), 1 to run them in order
+
+"""
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+from werkzeug.test import EnvironBuilder
+
+from rapidrest import codec
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.security import authentication
+
+_LOGGER = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/_batch"
+DEFAULT_MAX_ITEMS = 50
+DEFAULT_MAX_WORKERS = 4
+BATCH_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE"))
+
+
+class BatchSettings:
+    """
+    Batch endpoint settings, and the thread pool its sub-requests run on
+    """
+
+    def __init__(self, max_items:int=DEFAULT_MAX_ITEMS, max_workers:int=DEFAULT_MAX_WORKERS):
+        """
+        :param max_items: Most sub-requests accepted in one batch
+        :param max_workers: Sub-requests dispatched in parallel, 1 dispatches them in order on the batch's thread
+        """
+        self.max_items = max_items
+        self.executor = None
+        if max_workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rapidrest-batch")
+
+
+def _item_error(status:int, detail:str) -> dict:
+    return {"status": status, "headers": {}, "body": {"err": True, "err_type": "Client", "err_detail": detail}}
+
+
+def _dispatch_item(app:flask.Flask, item, base_url:str, principal) -> dict:
+    """
+    Dispatches a sub-request like a request of its own
+
+    :param app: The application
+    :param item: The sub-request
+    :param base_url: The batch request's base URL
+    :param principal: The batch request's principal, None if it wasn't authenticated
+
+    :return: The sub-request's result
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("path"), str) or not item["path"].startswith("/"):
+        return _item_error(400, "A sub-request needs a 'method' and an absolute 'path'")
+
+    method = str(item.get("method", "GET")).upper()
+    if method not in BATCH_METHODS:
+        return _item_error(400, f"Sub-requests can't use the {method} method")
+    if item["path"].split("?", 1)[0].rstrip("/") == BATCH_ENDPOINT:
+        return _item_error(400, "Batches can't be nested")
+
+    overrides = {authentication.DELEGATED_PRINCIPAL_KEY: principal} if principal is not None else {}
+    builder = EnvironBuilder(path=item["path"], base_url=base_url, method=method, json=item.get("body"),
+                             environ_overrides=overrides)
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    with app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            response = app.handle_exception(e)
+
+        data = response.get_data()
+        response.close()
+
+    if response.is_json and data:
+        body = codec.get_codec().loads(data)
+    else:
+        body = data.decode("utf-8", errors="replace")
+
+    headers = {name: value for name, value in response.headers.items() if name not in ("Content-Length",)}
+    return {"status": response.status_code, "headers": headers, "body": body}
+
+
+def _results(app:flask.Flask, settings:BatchSettings, items:list, base_url:str, principal):
+    """
+    Dispatches the sub-requests, yielding their results in request order
+    """
+    if settings.executor is None:
+        for item in items:
+            yield _dispatch_item(app, item, base_url, principal)
+        return
+
+    # Each sub-request runs in a copy of this context, so it shares the batch's application context
+    futures = [settings.executor.submit(contextvars.copy_context().run, _dispatch_item, app, item, base_url, principal)
+               for item in items]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class Batch(ApiResource):
+    """
+    Runs a list of sub-requests
+    """
+    endpoint_name = "_batch"
+    description = "Batch endpoint"
+
+    def post(self):
+        """
+        Dispatches the sub-requests in the body
+
+        :return: ApiResponse streaming the sub-request results
+        """
+        settings = flask.current_app.config["batch"]
+        items = self._current_request.body
+        if not isinstance(items, list):
+            flask.abort(400, "The batch body must be a JSON list of sub-requests")
+        if len(items) > settings.max_items:
+            flask.abort(413, f"Batches are limited to {settings.max_items} sub-requests")
+
+        principal = flask.g.get("principal")
+        results = _results(flask.current_app._get_current_object(), settings, items, flask.request.host_url,
+                           principal)
+        return ApiResponse(body=results, status_code=200)
+
+
+def from_api_config(api_config:dict) -> BatchSettings or None:
+    """
+    Creates the batch settings described by the API config
+
+    :param api_config: The API configuration dictionary
+
+    :return: The batch settings, or None if the batch endpoint is not enabled
+    """
+    batch_cfg = api_config.get("batch") or {}
+    if not batch_cfg.get("enabled", False):
+        return None
+
+    _LOGGER.info("Batch endpoint enabled at %s", BATCH_ENDPOINT)
+    return BatchSettings(
+        max_items=batch_cfg.get("max_items", DEFAULT_MAX_ITEMS),
+        max_workers=batch_cfg.get("max_workers", DEFAULT_MAX_WORKERS),
+    )
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Small in-process caches used throughout RapidRest
+
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LruTtlCache:
+    """
+    Thread-safe LRU cache where every entry also expires after a TTL.  Expired entries are dropped when they are next
+    touched, and the least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, max_entries:int=1024, ttl:float=300.0, clock=time.monotonic, max_bytes:int=None,
+                 sizeof=None):
+        """
+        :param max_entries: Maximum number of entries held before LRU eviction kicks in
+        :param ttl: Default time-to-live of an entry, in seconds
+        :param clock: Monotonic clock used for expiry (overridable for tests)
+        :param max_bytes: Maximum total size of the values held, None for no limit
+        :param sizeof: Callable returning a value's size in bytes, required with `max_bytes`
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("max_bytes requires a sizeof callable")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key, default=None):
+        """
+        Gets an entry, refreshing its LRU position
+
+        :param key: The cache key
+        :param default: Returned if the key is missing or expired
+
+        :return: The cached value or `default`
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value, size = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def put(self, key, value, ttl:float=None):
+        """
+        Adds or replaces an entry, evicting the least recently used entry if the cache is full
+
+        :param key: The cache key
+        :param value: The value to store
+        :param ttl: Overrides the default TTL for this entry
+        """
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        size = self._sizeof(value) if self._sizeof is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            self.evict(key)
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, _MISSING)
+            if previous is not _MISSING:
+                self._bytes -= previous[2]
+            self._entries[key] = (expires_at, value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+
+    def evict(self, key) -> bool:
+        """
+        Explicitly removes an entry
+
+        :param key: The cache key
+
+        :return: True if there was an entry to remove
+        """
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            if entry is _MISSING:
+                return False
+            self._bytes -= entry[2]
+            return True
+
+
+    def clear(self):
+        """
+        Removes all entries (counters are left alone)
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+    def stats(self) -> dict:
+        """
+        Gets the cache counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            return entry is not _MISSING and entry[0] > self._clock()
+
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight coalescing of identical concurrent GET requests.
+
+When many identical requests arrive at once (a cache miss on a hot resource, or the thundering herd after a deploy),
+only the first one runs the handler; the others wait for its response and are sent a copy.  A duplicate that waits
+longer than the timeout, or whose first request fails or produces a response that can't be shared (anything but a 2xx,
+a streamed one, or one that sets a cookie), runs the handler itself.
+
+A resource opts in with a `coalesce_requests` class attribute, or per endpoint in `api_config.yml`, which takes
+precedence:
+
+    coalescing:
+      timeout: 10                 # Seconds a duplicate waits for the first request
+      endpoint_control:
+        "/v1/pants":
+          GET:
+            enabled: true
+            per_principal: true   # Only coalesce requests from the same principal
+
+Requests are identified like they are by the response cache (rapidrest.response_cache): URL rule, its arguments, the
+query string and the principal.  Authentication and the `get_etag`/`get_last_modified` hooks still run for every
+request.  Coalescing is per worker.
+
+"""
+import logging
+import threading
+from types import MappingProxyType
+
+import flask
+
+from rapidrest.exceptions import RapidRestError
+from rapidrest.response_cache import CachedResponse
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+COALESCED_METHODS = frozenset(("GET", "HEAD"))
+
+
+class CoalescingError(RapidRestError): pass
+
+
+def is_shareable(response:flask.Response) -> bool:
+    """
+    Checks whether a response can be copied to the requests that waited for it
+
+    :param response: The response
+
+    :return: True if it can be shared
+    """
+    # Errors and 304s depend on the request that got them, they may not be what a duplicate would get
+    return 200 <= response.status_code < 300 and not response.is_streamed and not response.direct_passthrough and \
+        "Set-Cookie" not in response.headers
+
+
+class Flight:
+    """
+    A request in progress, that identical requests can wait on
+    """
+    __slots__ = ("_landed", "response")
+
+    def __init__(self):
+        self._landed = threading.Event()
+        self.response = None
+
+
+    def wait(self, timeout:float) -> CachedResponse or None:
+        """
+        Waits for the first request's response
+
+        :param timeout: Seconds to wait
+
+        :return: A copy of the response, or None if there is nothing to share (yet)
+        """
+        self._landed.wait(timeout)
+        return self.response
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests, for the endpoints that opt in
+    """
+
+    def __init__(self, table:dict, timeout:float=DEFAULT_TIMEOUT):
+        """
+        :param table: Mapping of (endpoint, rule) to the endpoint's (enabled, per_principal) settings
+        :param timeout: Seconds a duplicate request waits for the first one
+        """
+        self._table = MappingProxyType(table)
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+
+
+    def settings(self, resource_class, url_rule) -> tuple or None:
+        """
+        Gets how an endpoint's requests are coalesced
+
+        :param resource_class: The ApiResource subclass serving the endpoint
+        :param url_rule: The matched werkzeug.routing.Rule
+
+        :return: (enabled, per_principal), or None if the endpoint's requests aren't coalesced
+        """
+        settings = self._table.get((url_rule.endpoint, url_rule.rule))
+        if settings is None:
+            settings = (resource_class.coalesce_requests, resource_class.coalesce_per_principal)
+
+        return settings if settings[0] else None
+
+
+    def join(self, key:tuple) -> tuple:
+        """
+        Joins the flight for a request, starting it if there is none
+
+        :param key: The request's key
+
+        :return: (flight, True if this request leads it and has to run the handler)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+
+    def land(self, key:tuple, flight:Flight, response:flask.Response=None):
+        """
+        Ends a flight, releasing the requests waiting on it.  Must be called by its leader however the request ends.
+
+        :param key: The request's key
+        :param flight: The flight
+        :param response: The leader's response, None if it failed
+        """
+        if response is not None and is_shareable(response):
+            flight.response = CachedResponse(response.get_data(), response.status_code, list(response.headers))
+
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._landed.set()
+
+
+    def followed(self, flight:Flight, shared:CachedResponse or None) -> flask.Response or None:
+        """
+        Turns what a duplicate request waited for into its response, and counts the outcome
+
+        :param flight: The flight it waited on
+        :param shared: What `Flight.wait` returned
+
+        :return: The response, or None if the request has to run the handler itself
+        """
+        with self._lock:
+            if shared is not None:
+                self.coalesced += 1
+            elif flight._landed.is_set():
+                self.fallbacks += 1
+            else:
+                self.timeouts += 1
+
+        if shared is None:
+            return None
+        return flask.current_app.response_class(shared.body, status=shared.status_code, headers=shared.headers)
+
+
+    def stats(self) -> dict:
+        """
+        Gets the coalescing counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "fallbacks": self.fallbacks,
+            }
+
+
+def from_api_config(api_config:dict, registered_rules:list, log=_LOGGER) -> SingleFlight:
+    """
+    Creates the request coalescer described by the API config, checking its endpoint config against the registered
+    routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The request coalescer
+    """
+    coalescing_cfg = api_config.get("coalescing") or {}
+    endpoint_control = coalescing_cfg.get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise CoalescingError("'coalescing.endpoint_control' must be a mapping of URL rules")
+
+    table = {}
+    for endpoint, url_rule, methods in registered_rules:
+        method_cfg = (endpoint_control.get(url_rule) or {}).get("GET")
+        if method_cfg is None or "GET" not in methods:
+            continue
+        if not isinstance(method_cfg, dict):
+            raise CoalescingError(f"Coalescing config for GET {url_rule} must be a mapping")
+        table[(endpoint, url_rule)] = (method_cfg.get("enabled", True), method_cfg.get("per_principal", True))
+
+    registered = {url_rule for _, url_rule, _ in registered_rules}
+    for url_rule, rule_cfg in endpoint_control.items():
+        if url_rule not in registered:
+            log.warning(f"Coalescing config for '{url_rule}' does not match any registered route")
+        elif set(rule_cfg or ()).difference({"GET"}):
+            log.warning(f"Coalescing config for '{url_rule}' has methods other than GET, which are not coalesced")
+
+    return SingleFlight(table, timeout=coalescing_cfg.get("timeout", DEFAULT_TIMEOUT))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codec used for every response body RapidRest serializes (ApiResponse bodies, error responses, JSON:API responses)
+and, through the Flask JSON provider, for `jsonify` and request parsing too.
+
+Codecs produce UTF-8 bytes directly.  orjson is used when it is installed (`pip install rapid-rest[orjson]`), the
+standard library otherwise; both serialize the types Flask does (dates as HTTP dates, decimals and UUIDs as strings,
+dataclasses as objects) so the output does not depend on the backend.  Configured in `api_config.yml`:
+
+    json:
+      backend: auto         # auto, orjson or stdlib
+      sort_keys: false
+
+"""
+import dataclasses
+import decimal
+import json
+import logging
+import uuid
+from datetime import date
+
+import flask
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+from rapidrest.exceptions import RapidRestError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CodecError(RapidRestError): pass
+
+
+def _default(obj):
+    """
+    Serializes the non-JSON types Flask's own provider supports
+    """
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibJsonCodec:
+    """
+    Codec backed by the standard library's json module
+    """
+    name = "stdlib"
+
+    def __init__(self, sort_keys:bool=False):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys,
+                                         default=_default)
+
+
+    def dumps(self, obj) -> bytes:
+        return self._encoder.encode(obj).encode("utf-8")
+
+
+    def loads(self, data:bytes or str):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """
+    Codec backed by orjson, falls back to the standard library for what orjson refuses (e.g. integers over 64 bits)
+    """
+    name = "orjson"
+
+    def __init__(self, sort_keys:bool=False):
+        # Dates go through _default so they are formatted the same as with the stdlib codec
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if sort_keys:
+            self._options |= orjson.OPT_SORT_KEYS
+        self._fallback = StdlibJsonCodec(sort_keys=sort_keys)
+
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_default, option=self._options)
+        except orjson.JSONEncodeError:
+            return self._fallback.dumps(obj)
+
+
+    def loads(self, data:bytes or str):
+        return orjson.loads(data)
+
+
+def create_codec(backend:str="auto", sort_keys:bool=False):
+    """
+    Creates a codec
+
+    :param backend: "orjson", "stdlib", or "auto" to use orjson when it is installed
+    :param sort_keys: Whether to sort object keys
+
+    :return: The codec
+    """
+    if backend == "auto":
+        backend = "stdlib" if orjson is None else "orjson"
+
+    if backend == "orjson":
+        if orjson is None:
+            raise CodecError("The orjson JSON backend is configured, but orjson is not installed")
+        return OrjsonCodec(sort_keys=sort_keys)
+    elif backend == "stdlib":
+        return StdlibJsonCodec(sort_keys=sort_keys)
+
+    raise CodecError(f"Unknown JSON backend '{backend}', expected 'auto', 'orjson' or 'stdlib'")
+
+
+def from_api_config(api_config:dict):
+    """
+    Creates the codec described by the API config
+
+    :param api_config: The API configuration dictionary
+
+    :return: The codec
+    """
+    json_cfg = api_config.get("json", {})
+    codec = create_codec(json_cfg.get("backend", "auto"), sort_keys=json_cfg.get("sort_keys", False))
+    _LOGGER.info("Using the %s JSON codec", codec.name)
+    return codec
+
+
+DEFAULT_CODEC = create_codec()
+
+
+def get_codec():
+    """
+    Gets the current application's codec
+
+    :return: The codec, or the default one outside of an application or if the application did not install one
+    """
+    if flask.has_app_context():
+        return flask.current_app.config.get("json_codec") or DEFAULT_CODEC
+    return DEFAULT_CODEC
+
+
+def json_response(body, status:int, content_type:str="application/json") -> flask.Response:
+    """
+    Creates a response with a JSON body
+
+    :param body: The object to serialize
+    :param status: The HTTP status code
+    :param content_type: The response content type
+
+    :return: The response
+    """
+    return flask.current_app.response_class(get_codec().dumps(body), status=status, content_type=content_type)
+
+
+class CodecJSONProvider(JSONProvider):
+    """
+    Flask JSON provider that goes through the codec, so `jsonify` and `request.get_json` use it too
+    """
+
+    def __init__(self, app, codec):
+        super().__init__(app)
+        self.codec = codec
+
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self.codec.dumps(obj).decode("utf-8")
+
+
+    def loads(self, s:str or bytes, **kwargs):
+        return self.codec.loads(s)
+
+
+    def response(self, *args, **kwargs) -> flask.Response:
+        return self._app.response_class(self.codec.dumps(self._prepare_response_obj(args, kwargs)),
+                                        mimetype="application/json")
+
+
+def install(app, codec):
+    """
+    Makes a codec the application's JSON codec
+
+    :param app: The application
+    :param codec: The codec
+    """
+    app.config["json_codec"] = codec
+    app.json = CodecJSONProvider(app, codec)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Response compression negotiated from `Accept-Encoding`, and compressed request bodies.
+
+gzip and deflate are always available, zstd and br are offered when `zstandard`/`brotli` are installed
+(`pip install rapid-rest[compression]`).  Responses are compressed once every other part of the request is done, so
+this covers `ApiResponse`s, `JSONAPIResponse`s and error responses alike; streamed bodies are compressed as they are
+written, each chunk flushed so the client still receives items as they are produced.  Configured in `api_config.yml`:
+
+    compression:
+      enabled: true
+      min_size: 1024              # Bodies smaller than this (in bytes) are sent as they are
+      level: 6
+      encodings: [zstd, br, gzip, deflate]    # Preference order when the client accepts several equally
+      max_request_size: 104857600 # Limit on decompressed request bodies, defaults to requests.max_body_size
+      endpoint_control:
+        "/v1/files":
+          GET:
+            compress: false
+
+Requests may send `Content-Encoding: gzip` (or deflate) bodies.  HMAC signatures cover the body as it was sent, so it
+is only decompressed when a handler reads it through `self._current_request.raw_body`/`body`, within
+`max_request_size`.
+
+"""
+import logging
+import zlib
+
+import flask
+
+from rapidrest.exceptions import RapidRestError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+DEFAULT_ENCODINGS = ("zstd", "br", "gzip", "deflate")
+COMPRESSIBLE_MIMETYPES = frozenset(("application/json", "application/x-ndjson", "application/javascript",
+                                    "application/xml", "image/svg+xml"))
+# Decompressed in bounded steps, so a bomb is caught without inflating it
+_DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class CompressionError(RapidRestError): pass
+
+
+class _ZlibEncoder:
+    def __init__(self, level:int, wbits:int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.compress(data)
+
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self, level:int):
+        # Brotli's quality runs 0-11, zlib's levels are close enough to reuse
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.process(data)
+
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level:int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.compress(data)
+
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encodings() -> dict:
+    """
+    Gets the content codings that can be produced with the installed libraries
+
+    :return: Mapping of coding name to a callable taking the level and returning an encoder
+    """
+    encoders = {
+        "gzip": lambda level: _ZlibEncoder(level, 16 + zlib.MAX_WBITS),
+        "deflate": lambda level: _ZlibEncoder(level, zlib.MAX_WBITS),
+    }
+    if brotli is not None:
+        encoders["br"] = _BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = _ZstdEncoder
+    return encoders
+
+
+# Request bodies, by Content-Encoding, to the zlib window bits that decode them
+_REQUEST_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "x-gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+def decode_body(data:bytes, content_encoding:str, max_size:int=None) -> bytes:
+    """
+    Decompresses a request body
+
+    :param data: The body, as received
+    :param content_encoding: The request's Content-Encoding
+    :param max_size: Largest decompressed body accepted, None for no limit
+
+    :return: The decompressed body
+    """
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding == "identity" or not data:
+        return data
+
+    wbits = _REQUEST_WBITS.get(content_encoding)
+    if wbits is None:
+        flask.abort(415, f"Unsupported request Content-Encoding '{content_encoding}', expected gzip or deflate")
+
+    decompressor = zlib.decompressobj(wbits)
+    decoded = bytearray()
+    pending = data
+    try:
+        while pending and not decompressor.eof:
+            decoded += decompressor.decompress(pending, _DECODE_CHUNK_SIZE)
+            pending = decompressor.unconsumed_tail
+            if max_size is not None and len(decoded) > max_size:
+                flask.abort(413, f"The decompressed request body is larger than the maximum of {max_size} bytes")
+    except zlib.error as e:
+        flask.abort(400, f"The request body is not valid {content_encoding} data: {e}")
+
+    if not decompressor.eof:
+        flask.abort(400, f"The request body is truncated {content_encoding} data")
+
+    return bytes(decoded)
+
+
+class CompressionSettings:
+    """
+    Compression settings of an application
+    """
+
+    def __init__(self, min_size:int=DEFAULT_MIN_SIZE, level:int=DEFAULT_LEVEL, encodings=DEFAULT_ENCODINGS,
+                 max_request_size:int=None, endpoint_control:dict=None):
+        """
+        :param min_size: Bodies smaller than this are not compressed
+        :param level: Compression level
+        :param encodings: Codings offered, in order of preference, the ones that aren't installed are skipped
+        :param max_request_size: Largest decompressed request body accepted, None for no limit
+        :param endpoint_control: Per endpoint and method `compress` settings, keyed by URL rule
+        """
+        encoders = available_encodings()
+        unknown = set(encodings).difference(DEFAULT_ENCODINGS)
+        if unknown:
+            raise CompressionError(f"Unknown content codings {sorted(unknown)}, expected some of {DEFAULT_ENCODINGS}")
+
+        self.min_size = min_size
+        self.level = level
+        self.max_request_size = max_request_size
+        self.encodings = tuple(encoding for encoding in encodings if encoding in encoders)
+        self._encoders = encoders
+        self.endpoint_control = endpoint_control or {}
+
+
+    def endpoint_enabled(self, url_rule, method:str) -> bool:
+        """
+        Checks whether an endpoint's responses may be compressed
+
+        :param url_rule: The matched werkzeug.routing.Rule, or None if no route matched
+        :param method: The HTTP method in use
+
+        :return: False if the endpoint opted out
+        """
+        if url_rule is None:
+            return True
+        if method == "HEAD":
+            method = "GET"
+        return (self.endpoint_control.get(url_rule.rule) or {}).get(method, {}).get("compress", True)
+
+
+    def negotiate(self, request:flask.Request) -> str or None:
+        """
+        Picks the coding for a response
+
+        :param request: The current request
+
+        :return: The coding, or None to send the body as it is
+        """
+        return request.accept_encodings.best_match(self.encodings)
+
+
+    def encoder(self, encoding:str):
+        return self._encoders[encoding](self.level)
+
+
+def is_compressible(response:flask.Response) -> bool:
+    """
+    Checks whether a response's content type is worth compressing, and whether it may be
+
+    :param response: The response
+
+    :return: True if it should be compressed when the client accepts it
+    """
+    mimetype = response.mimetype or ""
+    if not (mimetype in COMPRESSIBLE_MIMETYPES or mimetype.startswith("text/") or mimetype.endswith("+json")):
+        return False
+
+    return "Content-Encoding" not in response.headers and not response.direct_passthrough and \
+        not response.cache_control.no_transform and response.status_code not in (204, 206, 304) and \
+        response.status_code >= 200
+
+
+def _compress_stream(chunks, encoder):
+    """
+    Compresses a streamed body, flushing after every chunk so nothing is held back
+    """
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield encoder.compress(chunk) + encoder.flush()
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response:flask.Response, settings:CompressionSettings, request:flask.Request) -> flask.Response:
+    """
+    Compresses a response with the coding the client prefers, if it should be
+
+    :param response: The response
+    :param settings: The compression settings
+    :param request: The request it answers
+
+    :return: The response
+    """
+    if not is_compressible(response) or not settings.endpoint_enabled(request.url_rule, request.method):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = settings.negotiate(request)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, settings.encoder(encoding))
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < settings.min_size:
+            return response
+
+        encoder = settings.encoder(encoding)
+        response.set_data(encoder.compress(body) + encoder.finish())
+
+    response.headers["Content-Encoding"] = encoding
+    # The representation changed, its strong validator no longer applies; the weak one still matches If-None-Match
+    etag, is_weak = response.get_etag()
+    if etag is not None and not is_weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def from_api_config(api_config:dict) -> CompressionSettings or None:
+    """
+    Creates the compression settings described by the API config
+
+    :param api_config: The API configuration dictionary
+
+    :return: The settings, or None if compression is not enabled
+    """
+    compression_cfg = api_config.get("compression") or {}
+    if not compression_cfg.get("enabled", False):
+        return None
+
+    settings = CompressionSettings(
+        min_size=compression_cfg.get("min_size", DEFAULT_MIN_SIZE),
+        level=compression_cfg.get("level", DEFAULT_LEVEL),
+        encodings=compression_cfg.get("encodings") or DEFAULT_ENCODINGS,
+        # An empty key in the YAML is None too, which would mean no limit at all
+        max_request_size=compression_cfg.get("max_request_size") or
+                         (api_config.get("requests") or {}).get("max_body_size"),
+        endpoint_control=compression_cfg.get("endpoint_control"),
+    )
+    _LOGGER.info("Response compression enabled, offering %s", ", ".join(settings.encodings))
+    return settings
+
+
+def check_endpoint_control(settings:CompressionSettings or None, registered_rules:list, log=_LOGGER):
+    """
+    Checks the compression endpoint config against the registered routes, once they are all added
+
+    :param settings: The compression settings, None if compression is disabled
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+    """
+    if settings is None:
+        return
+
+    registered = {}
+    for _, url_rule, methods in registered_rules:
+        registered.setdefault(url_rule, set()).update(methods)
+
+    for url_rule, methods_cfg in settings.endpoint_control.items():
+        if url_rule not in registered:
+            log.warning(f"Compression config for '{url_rule}' does not match any registered route")
+            continue
+        if not isinstance(methods_cfg, dict):
+            raise CompressionError(f"Compression config for '{url_rule}' must be a mapping of methods")
+        for method, method_cfg in methods_cfg.items():
+            if not isinstance(method_cfg, dict) or not isinstance(method_cfg.get("compress", True), bool):
+                raise CompressionError(f"Compression config for {method} {url_rule} needs a boolean 'compress'")
+            if method not in registered[url_rule]:
+                log.warning(f"Compression config for {method} {url_rule} does not match any registered method")
+
+
+def install(app, settings:CompressionSettings or None):
+    """
+    Compresses the application's responses
+
+    :param app: The application
+    :param settings: The compression settings, None leaves responses alone (request bodies are still decompressed)
+    """
+    app.config["compression"] = settings
+    if settings is not None:
+        app.after_request(lambda response: compress_response(response, settings, flask.request))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Request deadlines, so work for a client that has already given up is abandoned instead of run to completion.
+
+Every request gets a deadline when it is dispatched: the number of seconds in its `X-Request-Timeout` header, or the
+endpoint's timeout if it has none, capped by the endpoint's timeout and `max_timeout`.  It is checked before
+authentication, before the handler is called and before the response is serialized, and Vault calls made for the
+request (see rapidrest.vault_access) wait no longer than it has left.  A request that runs out of time is answered
+with a 504.  The timeout counts from when the request was received (by the ASGI adapter, or the proxy's
+`X-Request-Start` header), so time spent queued for a worker is taken off it.  Configured in `api_config.yml`:
+
+    deadlines:
+      enabled: false
+      default_timeout: 30     # Seconds, for requests without the header (unset for no deadline)
+      max_timeout: 60         # Cap on the header's value
+      endpoint_control:
+        "/v1/reports":
+          POST:
+            timeout: 120      # Default and cap for this endpoint, overriding the two above
+
+Handlers can see how long they have left with `self._current_request.time_remaining`, and any code running for the
+request with `remaining()`, to pass on to their own calls or to stop early with `check()`.
+
+"""
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from types import MappingProxyType
+
+import flask
+
+from rapidrest import admission, httperrors
+from rapidrest.exceptions import RapidRestError
+
+_LOGGER = logging.getLogger(__name__)
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Where a deadline is checked
+AUTHENTICATION = "authentication"
+HANDLER = "handler"
+SERIALIZATION = "serialization"
+VAULT = "vault"
+STAGES = (AUTHENTICATION, HANDLER, SERIALIZATION, VAULT)
+
+_CURRENT_DEADLINE = ContextVar("rapidrest_deadline", default=None)
+
+
+class DeadlineError(RapidRestError): pass
+
+
+class DeadlineExceeded(httperrors.GatewayTimeout):
+    """
+    Raised when a request's deadline passes, answered with a 504
+    """
+
+    def __init__(self, stage:str):
+        super().__init__(f"The request's deadline passed before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    The time by which a request must be answered
+    """
+    __slots__ = ("expires_at", "timeout", "_policy", "_counted")
+
+    def __init__(self, timeout:float, policy, elapsed:float=0.0):
+        """
+        :param timeout: Seconds the request has
+        :param policy: The DeadlinePolicy, whose clock it runs on
+        :param elapsed: Seconds that already went by since the request was received
+        """
+        self.timeout = timeout
+        self.expires_at = policy.clock() + timeout - elapsed
+        self._policy = policy
+        self._counted = False
+
+
+    def remaining(self) -> float:
+        """
+        :return: Seconds left, 0 once it passed
+        """
+        return max(0.0, self.expires_at - self._policy.clock())
+
+
+    def expired(self) -> bool:
+        return self._policy.clock() >= self.expires_at
+
+
+    def check(self, stage:str):
+        """
+        Raises DeadlineExceeded if the deadline has passed
+
+        :param stage: What the request was about to do, for the counters
+        """
+        if self.expired():
+            if not self._counted:
+                self._counted = True
+                self._policy.count_expired(stage)
+            raise DeadlineExceeded(stage)
+
+
+def current() -> Deadline or None:
+    """
+    Gets the deadline of the request being dispatched
+
+    :return: The deadline, or None if it has none
+    """
+    return _CURRENT_DEADLINE.get()
+
+
+def remaining() -> float or None:
+    """
+    Gets the seconds the request being dispatched has left
+
+    :return: The seconds, or None if it has no deadline
+    """
+    deadline = _CURRENT_DEADLINE.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def check(stage:str):
+    """
+    Aborts the request being dispatched with a 504 if its deadline has passed
+
+    :param stage: What the request was about to do
+    """
+    deadline = _CURRENT_DEADLINE.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+class DeadlinePolicy:
+    """
+    Works out the deadline of each request, and counts those that expire
+    """
+
+    def __init__(self, table:dict, default_timeout:float=None, max_timeout:float=None, clock=time.monotonic,
+                 wall_clock=time.time):
+        """
+        :param table: Mapping of (endpoint, rule, method) to the endpoint's timeout
+        :param default_timeout: Seconds requests without a timeout header get, None for no deadline
+        :param max_timeout: Cap on the timeout header, None for no cap
+        :param clock: Monotonic clock (overridable for tests)
+        :param wall_clock: Wall clock, as unix epoch seconds, to compare with when requests were received
+        """
+        self._table = MappingProxyType(table)
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self.started = 0
+        self.expired = dict.fromkeys(STAGES, 0)
+
+
+    def timeout(self, request:flask.Request) -> float or None:
+        """
+        Gets the timeout of a request
+
+        :param request: The current request
+
+        :return: Seconds, or None if the request has no deadline
+        """
+        rule = request.url_rule
+        method = "GET" if request.method == "HEAD" else request.method
+        endpoint_timeout = self._table.get((rule.endpoint, rule.rule, method)) if rule is not None else None
+        cap = endpoint_timeout if endpoint_timeout is not None else self.max_timeout
+
+        header = request.headers.get(TIMEOUT_HEADER)
+        if header is None:
+            return endpoint_timeout if endpoint_timeout is not None else self.default_timeout
+
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = -1
+        if not requested > 0:
+            flask.abort(400, f"{TIMEOUT_HEADER} must be a positive number of seconds")
+        return min(requested, cap) if cap is not None else requested
+
+
+    def start(self, request:flask.Request):
+        """
+        Sets the deadline of the request being dispatched
+
+        :param request: The current request
+
+        :return: Token to pass to `reset` when the request ends
+        """
+        timeout = self.timeout(request)
+        if timeout is None:
+            return _CURRENT_DEADLINE.set(None)
+
+        received_at = admission.request_start(request)
+        # Clock skew with the proxy must not extend the deadline
+        elapsed = max(0.0, self.wall_clock() - received_at) if received_at is not None else 0.0
+
+        with self._lock:
+            self.started += 1
+        return _CURRENT_DEADLINE.set(Deadline(timeout, self, elapsed))
+
+
+    def count_expired(self, stage:str):
+        with self._lock:
+            self.expired[stage] += 1
+
+
+    def stats(self) -> dict:
+        """
+        Gets the deadline counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            stats = {f"expired_before_{stage}": count for stage, count in self.expired.items()}
+            stats["started"] = self.started
+        stats["expired"] = sum(self.expired.values())
+        return stats
+
+
+def start(app:flask.Flask, request:flask.Request):
+    """
+    Sets the deadline of the request being dispatched, if the application has deadlines
+
+    :param app: The application
+    :param request: The current request
+
+    :return: Token to pass to `reset` when the request ends
+    """
+    policy = app.config.get("deadlines")
+    if policy is None:
+        return None
+    return policy.start(request)
+
+
+def reset(token):
+    """
+    Clears the deadline set by `start`, so it doesn't outlive its request on a reused thread
+    """
+    if token is not None:
+        _CURRENT_DEADLINE.reset(token)
+
+
+def from_api_config(api_config:dict, registered_rules:list, log=_LOGGER) -> DeadlinePolicy or None:
+    """
+    Creates the deadline policy described by the API config, checking its endpoint config against the registered
+    routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The deadline policy, or None if deadlines are not enabled
+    """
+    deadlines_cfg = api_config.get("deadlines") or {}
+    if not deadlines_cfg.get("enabled", False):
+        return None
+
+    endpoint_control = deadlines_cfg.get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise DeadlineError("'deadlines.endpoint_control' must be a mapping of URL rules")
+
+    table = {}
+    for endpoint, url_rule, methods in registered_rules:
+        for method, method_cfg in (endpoint_control.get(url_rule) or {}).items():
+            if method not in methods:
+                continue
+            if not isinstance(method_cfg, dict) or not isinstance(method_cfg.get("timeout"), (int, float)) or \
+                    method_cfg["timeout"] <= 0:
+                raise DeadlineError(f"Deadline config for {method} {url_rule} needs a positive 'timeout'")
+            table[(endpoint, url_rule, method)] = method_cfg["timeout"]
+
+    registered = {url_rule for _, url_rule, _ in registered_rules}
+    for url_rule in endpoint_control:
+        if url_rule not in registered:
+            log.warning(f"Deadline config for '{url_rule}' does not match any registered route")
+
+    return DeadlinePolicy(
+        table,
+        default_timeout=deadlines_cfg.get("default_timeout"),
+        max_timeout=deadlines_cfg.get("max_timeout"),
+    )
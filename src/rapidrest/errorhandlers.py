@@ -3,9 +3,11 @@
 Basic error handlers
 
 """
-from flask import jsonify, make_response, current_app
+from flask import current_app
 from werkzeug.exceptions import HTTPException
 
+from rapidrest.codec import json_response
+
 def register_handlers(app):
     """
     @brief      Registers the default error handlers for RapidRest
@@ -37,7 +39,12 @@ def _handle_http_errors(err):
         "err_detail": str(err)
     }
 
-    return make_response(jsonify(resp), err.code)
+    response = json_response(resp, err.code)
+    # Keep the headers the exception carries, like Retry-After or Allow
+    for name, value in err.get_headers():
+        if name.lower() != "content-type":
+            response.headers[name] = value
+    return response
 
 
 def _handle_unregistered(err):
@@ -56,4 +63,4 @@ def _handle_unregistered(err):
 
     current_app.logger.exception(err)
 
-    return make_response(jsonify(resp), 500)
+    return json_response(resp, 500)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP caching validators and per-endpoint Cache-Control.
+
+Successful GET (and HEAD) `ApiResponse`s get a strong ETag computed from their serialized body, and requests whose
+If-None-Match/If-Modified-Since match get a 304 instead.  A resource can make this cheaper by overriding `get_etag`
+and/or `get_last_modified`, which receive the same arguments as `get`: they run before the handler, and when the
+client's copy is current the handler is not called and nothing is serialized.  Streamed bodies only get validators
+through those hooks.
+
+Cache-Control headers are declared per endpoint, in the same shape as `security.endpoint_control`:
+
+    http_caching:
+      etags: true                   # Compute ETags for GET responses that don't get one from a hook
+      endpoint_control:
+        "/v1/pants":
+          GET:
+            cache_control: "private, max-age=60"
+            etag: true              # Per-endpoint override of `etags`
+
+"""
+import hashlib
+import logging
+from types import MappingProxyType
+
+from werkzeug.http import is_resource_modified
+
+from rapidrest.exceptions import RapidRestError
+
+_LOGGER = logging.getLogger(__name__)
+
+CONDITIONAL_METHODS = frozenset(("GET", "HEAD"))
+# Headers a 304 has to repeat from the response it stands in for (RFC 9110, section 15.4.5)
+NOT_MODIFIED_HEADERS = ("Cache-Control", "Content-Location", "Date", "ETag", "Expires", "Last-Modified", "Vary")
+
+
+class CachePolicyError(RapidRestError): pass
+
+
+class CachePolicy:
+    """
+    Immutable lookup of endpoint caching configs, keyed by Werkzeug endpoint, URL rule and method
+    """
+
+    def __init__(self, table:dict, etags:bool=True):
+        """
+        :param table: Mapping of (endpoint, rule, method) to the method's caching config
+        :param etags: Whether ETags are computed for methods without a config
+        """
+        self._table = MappingProxyType(table)
+        self._default = MappingProxyType({"cache_control": None, "etag": etags})
+
+
+    def lookup(self, url_rule, method:str) -> MappingProxyType:
+        """
+        Gets the caching config for the matched rule, HEAD requests use the GET config
+
+        :param url_rule: The matched werkzeug.routing.Rule
+        :param method: The HTTP method in use
+
+        :return: The caching config for the endpoint
+        """
+        if method == "HEAD":
+            method = "GET"
+        return self._table.get((url_rule.endpoint, url_rule.rule, method), self._default)
+
+
+    def __len__(self):
+        return len(self._table)
+
+
+def compile_cache_policy(api_config:dict, registered_rules:list, log=_LOGGER) -> CachePolicy:
+    """
+    Compiles the endpoint caching config against the registered routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The compiled caching policy
+    """
+    caching_cfg = api_config.get("http_caching") or {}
+    etags = caching_cfg.get("etags", True)
+    endpoint_control = caching_cfg.get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise CachePolicyError("'http_caching.endpoint_control' must be a mapping of URL rules")
+
+    table = {}
+    rule_methods = {}
+    for endpoint, url_rule, methods in registered_rules:
+        rule_methods.setdefault(url_rule, set()).update(methods)
+        for method, method_cfg in (endpoint_control.get(url_rule) or {}).items():
+            if method not in methods:
+                continue
+            if not isinstance(method_cfg, dict):
+                raise CachePolicyError(f"Caching config for {method} {url_rule} must be a mapping")
+            table[(endpoint, url_rule, method)] = MappingProxyType({
+                "cache_control": method_cfg.get("cache_control"),
+                "etag": bool(method_cfg.get("etag", etags)),
+            })
+
+    for url_rule, rule_cfg in endpoint_control.items():
+        if url_rule not in rule_methods:
+            log.warning(f"Caching config for '{url_rule}' does not match any registered route")
+            continue
+        for method in set(rule_cfg or ()).difference(rule_methods[url_rule]):
+            log.warning(f"Caching config for {method} '{url_rule}' does not match a method the route accepts")
+
+    return CachePolicy(table, etags=etags)
+
+
+def body_etag(body:bytes) -> str:
+    """
+    Computes a strong ETag for a serialized body
+
+    :param body: The body
+
+    :return: The (unquoted) ETag
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def resource_validators(resource, view_args:dict) -> tuple:
+    """
+    Asks a resource for its cheap validators
+
+    :param resource: The ApiResource handling the request
+    :param view_args: The arguments the handler will be called with
+
+    :return: (etag or None, last modified datetime or None)
+    """
+    return resource.get_etag(**view_args), resource.get_last_modified(**view_args)
+
+
+def not_modified(request, etag:str=None, last_modified=None) -> bool:
+    """
+    Checks the request's If-None-Match/If-Modified-Since against the current validators
+
+    :param request: The current request
+    :param etag: The current ETag
+    :param last_modified: When the resource last changed
+
+    :return: True if the client's copy is current
+    """
+    if etag is None and last_modified is None:
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def apply_headers(response, cache_cfg, etag:str=None, last_modified=None):
+    """
+    Adds the validators and the configured Cache-Control to a response
+
+    :param response: The response
+    :param cache_cfg: The endpoint's caching config
+    :param etag: The ETag
+    :param last_modified: When the resource last changed
+    """
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_cfg["cache_control"] and "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = cache_cfg["cache_control"]
+
+
+def not_modified_response(response):
+    """
+    Replaces a response with a 304 carrying its validators, without reading (or serializing) its body
+
+    :param response: The response the client already has
+
+    :return: The 304 response
+    """
+    not_modified_resp = type(response)(status=304)
+    for header in NOT_MODIFIED_HEADERS:
+        if header in response.headers:
+            not_modified_resp.headers[header] = response.headers[header]
+
+    response.close()
+    return not_modified_resp
@@ -7,6 +7,7 @@ import logging
 import os
 
 from rapidrest.exceptions import IntegrationLoadError
+from rapidrest.startup_trace import NULL_TRACER
 from vaultclient import VaultClient
 
 log = logging.getLogger(__name__)
@@ -29,24 +30,48 @@ def integrations_required_keys(modules:list) -> set:
     return req_keys
 
 
-def initialize_api_integrations(modules:list, api_config:dict, vault:VaultClient):
+def initialize_api_integrations(modules:list, api_config:dict, vault:VaultClient, tracer=NULL_TRACER):
     """
     Initializes all the API integrations
 
     :param modules: The list of modules to process
     :param api_config: The API configuration dictionary
     :param vault: The initialized Vault client
+    :param tracer: The startup tracer, which records each module's bootstrap
     """
     int_cfg = _get_req_key_values(integrations_required_keys(modules), api_config, vault)
     try:
         for module in modules:
-            _init_integration(module, int_cfg)
+            with tracer.span("integrations", module.__name__):
+                _init_integration(module, int_cfg)
     except Exception:
         return False
 
     return True
 
 
+def notify_secrets_refreshed(modules:list, api_config:dict, vault:VaultClient):
+    """
+    Lets integration modules know the API's secrets have changed.  Modules opt in by defining
+    `on_secrets_refreshed(cfg)`, which receives the same style of config as `initialize_ext_resources`, so that
+    things like connection pools can reconnect with new credentials.
+
+    :param modules: The integration modules
+    :param api_config: The API configuration dictionary
+    :param vault: The initialized Vault client
+    """
+    int_cfg = _get_req_key_values(integrations_required_keys(modules), api_config, vault)
+    for module in modules:
+        callback = getattr(module, "on_secrets_refreshed", None)
+        if callback is None:
+            continue
+
+        try:
+            callback(int_cfg)
+        except Exception as e:
+            log.error(f"Secrets refresh callback for {module.__name__} failed: {e}")
+
+
 def _get_req_key_values(req_keys:set, api_config:dict, vault:VaultClient) -> dict:
     """
     Gets the values for required keys
@@ -58,7 +83,7 @@ def _get_req_key_values(req_keys:set, api_config:dict, vault:VaultClient) -> dic
     :return: Mapping of key/values
     """
     # Order of precedence goes --> thataway
-    search_objs = (api_config, api_config["secrets"], os.environ)
+    search_objs = (api_config, api_config.get("secrets", {}), os.environ)
 
     # Wasteful? Yeah, kinda, but most likely as fast as something with continue, and less code
     req_map = {key: obj[key] for key in req_keys for obj in search_objs if key in obj}
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous jobs, so handlers of long-running requests don't hold a worker for their whole duration.
+
+A handler hands its work to the job pools and returns right away with a 202, pointing the client at the job:
+
+    class Reports(ApiResource):
+        job_executor = "process"    # "thread" (the default) for work that mostly waits on I/O
+
+        def post(self):
+            return self._start_job(build_report, self._current_request.body)
+
+The client then polls `GET /_jobs/<job_id>` for the job's status (queued, running, succeeded, failed or cancelled) and,
+once it succeeded, its result (which must be JSON serializable), or cancels it with `DELETE /_jobs/<job_id>`.  A queued
+job is cancelled outright; a running thread job is only asked to stop, which it can check with `cancel_requested()`
+and honour by raising `JobCancelled`.  Jobs are only visible to the principal that started them.
+
+Process jobs run in a pool of spawned processes, so their function and arguments must be picklable (a module level
+function, not a method).  Thread jobs run with the application context.  Configured in `api_config.yml`:
+
+    jobs:
+      enabled: true
+      max_threads: 4
+      max_processes: 2
+      max_queued: 100       # Jobs waiting for a worker, per pool, before new ones are rejected with a 503
+      retry_after: 5        # Seconds, sent with those 503s
+      result_ttl: 600       # Seconds a finished job's result is kept
+      max_results: 10000
+
+Jobs are held by the worker that started them, which is the one `/_jobs/<job_id>` has to reach: run a single worker
+process (scaling with the pools instead) or use sticky routing.
+
+"""
+import contextvars
+import logging
+import multiprocessing
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import flask
+
+from rapidrest import httperrors
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.cache import LruTtlCache
+
+_LOGGER = logging.getLogger(__name__)
+
+JOBS_ENDPOINT = "/_jobs/<job_id>"
+EXECUTORS = ("thread", "process")
+DEFAULT_MAX_THREADS = 4
+DEFAULT_MAX_PROCESSES = 2
+DEFAULT_MAX_QUEUED = 100
+DEFAULT_RETRY_AFTER = 5
+DEFAULT_RESULT_TTL = 600
+DEFAULT_MAX_RESULTS = 10000
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_CURRENT_JOB = contextvars.ContextVar("rapidrest_current_job", default=None)
+
+
+class JobCancelled(Exception):
+    """
+    Raised by a thread job that stopped because it was asked to
+    """
+
+
+def cancel_requested() -> bool:
+    """
+    Checks whether the thread job calling it has been asked to stop
+
+    :return: True if it should stop (by raising JobCancelled)
+    """
+    job = _CURRENT_JOB.get()
+    return job is not None and job.cancel_event.is_set()
+
+
+class Job:
+    """
+    A job, and the future of its result
+    """
+    __slots__ = ("id", "owner", "executor", "created", "finished", "future", "cancel_event")
+
+    def __init__(self, owner:str or None, executor:str):
+        self.id = secrets.token_urlsafe(16)
+        self.owner = owner
+        self.executor = executor
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self.cancel_event = threading.Event()
+
+
+    @property
+    def status(self) -> str:
+        future = self.future
+        if future.cancelled():
+            return CANCELLED
+        if not future.done():
+            return RUNNING if future.running() else QUEUED
+        if isinstance(future.exception(), JobCancelled):
+            return CANCELLED
+        return FAILED if future.exception() is not None else SUCCEEDED
+
+
+    def describe(self) -> dict:
+        """
+        Describes the job, as sent to clients
+
+        :return: The job's status, and its result or error once it finished
+        """
+        status = self.status
+        desc = {"id": self.id, "status": status, "created": self.created, "finished": self.finished}
+        if status == SUCCEEDED:
+            desc["result"] = self.future.result()
+        elif status == FAILED:
+            error = self.future.exception()
+            desc["error"] = f"{error.__class__.__name__}: {error}"
+        elif status == RUNNING:
+            desc["cancel_requested"] = self.cancel_event.is_set()
+        return desc
+
+
+def _run_thread_job(app:flask.Flask, job:Job, func, args:tuple, kwargs:dict):
+    _CURRENT_JOB.set(job)
+    with app.app_context():
+        return func(*args, **kwargs)
+
+
+class JobManager:
+    """
+    The job pools, and the jobs this worker started
+    """
+
+    def __init__(self, max_threads:int=DEFAULT_MAX_THREADS, max_processes:int=DEFAULT_MAX_PROCESSES,
+                 max_queued:int=DEFAULT_MAX_QUEUED, retry_after:int=DEFAULT_RETRY_AFTER,
+                 result_ttl:float=DEFAULT_RESULT_TTL, max_results:int=DEFAULT_MAX_RESULTS):
+        """
+        :param max_threads: Thread jobs run at once
+        :param max_processes: Process jobs run at once
+        :param max_queued: Jobs waiting for a worker in each pool before new ones are rejected
+        :param retry_after: Seconds clients are told to wait when a job is rejected
+        :param result_ttl: Seconds a finished job is kept
+        :param max_results: Most finished jobs kept
+        """
+        self.max_workers = {"thread": max_threads, "process": max_processes}
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self._executors = {}
+        self._active = {}
+        self._unfinished = dict.fromkeys(EXECUTORS, 0)
+        self._finished = LruTtlCache(max_entries=max_results, ttl=result_ttl)
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "rejected": 0, "finished": 0}
+
+
+    def _executor(self, kind:str):
+        # Created on first use, so workers that never run jobs don't start pools
+        executor = self._executors.get(kind)
+        if executor is None:
+            if kind == "process":
+                # Forking a worker that already runs threads can deadlock the children
+                executor = ProcessPoolExecutor(max_workers=self.max_workers[kind],
+                                               mp_context=multiprocessing.get_context("spawn"))
+            else:
+                executor = ThreadPoolExecutor(max_workers=self.max_workers[kind], thread_name_prefix="rapidrest-job")
+            self._executors[kind] = executor
+        return executor
+
+
+    def submit(self, kind:str, owner:str or None, func, *args, **kwargs) -> Job:
+        """
+        Starts a job, aborting with a 503 if its pool's queue is full
+
+        :param kind: "thread" or "process"
+        :param owner: Name of the principal starting it
+        :param func: The callable doing the work
+        :param args: Its arguments
+        :param kwargs: Its keyword arguments
+
+        :return: The job
+        """
+        if kind not in EXECUTORS:
+            raise ValueError(f"Unknown job executor '{kind}', expected one of {EXECUTORS}")
+
+        job = Job(owner, kind)
+        with self._lock:
+            if self._unfinished[kind] >= self.max_workers[kind] + self.max_queued:
+                self.counters["rejected"] += 1
+                raise httperrors.ServiceUnavailable("Too many jobs are queued, try again later",
+                                                    retry_after=self.retry_after)
+
+            if kind == "process":
+                job.future = self._executor(kind).submit(func, *args, **kwargs)
+            else:
+                job.future = self._executor(kind).submit(_run_thread_job, flask.current_app._get_current_object(),
+                                                         job, func, args, kwargs)
+            self._active[job.id] = job
+            self._unfinished[kind] += 1
+            self.counters["submitted"] += 1
+
+        job.future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+
+    def start(self, resource_class, func, *args, **kwargs) -> ApiResponse:
+        """
+        Starts a job for the current request (see ApiResource._start_job)
+
+        :param resource_class: The ApiResource subclass starting it, whose `job_executor` picks the pool
+        :param func: The callable doing the work
+        :param args: Its arguments
+        :param kwargs: Its keyword arguments
+
+        :return: The 202 ApiResponse pointing at the job
+        """
+        principal = flask.g.get("principal")
+        job = self.submit(resource_class.job_executor, principal.name if principal is not None else None,
+                          func, *args, **kwargs)
+        url = flask.url_for(Jobs.endpoint_name, job_id=job.id)
+        return ApiResponse(body={"id": job.id, "status": QUEUED, "href": url}, status_code=202,
+                           headers={"Location": url})
+
+
+    def _finish(self, job:Job):
+        job.finished = time.time()
+        with self._lock:
+            # Moved under the lock, so lookups never miss a job in between
+            self._finished.put(job.id, job)
+            self._active.pop(job.id, None)
+            self._unfinished[job.executor] -= 1
+            self.counters["finished"] += 1
+
+
+    def get(self, job_id:str, owner:str or None) -> Job or None:
+        """
+        Gets a job
+
+        :param job_id: The job's ID
+        :param owner: Name of the principal asking for it
+
+        :return: The job, or None if there is no such job or it belongs to another principal
+        """
+        with self._lock:
+            job = self._active.get(job_id) or self._finished.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+
+    def cancel(self, job:Job) -> bool:
+        """
+        Cancels a job, or asks it to stop if it is already running
+
+        :param job: The job
+
+        :return: True if it was cancelled before it started
+        """
+        job.cancel_event.set()
+        return job.future.cancel()
+
+
+    def stats(self) -> dict:
+        """
+        Gets the job counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            for kind in EXECUTORS:
+                stats[f"active_{kind}"] = self._unfinished[kind]
+        stats["results"] = len(self._finished)
+        return stats
+
+
+    def shutdown(self, wait:bool=True):
+        """
+        Stops the pools, cancelling the queued jobs
+        """
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class Jobs(ApiResource):
+    """
+    Reports on and cancels jobs
+    """
+    endpoint_name = "_jobs"
+    description = "Job status endpoint"
+
+    def _job(self, job_id:str) -> Job:
+        principal = flask.g.get("principal")
+        job = flask.current_app.config["jobs"].get(job_id, principal.name if principal is not None else None)
+        if job is None:
+            flask.abort(404, f"There is no job '{job_id}'")
+        return job
+
+
+    def get(self, job_id):
+        """
+        Gets a job's status, and its result once it finished
+
+        :return: ApiResponse describing the job
+        """
+        return ApiResponse(body=self._job(job_id).describe(), status_code=200)
+
+
+    def delete(self, job_id):
+        """
+        Cancels a job
+
+        :return: ApiResponse describing the job, 202 if it is running and was only asked to stop
+        """
+        job = self._job(job_id)
+        if job.future.done():
+            flask.abort(409, f"Job '{job_id}' has already finished")
+
+        cancelled = flask.current_app.config["jobs"].cancel(job)
+        return ApiResponse(body=job.describe(), status_code=200 if cancelled else 202)
+
+
+def from_api_config(api_config:dict) -> JobManager or None:
+    """
+    Creates the job manager described by the API config
+
+    :param api_config: The API configuration dictionary
+
+    :return: The job manager, or None if jobs are not enabled
+    """
+    jobs_cfg = api_config.get("jobs") or {}
+    if not jobs_cfg.get("enabled", False):
+        return None
+
+    _LOGGER.info("Asynchronous jobs enabled at %s", JOBS_ENDPOINT)
+    return JobManager(
+        max_threads=jobs_cfg.get("max_threads", DEFAULT_MAX_THREADS),
+        max_processes=jobs_cfg.get("max_processes", DEFAULT_MAX_PROCESSES),
+        max_queued=jobs_cfg.get("max_queued", DEFAULT_MAX_QUEUED),
+        retry_after=jobs_cfg.get("retry_after", DEFAULT_RETRY_AFTER),
+        result_ttl=jobs_cfg.get("result_ttl", DEFAULT_RESULT_TTL),
+        max_results=jobs_cfg.get("max_results", DEFAULT_MAX_RESULTS),
+    )
@@ -3,9 +3,11 @@
 Subclasses Flask's MethodView to provide some extra functionality (and enforce some things)
 
 """
-import json
 from flask import Response
 
+from rapidrest import streaming
+from rapidrest.codec import get_codec
+
 
 class JSONAPIResponse(Response):
     """
@@ -31,12 +33,36 @@ class JSONAPIResponse(Response):
                 "data": response
             }
         else:
-            self._make_jsonapi_response(links=links, data=data, errors=errors, meta=meta, included=included,
-                                        jsonapi=jsonapi)
-            actual_response = {}
+            actual_response = self._make_jsonapi_response(links=links, data=data, errors=errors, meta=meta,
+                                                          included=included, jsonapi=jsonapi)
+            # The document reports the misconfiguration itself, sent as a 500 unless the caller chose a status
+            if "errors" in actual_response and errors is None and status is None:
+                status = 500
+
+        json_codec = get_codec()
+        if streaming.is_stream(actual_response.get("data")):
+            body = self._stream_document(actual_response, json_codec)
+        else:
+            body = json_codec.dumps(actual_response)
+
+        super().__init__(response=body, status=status, headers=headers, content_type="application/vnd.api+json")
+
+
+    @staticmethod
+    def _stream_document(document:dict, json_codec):
+        """
+        Streams a document whose primary data is an iterator, the other members are written before it
+
+        :param document: The JSON:API document
+        :param json_codec: The codec to serialize it with
+
+        :return: The response body
+        """
+        items = streaming.StreamedItems(document.pop("data"))
+        members = json_codec.dumps(document)
+        prefix = members[:-1] + (b',"data":[' if document else b'"data":[')
 
-        super().__init__(response=json.dumps(actual_response), status=status, headers=headers,
-                         content_type="application/vnd.api+json")
+        return streaming.stream_body(streaming.stream_items(items, json_codec, prefix=prefix, suffix=b"]}"))
 
 
     def _make_jsonapi_response(self, **kwargs):
@@ -44,6 +70,8 @@ class JSONAPIResponse(Response):
 
         :return:
         """
+        # Members that weren't provided are left out of the document
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
         if "data" not in kwargs and "errors" not in kwargs and "meta" not in kwargs:
             ret_dict = {
                 "errors": [{
@@ -61,7 +89,6 @@ class JSONAPIResponse(Response):
                 }]
             }
         else:
-            keys = ("links","data","errors","meta","included","jsonapi")
-            ret_dict = {key: kwargs[key] for key in keys if not None}
+            ret_dict = kwargs
 
         return ret_dict
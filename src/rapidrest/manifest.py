@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Route manifest support.
+
+Discovering an API walks its packages, imports every module and inspects every handler's signature, which is a large
+part of a worker's boot time.  A route manifest records the result of that discovery, so workers can register the
+routes directly.  The manifest also records the size, mtime and hash of every source file in the API package, and it is
+ignored (falling back to discovery) as soon as any of them change.
+
+Enable it in `api_config.yml` (relative paths are relative to the API package), or with the API_ROUTE_MANIFEST
+environment variable:
+
+    routing:
+      manifest: route_manifest.json
+
+and build it, e.g. while building the image, with:
+
+    python -m rapidrest.manifest rapidrest_dummyapi.v1
+
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+
+MANIFEST_FORMAT = 2
+DEFAULT_MANIFEST_NAME = "route_manifest.json"
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _package_dir(api_root:str) -> str:
+    return importlib.import_module(api_root).__path__[0]
+
+
+def _file_hash(path:str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as src:
+        for chunk in iter(lambda: src.read(64 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _source_files(package_dir:str) -> dict:
+    """
+    Finds the Python source files in an API package
+
+    :param package_dir: The API package directory
+
+    :return: Mapping of path (relative to the package) to os.stat_result
+    """
+    sources = {}
+    for dir_path, dir_names, file_names in os.walk(package_dir):
+        dir_names[:] = [name for name in dir_names if name != "__pycache__"]
+        for file_name in file_names:
+            if file_name.endswith(".py"):
+                path = os.path.join(dir_path, file_name)
+                sources[os.path.relpath(path, package_dir)] = os.stat(path)
+
+    return sources
+
+
+def manifest_path(api_root:str, api_config:dict) -> str or None:
+    """
+    Gets the configured manifest location
+
+    :param api_root: The Python path to the API root
+    :param api_config: The API configuration dictionary
+
+    :return: Absolute path of the manifest, or None if no manifest is configured
+    """
+    path = os.environ.get("API_ROUTE_MANIFEST") or api_config.get("routing", {}).get("manifest")
+    if not path:
+        return None
+
+    return path if os.path.isabs(path) else os.path.join(_package_dir(api_root), path)
+
+
+def build_manifest(app, api_root:str, integration_modules:list) -> dict:
+    """
+    Builds a manifest from an application whose routes were discovered by `routebuilder.load_api`
+
+    :param app: The application
+    :param api_root: The Python path to the API root
+    :param integration_modules: The integration modules returned by `routebuilder.load_api`
+
+    :return: The manifest
+    """
+    package_dir = _package_dir(api_root)
+
+    return {
+        "format": MANIFEST_FORMAT,
+        "api_root": api_root,
+        "routes": [
+            {
+                "url": spec.url,
+                "endpoint": spec.endpoint,
+                "module": spec.module,
+                "class": spec.class_name,
+                "methods": spec.method_map,
+            }
+            for spec in app.config.get("route_specs", [])
+        ],
+        "integrations": [module.__name__ for module in integration_modules],
+        "sources": {
+            path: {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": _file_hash(os.path.join(package_dir, path)),
+            }
+            for path, stat in _source_files(package_dir).items()
+        },
+    }
+
+
+def is_fresh(manifest:dict, api_root:str) -> bool:
+    """
+    Checks that a manifest still describes the API's source.  Files whose size and mtime match are trusted, files
+    whose mtime changed (e.g. copied into an image) are hashed.
+
+    :param manifest: The manifest
+    :param api_root: The Python path to the API root
+
+    :return: True if the manifest can be used
+    """
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("api_root") != api_root:
+        return False
+
+    package_dir = _package_dir(api_root)
+    sources = _source_files(package_dir)
+    if set(sources) != set(manifest["sources"]):
+        return False
+
+    for path, stat in sources.items():
+        recorded = manifest["sources"][path]
+        if stat.st_size != recorded["size"]:
+            return False
+        if stat.st_mtime_ns != recorded["mtime_ns"] and _file_hash(os.path.join(package_dir, path)) != recorded["sha256"]:
+            return False
+
+    return True
+
+
+def load_fresh_manifest(api_root:str, api_config:dict) -> dict or None:
+    """
+    Loads the configured manifest, if there is one and it is still fresh
+
+    :param api_root: The Python path to the API root
+    :param api_config: The API configuration dictionary
+
+    :return: The manifest, or None if the API should be discovered instead
+    """
+    path = manifest_path(api_root, api_config)
+    if path is None:
+        return None
+
+    try:
+        with open(path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        _LOGGER.warning(f"Could not load the route manifest '{path}', discovering the API instead: {e}")
+        return None
+
+    if not is_fresh(manifest, api_root):
+        _LOGGER.warning(f"The route manifest '{path}' is stale, discovering the API instead")
+        return None
+
+    return manifest
+
+
+def main(argv=None) -> int:
+    """
+    Builds the route manifest for an API
+    """
+    # Imported here, the application module uses this one
+    import flask
+    from rapidrest import application, routebuilder
+
+    parser = argparse.ArgumentParser(prog="python -m rapidrest.manifest", description=main.__doc__.strip())
+    parser.add_argument("api_root", help="Python path to the API root, e.g. rapidrest_dummyapi.v1")
+    parser.add_argument("-o", "--output", help="Where to write the manifest, defaults to the configured location, "
+                                               f"or {DEFAULT_MANIFEST_NAME} in the API package")
+    args = parser.parse_args(argv)
+
+    api_cfg = application.load_api_config(args.api_root)
+    if not api_cfg:
+        return 3
+
+    app = flask.Flask(api_cfg.get("api_name", args.api_root))
+    app.config["api_config"] = api_cfg
+    try:
+        integration_modules = routebuilder.load_api(app, args.api_root)
+    except routebuilder.RouteBuilderError as e:
+        print(f"Failed to load API: {e}", file=sys.stderr)
+        return 2
+
+    output = args.output or manifest_path(args.api_root, api_cfg) or \
+        os.path.join(_package_dir(args.api_root), DEFAULT_MANIFEST_NAME)
+    with open(output, "w") as manifest_file:
+        json.dump(build_manifest(app, args.api_root, integration_modules), manifest_file, indent=2)
+
+    print(f"Wrote route manifest for {args.api_root} to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
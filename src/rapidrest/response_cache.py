@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side cache of GET responses, so resources serving hot, slowly changing data don't run their handler for every
+request.
+
+A resource opts in with a `response_cache_ttl` class attribute, or per endpoint in `api_config.yml`, which takes
+precedence:
+
+    response_cache:
+      enabled: true
+      max_entries: 4096
+      max_bytes: 67108864         # Memory cap, on the cached bodies
+      endpoint_control:
+        "/v1/pants":
+          GET:
+            ttl: 30               # Seconds, 0 to not cache the endpoint
+            per_principal: true   # Keep a separate copy for each authenticated principal
+
+Responses are keyed on the URL rule, its arguments, the query string and (unless `per_principal` is off) the
+principal.  Authentication still runs for every request, and so do `get_etag`/`get_last_modified`.  A successful
+POST, PUT, PATCH or DELETE on a resource invalidates all of its cached responses; this is per worker, other workers
+serve theirs until they expire.
+
+Only complete 200 responses are cached, streamed responses and responses with Set-Cookie, Vary or a `no-store`
+Cache-Control are not.
+
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+import flask
+
+from rapidrest.cache import LruTtlCache
+from rapidrest.exceptions import RapidRestError
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+CachedResponse = namedtuple("CachedResponse", field_names=("body", "status_code", "headers"))
+
+
+class ResponseCacheError(RapidRestError): pass
+
+
+def request_key(request:flask.Request, per_principal:bool=True) -> tuple:
+    """
+    Identifies the response a GET request asks for
+
+    :param request: The current request
+    :param per_principal: Whether requests from different principals get different responses
+
+    :return: (endpoint, rule, rule arguments, query arguments, principal name or None)
+    """
+    principal = flask.g.get("principal") if per_principal else None
+    return (
+        request.url_rule.endpoint,
+        request.url_rule.rule,
+        tuple(sorted(request.view_args.items())),
+        tuple(sorted(request.args.items(multi=True))),
+        principal.name if principal is not None else None,
+    )
+
+
+def _sizeof(entry:CachedResponse) -> int:
+    return len(entry.body) + sum(len(name) + len(value) for name, value in entry.headers)
+
+
+def is_cacheable(response:flask.Response) -> bool:
+    """
+    Checks whether a response can be stored and replayed to other requests
+
+    :param response: The response
+
+    :return: True if it can be cached
+    """
+    return response.status_code == 200 and not response.is_streamed and not response.direct_passthrough and \
+        "Set-Cookie" not in response.headers and "Vary" not in response.headers and \
+        not response.cache_control.no_store
+
+
+class ResponseCache:
+    """
+    Bounded LRU+TTL cache of GET responses, invalidated per resource
+    """
+
+    def __init__(self, table:dict, max_entries:int=DEFAULT_MAX_ENTRIES, max_bytes:int=DEFAULT_MAX_BYTES,
+                 clock=time.monotonic):
+        """
+        :param table: Mapping of (endpoint, rule) to the endpoint's (ttl, per_principal) settings
+        :param max_entries: Maximum number of responses to hold
+        :param max_bytes: Maximum total size of the responses held
+        :param clock: Monotonic clock (overridable for tests)
+        """
+        self._table = MappingProxyType(table)
+        self._cache = LruTtlCache(max_entries=max_entries, ttl=0, clock=clock, max_bytes=max_bytes, sizeof=_sizeof)
+        # Bumped by writes, entries keyed with an older generation are never looked up again and age out
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stores = 0
+        self.invalidations = 0
+
+
+    def settings(self, resource_class, url_rule) -> tuple or None:
+        """
+        Gets how an endpoint's responses are cached
+
+        :param resource_class: The ApiResource subclass serving the endpoint
+        :param url_rule: The matched werkzeug.routing.Rule
+
+        :return: (ttl, per_principal), or None if the endpoint isn't cached
+        """
+        settings = self._table.get((url_rule.endpoint, url_rule.rule))
+        if settings is None:
+            settings = (resource_class.response_cache_ttl, resource_class.response_cache_per_principal)
+
+        return settings if settings[0] else None
+
+
+    def key(self, request:flask.Request, per_principal:bool=True) -> tuple:
+        """
+        Creates the cache key of a request, must be created before the handler runs so a concurrent write can't
+        leave a stale response behind
+
+        :param request: The current request
+        :param per_principal: Whether the principal is part of the key
+
+        :return: The cache key
+        """
+        endpoint = request.url_rule.endpoint
+        return (self._generations.get(endpoint, 0),) + request_key(request, per_principal)
+
+
+    def get(self, key:tuple) -> flask.Response or None:
+        """
+        Gets a cached response
+
+        :param key: The request's cache key
+
+        :return: A new response, or None on a miss
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        return flask.current_app.response_class(entry.body, status=entry.status_code, headers=entry.headers)
+
+
+    def put(self, key:tuple, response:flask.Response, ttl:float) -> bool:
+        """
+        Stores a response, if it can be cached
+
+        :param key: The request's cache key
+        :param response: The response
+        :param ttl: Seconds to keep it
+
+        :return: True if it was stored
+        """
+        if not is_cacheable(response):
+            return False
+
+        self._cache.put(key, CachedResponse(response.get_data(), response.status_code, list(response.headers)),
+                        ttl=ttl)
+        self.stores += 1
+        return True
+
+
+    def invalidate(self, endpoint:str):
+        """
+        Drops every cached response of a resource
+
+        :param endpoint: The resource's endpoint name
+        """
+        with self._lock:
+            self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+            self.invalidations += 1
+
+
+    def clear(self):
+        """
+        Drops every cached response
+        """
+        self._cache.clear()
+
+
+    def stats(self) -> dict:
+        """
+        Gets the cache counters, useful for sizing the cache and the TTLs
+
+        :return: Mapping of counter names to values
+        """
+        stats = self._cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["stores"] = self.stores
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+def from_api_config(api_config:dict, registered_rules:list, log=_LOGGER) -> ResponseCache or None:
+    """
+    Creates the response cache described by the API config, checking its endpoint config against the registered
+    routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The response cache, or None if it is disabled
+    """
+    cache_cfg = api_config.get("response_cache") or {}
+    if not cache_cfg.get("enabled", True):
+        return None
+
+    endpoint_control = cache_cfg.get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise ResponseCacheError("'response_cache.endpoint_control' must be a mapping of URL rules")
+
+    table = {}
+    for endpoint, url_rule, methods in registered_rules:
+        method_cfg = (endpoint_control.get(url_rule) or {}).get("GET")
+        if method_cfg is None or "GET" not in methods:
+            continue
+        if not isinstance(method_cfg, dict):
+            raise ResponseCacheError(f"Response cache config for GET {url_rule} must be a mapping")
+        table[(endpoint, url_rule)] = (method_cfg.get("ttl", 0), method_cfg.get("per_principal", True))
+
+    registered = {url_rule for _, url_rule, _ in registered_rules}
+    for url_rule, rule_cfg in endpoint_control.items():
+        if url_rule not in registered:
+            log.warning(f"Response cache config for '{url_rule}' does not match any registered route")
+        elif set(rule_cfg or ()).difference({"GET"}):
+            log.warning(f"Response cache config for '{url_rule}' has methods other than GET, which are not cached")
+
+    return ResponseCache(
+        table,
+        max_entries=cache_cfg.get("max_entries", DEFAULT_MAX_ENTRIES),
+        max_bytes=cache_cfg.get("max_bytes", DEFAULT_MAX_BYTES),
+    )
@@ -5,9 +5,17 @@ Application layer for the Rapid-REST server
 import importlib
 import inspect
 import pkgutil
+import threading
+from collections import namedtuple
+
+from rapidrest import admission, batch, coalescing, compression, deadlines, http_caching, jobs, response_cache, router, startup_trace
+from rapidrest.security import policy, tokens
 
 class RouteBuilderError(Exception): pass
 
+# Everything needed to register a resource's routes without discovering it again (see rapidrest.manifest)
+RouteSpec = namedtuple("RouteSpec", field_names=("url", "endpoint", "module", "class_name", "method_map"))
+
 
 def _add_url_rule(app, url, view, log, method_map=None):
     """
@@ -17,14 +25,22 @@ def _add_url_rule(app, url, view, log, method_map=None):
     @param url:                 The url
     @param view:                The view method
     @param log:                 The logger
-    @param method_map:          Maps methods to their _id parameters
+    @param method_map:          Maps methods to their _id parameters, and lists the methods with async handlers
     """
+    registry = app.config.setdefault("route_registry", [])
+    async_methods = method_map.get("async", [])
+    if async_methods:
+        # HEAD requests are served by GET handlers
+        app.config.setdefault("async_routes", set()).update(
+            (view.__name__, method) for method in async_methods + (["HEAD"] if "GET" in async_methods else []))
+
     app.add_url_rule(
         url,
         view_func=view,
         provide_automatic_options=True,
         methods=method_map["non-id"]
     )
+    registry.append((view.__name__, url, tuple(method_map["non-id"])))
     log.debug(f"Added endpoint {url}")
 
     for method, id_param in method_map["id"].items():
@@ -34,6 +50,7 @@ def _add_url_rule(app, url, view, log, method_map=None):
             view_func=view,
             methods=[method]
         )
+        registry.append((view.__name__, rule, (method,)))
         log.debug(f"Added 'id' endpoint '{rule}'")
 
 
@@ -60,13 +77,13 @@ def _resource_initializer(app, root, module, log):
         log.warning(f"{module_py_path}.{res_class_name} does not inherit from flask.views.MethodView, skipping")
         return
 
-    # Create url rule(s)
-    view = resource_class.as_view(resource_class.endpoint_name)
-
     # Make sure that methods that need 'id'-type rules get them
-    method_map = { "non-id": [], "id": {} }
-    for method in view.view_class.methods:
-        meth_sig = inspect.signature(getattr(view.view_class, method.lower()))
+    method_map = { "non-id": [], "id": {}, "async": [] }
+    for method in resource_class.methods:
+        handler = getattr(resource_class, method.lower())
+        meth_sig = inspect.signature(handler)
+        if inspect.iscoroutinefunction(handler):
+            method_map["async"].append(method)
 
         id_params = [param_obj for param_obj in meth_sig.parameters.values() if param_obj.name.endswith("_id")]
         if id_params:
@@ -82,8 +99,147 @@ def _resource_initializer(app, root, module, log):
             raise RouteBuilderError(str(f"Method '{method}' in {module_py_path} is required to have an '_id'-style "
                                     "parameter"))
 
+    spec = RouteSpec(url=url, endpoint=resource_class.endpoint_name, module=module.__name__,
+                     class_name=res_class_name, method_map=method_map)
+    app.config.setdefault("route_specs", []).append(spec)
+
     log.debug(f"Adding view for {url}")
-    _add_url_rule(app, url, view, log, method_map=method_map)
+    _register_route(app, spec, resource_class, log)
+
+
+def _register_route(app, spec:RouteSpec, resource_class, log):
+    """
+    Creates the view for a resource and adds its url rule(s)
+
+    @param app:                 The application
+    @param spec:                The resource's route spec
+    @param resource_class:      The ApiResource subclass
+    @param log:                 The logger
+    """
+    view = _as_view(resource_class, spec.endpoint, _singleton_resources(app))
+    _add_url_rule(app, spec.url, view, log, method_map=spec.method_map)
+
+
+def _singleton_resources(app) -> bool:
+    return app.config["api_config"].get("routing", {}).get("singleton_resources", False)
+
+
+def _as_view(resource_class, endpoint:str, singleton:bool=False):
+    """
+    Creates the view function for a resource
+
+    @param resource_class:      The ApiResource subclass
+    @param endpoint:            The endpoint name
+    @param singleton:           Serve every request with one instance, even if the class doesn't ask for it
+
+    @return: The view function
+    """
+    if singleton and resource_class.init_every_request:
+        # A subclass rather than flipping the flag, the resource class may be shared with other apps
+        resource_class = type(resource_class.__name__, (resource_class,), {
+            "init_every_request": False,
+            "__module__": resource_class.__module__,
+            "__qualname__": resource_class.__qualname__,
+        })
+
+    return resource_class.as_view(endpoint)
+
+
+class LazyView:
+    """
+    Stands in for a resource's view function until the first request for it, which imports the resource's module and
+    binds the real view.  Registered for manifest routes, so a worker only imports the resources it actually serves.
+    """
+
+    def __init__(self, spec:RouteSpec, singleton:bool=False):
+        """
+        @param spec:                The resource's route spec
+        @param singleton:           Serve every request with one instance of the resource
+        """
+        self.__name__ = spec.endpoint
+        self.spec = spec
+        self.singleton = singleton
+        self._view = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def resolved(self) -> bool:
+        return self._view is not None
+
+
+    def resolve(self):
+        """
+        Imports the resource and creates its view, once
+
+        @return: The real view function
+        """
+        view = self._view
+        if view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = _as_view(_import_resource(self.spec), self.spec.endpoint, self.singleton)
+                view = self._view
+
+        return view
+
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+
+def _import_module(module_py_path:str, tracer):
+    """
+    Imports a module, recording the import with the startup tracer
+
+    @param module_py_path:      The module's Python path
+    @param tracer:              The startup tracer
+
+    @return: The module
+    """
+    with tracer.span("modules", module_py_path):
+        return importlib.import_module(module_py_path)
+
+
+def _import_resource(spec:RouteSpec, tracer=startup_trace.NULL_TRACER):
+    """
+    Imports the resource class named by a route spec
+
+    @param spec:                The resource's route spec
+    @param tracer:              The startup tracer
+
+    @return: The ApiResource subclass
+    """
+    try:
+        module = _import_module(spec.module, tracer)
+    except ImportError as e:
+        raise RouteBuilderError(f"Failed to import API resource {spec.module}: {e}")
+
+    resource_class = getattr(module, spec.class_name, None)
+    if resource_class is None:
+        raise RouteBuilderError(f"{spec.module} no longer has the class '{spec.class_name}', rebuild the manifest")
+
+    return resource_class
+
+
+def _builtin_resource_initializer(app, url, resource_class, default_sec_cfg, log):
+    """
+    Registers a resource provided by RapidRest itself.  Its security config defaults to `default_sec_cfg` unless the
+    API's config already has an `endpoint_control` entry for it.
+
+    @param app:                 The application
+    @param url:                 The url
+    @param resource_class:      The ApiResource subclass
+    @param default_sec_cfg:     Maps the accepted methods to their default security config
+    @param log:                 The logger
+    """
+    sec_cfg = app.config["api_config"].setdefault("security", {})
+    if sec_cfg.get("endpoint_control") is None:
+        sec_cfg["endpoint_control"] = {}
+    sec_cfg["endpoint_control"].setdefault(url, default_sec_cfg)
+
+    view = _as_view(resource_class, resource_class.endpoint_name, _singleton_resources(app))
+    _add_url_rule(app, url, view, log, method_map={"non-id": list(default_sec_cfg), "id": {}})
 
 
 def load_api(app, api_path, _root="") -> list:
@@ -101,7 +257,7 @@ def load_api(app, api_path, _root="") -> list:
     api_integration_modules = []
 
     try:
-        api_resource = importlib.import_module(api_path)
+        api_resource = _import_module(api_path, startup_trace.tracer_for(app))
     except ImportError:
         raise RouteBuilderError(f"Failed to load the API at '{api_path}'")
 
@@ -112,6 +268,7 @@ def load_api(app, api_path, _root="") -> list:
 
     # This should only run at the very beginning, probably a better way to do this but I'm braindead
     if not _root:
+        _install_matcher(app)
         _resource_initializer(app, _root, api_resource, log)
 
     # Now we do some magic to traverse the package and find all the sub-resources we need to load
@@ -129,7 +286,7 @@ def load_api(app, api_path, _root="") -> list:
             load_api(app, module_py_path, _root=sub_resource_root)
 
         try:
-            module = importlib.import_module(module_py_path)
+            module = _import_module(module_py_path, startup_trace.tracer_for(app))
         except ImportError as e:
             raise RouteBuilderError(f"Failed to import API resource {module_py_path}: {e}")
 
@@ -143,4 +300,119 @@ def load_api(app, api_path, _root="") -> list:
         log.debug(f"Initializing resource {module_py_path}")
         _resource_initializer(app, sub_resource_root, module, log)
 
+    # Once every route is known, the security config can be compiled and checked against them
+    if not _root:
+        _finalize_routes(app, log)
+
+    return api_integration_modules
+
+
+def load_api_from_manifest(app, manifest:dict) -> list:
+    """
+    Loads an API from a route manifest, skipping package discovery and signature inspection
+
+    :param app:                     The application
+    :param manifest:                The manifest, as produced by rapidrest.manifest.build_manifest
+
+    :return The API integration modules
+    """
+    log = app.logger
+    # Resources are imported on their first request unless asked otherwise, eager imports before the server forks
+    # let its workers share the imported modules' memory
+    eager = app.config["api_config"].get("routing", {}).get("eager_import", False)
+    log.debug(f"Loading {len(manifest['routes'])} routes for '{manifest['api_root']}' from the route manifest "
+              f"({'eager' if eager else 'lazy'} imports)")
+
+    _install_matcher(app)
+    for route in manifest["routes"]:
+        spec = RouteSpec(url=route["url"], endpoint=route["endpoint"], module=route["module"],
+                         class_name=route["class"], method_map=route["methods"])
+        app.config.setdefault("route_specs", []).append(spec)
+
+        if eager:
+            _register_route(app, spec, _import_resource(spec, startup_trace.tracer_for(app)), log)
+        else:
+            _add_url_rule(app, spec.url, LazyView(spec, _singleton_resources(app)), log,
+                          method_map=spec.method_map)
+
+    api_integration_modules = []
+    for module_py_path in manifest["integrations"]:
+        try:
+            api_integration_modules.append(_import_module(module_py_path, startup_trace.tracer_for(app)))
+        except ImportError as e:
+            raise RouteBuilderError(f"Failed to import API integrations {module_py_path}: {e}")
+
+    _finalize_routes(app, log)
     return api_integration_modules
+
+
+def _install_matcher(app):
+    """
+    Switches the application to the URL matcher chosen in the API config, before any of the API's routes are added
+
+    @param app:                 The application
+    """
+    matcher = app.config["api_config"].get("routing", {}).get("matcher", "werkzeug")
+    if matcher == "radix":
+        router.install(app)
+    elif matcher != "werkzeug":
+        raise RouteBuilderError(f"Unknown URL matcher '{matcher}', expected 'werkzeug' or 'radix'")
+
+
+def _finalize_routes(app, log):
+    """
+    Adds RapidRest's own resources and compiles the security and caching configs, once all of the API's routes are
+    registered
+
+    @param app:                 The application
+    @param log:                 The logger
+    """
+    if app.config.get("token_issuer") is not None:
+        _builtin_resource_initializer(app, tokens.TOKEN_ENDPOINT, tokens.SessionToken,
+                                      {"POST": {"authentication": True}}, log)
+    if app.config.get("batch") is not None:
+        _builtin_resource_initializer(app, batch.BATCH_ENDPOINT, batch.Batch, {"POST": {"authentication": True}}, log)
+    if app.config.get("jobs") is not None:
+        _builtin_resource_initializer(app, jobs.JOBS_ENDPOINT, jobs.Jobs,
+                                      {"GET": {"authentication": True}, "DELETE": {"authentication": True}}, log)
+
+    try:
+        app.config["security_policy"] = policy.compile_security_policy(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except policy.SecurityPolicyError as e:
+        raise RouteBuilderError(f"Invalid security configuration: {e}")
+
+    try:
+        compression.check_endpoint_control(app.config.get("compression"), app.config.get("route_registry", []), log)
+    except compression.CompressionError as e:
+        raise RouteBuilderError(f"Invalid compression configuration: {e}")
+
+    try:
+        app.config["cache_policy"] = http_caching.compile_cache_policy(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except http_caching.CachePolicyError as e:
+        raise RouteBuilderError(f"Invalid caching configuration: {e}")
+
+    try:
+        app.config["response_cache"] = response_cache.from_api_config(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except response_cache.ResponseCacheError as e:
+        raise RouteBuilderError(f"Invalid response cache configuration: {e}")
+
+    try:
+        app.config["single_flight"] = coalescing.from_api_config(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except coalescing.CoalescingError as e:
+        raise RouteBuilderError(f"Invalid coalescing configuration: {e}")
+
+    try:
+        app.config["admission"] = admission.from_api_config(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except admission.AdmissionError as e:
+        raise RouteBuilderError(f"Invalid admission configuration: {e}")
+
+    try:
+        app.config["deadlines"] = deadlines.from_api_config(
+            app.config["api_config"], app.config.get("route_registry", []), log)
+    except deadlines.DeadlineError as e:
+        raise RouteBuilderError(f"Invalid deadline configuration: {e}")
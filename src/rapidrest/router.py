@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix tree URL matcher for the routes built by `routebuilder`.
+
+Routebuilder's URL space is very regular: static `/<package path>/<resource>` rules, plus a variant of each ending in
+an `<x_id>` segment.  `RadixMap` indexes those rules by path segment, so matching a request walks one tree node per
+segment instead of going through Werkzeug's general matcher.  Id segments are typed by their rule's converter.
+
+Anything the tree does not cover (rules with defaults, redirects, host/subdomain matching, multi-segment converters)
+and every request the tree does not match (404s, 405s, trailing slash redirects) falls back to Werkzeug, so the
+behaviour is unchanged.  Enabled in `api_config.yml` with:
+
+    routing:
+      matcher: radix
+
+"""
+import re
+import threading
+
+from werkzeug.routing import Map, MapAdapter, UnicodeConverter, ValidationError
+
+_ANY_SEGMENT = UnicodeConverter(Map()).regex
+_PARAM_RE = re.compile(r"<(?:(?P<converter>[a-zA-Z_][a-zA-Z0-9_]*)(?:\(.*\))?:)?(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)>")
+
+
+class _Node:
+    __slots__ = ("static", "params", "rules")
+
+    def __init__(self):
+        self.static = {}
+        # (argument name, converter, segment regex or None if any non-empty segment matches, child node)
+        self.params = []
+        self.rules = {}
+
+
+def _supported(rule) -> bool:
+    return not (rule.defaults or rule.redirect_to is not None or rule.alias or rule.websocket or rule.build_only
+                or rule.host or rule.subdomain or not rule.rule.startswith("/") or rule.rule.endswith("/"))
+
+
+def build_tree(rules) -> _Node:
+    """
+    Compiles rules into a prefix tree, skipping those the tree can't match exactly like Werkzeug does
+
+    :param rules: Bound Werkzeug rules, in the map's order
+
+    :return: The root node
+    """
+    rules = list(rules)
+    # Rules with defaults can redirect to other rules of their endpoint, leave those endpoints to Werkzeug
+    excluded_endpoints = {rule.endpoint for rule in rules if rule.defaults}
+
+    root = _Node()
+    for rule in rules:
+        if rule.endpoint in excluded_endpoints or not _supported(rule):
+            continue
+
+        node = root
+        for segment in rule.rule[1:].split("/"):
+            if "<" not in segment:
+                node = node.static.setdefault(segment, _Node())
+                continue
+
+            param = _PARAM_RE.fullmatch(segment)
+            converter = rule._converters.get(param.group("name")) if param else None
+            if converter is None or not getattr(converter, "part_isolating", True):
+                break
+
+            # A plain string segment matches anything non-empty, length limits and other converters need their regex
+            regex = None if type(converter) is UnicodeConverter and converter.regex == _ANY_SEGMENT else \
+                re.compile(converter.regex)
+            for name, existing, existing_regex, child in node.params:
+                if name == param.group("name") and type(existing) is type(converter) and \
+                        getattr(existing_regex, "pattern", None) == getattr(regex, "pattern", None):
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((param.group("name"), converter, regex, child))
+                node = child
+        else:
+            for method in rule.methods or ():
+                node.rules.setdefault(method, rule)
+
+    return root
+
+
+def _match(node:_Node, segments:list, idx:int, method:str, args:dict):
+    if idx == len(segments):
+        return node.rules.get(method)
+
+    segment = segments[idx]
+    child = node.static.get(segment)
+    if child is not None:
+        rule = _match(child, segments, idx + 1, method, args)
+        if rule is not None:
+            return rule
+
+    if not segment:
+        return None
+
+    for name, converter, regex, child in node.params:
+        if regex is not None and regex.fullmatch(segment) is None:
+            continue
+        try:
+            args[name] = converter.to_python(segment)
+        except ValidationError:
+            continue
+
+        rule = _match(child, segments, idx + 1, method, args)
+        if rule is not None:
+            return rule
+        del args[name]
+
+    return None
+
+
+class RadixMapAdapter(MapAdapter):
+    """
+    Tries the prefix tree before handing the request to Werkzeug's matcher
+    """
+
+    def match(self, path_info=None, method=None, return_rule=False, query_args=None, websocket=None):
+        websocket = self.websocket if websocket is None else websocket
+        if not websocket and not self.map.host_matching and not self.subdomain:
+            path_info = self.path_info if path_info is None else path_info
+            # Only the one leading slash, anything else (e.g. "//v1/pants") is left to Werkzeug
+            segments = (path_info[1:] if path_info.startswith("/") else path_info).split("/")
+            args = {}
+            rule = _match(self.map.radix_tree(), segments, 0, (method or self.default_method).upper(), args)
+            if rule is not None:
+                return (rule, args) if return_rule else (rule.endpoint, args)
+
+        return super().match(path_info, method, return_rule, query_args, websocket)
+
+
+class RadixMap(Map):
+    """
+    Werkzeug Map whose adapters match through a prefix tree, rebuilt whenever rules are added
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._tree = None
+        self._tree_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+
+    def add(self, rulefactory):
+        super().add(rulefactory)
+        self._tree = None
+
+
+    def radix_tree(self) -> _Node:
+        tree = self._tree
+        if tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    self._tree = build_tree(self._rules)
+                tree = self._tree
+
+        return tree
+
+
+    def _radix_adapter(self, adapter:MapAdapter) -> RadixMapAdapter:
+        return RadixMapAdapter(self, adapter.server_name, adapter.script_name, adapter.subdomain,
+                               adapter.url_scheme, adapter.path_info, adapter.default_method, adapter.query_args)
+
+
+    def bind(self, *args, **kwargs) -> RadixMapAdapter:
+        return self._radix_adapter(super().bind(*args, **kwargs))
+
+
+    def bind_to_environ(self, *args, **kwargs) -> RadixMapAdapter:
+        # What Flask calls for every request, Werkzeug's version binds through Map.bind rather than self.bind
+        return self._radix_adapter(super().bind_to_environ(*args, **kwargs))
+
+
+    @classmethod
+    def from_map(cls, url_map:Map) -> "RadixMap":
+        """
+        Creates a RadixMap with the same settings and rules as an existing map
+
+        :param url_map: The map to copy
+
+        :return: The new map
+        """
+        rules = []
+        for rule in url_map.iter_rules():
+            rules.append(rule.empty())
+            # Flask keeps this on the rule itself
+            if hasattr(rule, "provide_automatic_options"):
+                rules[-1].provide_automatic_options = rule.provide_automatic_options
+
+        return cls(
+            rules=rules,
+            default_subdomain=url_map.default_subdomain,
+            strict_slashes=url_map.strict_slashes,
+            merge_slashes=url_map.merge_slashes,
+            redirect_defaults=url_map.redirect_defaults,
+            converters=url_map.converters,
+            sort_parameters=url_map.sort_parameters,
+            sort_key=url_map.sort_key,
+            host_matching=url_map.host_matching,
+        )
+
+
+def install(app):
+    """
+    Switches an application over to the prefix tree matcher
+
+    :param app: The application
+    """
+    if not isinstance(app.url_map, RadixMap):
+        app.url_map = RadixMap.from_map(app.url_map)
@@ -10,12 +10,30 @@ import base64
 import flask
 import hashlib
 import hmac
+import secrets
 import sys
+import tempfile
+import time
+from collections import namedtuple
 
+from rapidrest.security import replay
+from rapidrest.vault_access import VaultUnavailableError
 from rapidrest.utils import check_required_args
 
-VALID_AUTH_VERSIONS = ["v1"]
+VALID_AUTH_VERSIONS = ["v1", "v2", "t1"]
 DEFAULT_AUTH_VERSION = "v1"
+# Versions where the client signs the request with its own key, as opposed to presenting a session token
+HMAC_AUTH_VERSIONS = ("v1", "v2")
+TOKEN_AUTH_VERSION = "t1"
+# WSGI environ key of the principal a sub-request was authenticated as (by its batch request, see rapidrest.batch)
+DELEGATED_PRINCIPAL_KEY = "rapidrest.delegated_principal"
+
+# The authenticated caller, available as `flask.g.principal` once authentication succeeds
+Principal = namedtuple("Principal", field_names=("name", "auth_version"))
+
+# v2 bodies are hashed in chunks of this size, and are spooled to disk once they are larger than the max memory size
+V2_BODY_CHUNK_SIZE = 64 * 1024
+V2_SPOOL_MAX_MEMORY = 1024 * 1024
 
 def create_hmac_signature(key:bytes, data_to_sign:str, hashmech:hashlib=hashlib.sha256) -> str:
     """
@@ -32,34 +50,199 @@ def create_hmac_signature(key:bytes, data_to_sign:str, hashmech:hashlib=hashlib.
     return base64.b64encode(sig).decode("utf-8")
 
 
-def create_v1_auth_header(principal_name:str, principal_key:bytes, method:str, host:str, url:str, body:str="") -> str:
+def replay_elements(date:int=None, nonce:str=None) -> tuple:
+    """
+    Creates the Date/Nonce elements used for replay protection
+
+    :param date: Request time as unix epoch seconds, defaults to now
+    :param nonce: Single-use request nonce, defaults to a random one
+
+    :return: (date, nonce)
+    """
+    return (int(time.time()) if date is None else int(date),
+            secrets.token_hex(16) if nonce is None else nonce)
+
+
+def _signed_replay_header(sig_elements:list, date:int, nonce:str) -> str:
+    """
+    Adds the replay protection elements to the signed elements, if they are in use
+
+    :return: The extra Authorization header tokens
+    """
+    if date is None and nonce is None:
+        return ""
+
+    date, nonce = replay_elements(date, nonce)
+    sig_elements.extend((str(date), nonce))
+    return f";Date:{date};Nonce:{nonce}"
+
+
+def create_v1_auth_header(principal_name:str, principal_key:bytes, method:str, host:str, url:str, body:str="",
+                          date:int=None, nonce:str=None) -> str:
     """
-    Creates a v1 auth header
+    Creates a v1 auth header.  Passing `date` and/or `nonce` signs them for replay protection (see `replay_elements`)
 
     :return: The v1 auth header
     """
     sig_elements = [method, host, url, base64.encodebytes(body.encode("utf-8")).decode("utf-8")]
+    replay_header = _signed_replay_header(sig_elements, date, nonce)
 
     sig = create_hmac_signature(principal_key, "\n".join(sig_elements))
-    return f"Version:v1;Hash:sha265;Principal:{principal_name};Signature:{sig}"
+    return f"Version:v1;Hash:sha265;Principal:{principal_name};Signature:{sig}{replay_header}"
+
+
+def content_digest(body=b"") -> str:
+    """
+    Computes the v2 content digest of a request body, incrementally, so large bodies don't need to be held in memory
+
+    :param body: The body as bytes or str, a binary file-like object, or an iterable of bytes chunks
 
+    :return: Hex encoded SHA-256 digest
+    """
+    sha = hashlib.sha256()
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        sha.update(body)
+    elif hasattr(body, "read"):
+        for chunk in iter(lambda: body.read(V2_BODY_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    else:
+        for chunk in body:
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def create_v2_auth_header(principal_name:str, principal_key:bytes, method:str, host:str, url:str, body=b"",
+                          date:int=None, nonce:str=None) -> str:
+    """
+    Creates a v2 auth header.  Unlike v1, the signature covers a SHA-256 digest of the body instead of the body
+    itself, so the body can be streamed (see `content_digest` for what `body` may be).  If `body` is a file-like
+    object it is consumed, and must be rewound before it is sent.
 
-def _get_endpoint_sec_cfg(app:flask.app, url_rule:str, method:str) -> dict or None:
+    :return: The v2 auth header
     """
-    Gets the endpoint's security config
+    sig_elements = [method, host, url, content_digest(body)]
+    replay_header = _signed_replay_header(sig_elements, date, nonce)
+
+    sig = create_hmac_signature(principal_key, "\n".join(sig_elements))
+    return f"Version:v2;Hash:sha256;Principal:{principal_name};Signature:{sig}{replay_header}"
+
+
+def _spool_request_body(request:flask.Request) -> str:
+    """
+    Reads the request body from the WSGI input stream in chunks, hashing it and spooling it (to disk, if it's large) so
+    the handler can still read it afterwards
+
+    @param request: The current request
+
+    @return: Hex encoded SHA-256 digest of the body
+    """
+    sha = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=V2_SPOOL_MAX_MEMORY)
+
+    stream = request.stream
+    for chunk in iter(lambda: stream.read(V2_BODY_CHUNK_SIZE), b""):
+        sha.update(chunk)
+        spool.write(chunk)
+
+    spool.seek(0)
+    # The original stream is exhausted, replace it so get_data()/get_json() read the spooled body instead
+    request.stream = spool
+
+    # Flask closes the request when its context is popped, which only closes uploaded files, so the spool (and its
+    # temporary file, once it rolled over to disk) is closed along with them
+    close_request = request.close
+
+    def _close():
+        try:
+            close_request()
+        finally:
+            spool.close()
+
+    request.close = _close
+    return sha.hexdigest()
+
+
+def _verify_signature(app:flask.app, principal:str, signed_data:str, signature:str) -> bool:
+    """
+    Verifies a principal's signature, locally if the principal key cache is enabled, otherwise through Vault
 
     @param app: The Flask application
-    @param url_rule: The url rule that was invoked
-    @param method: The HTTP method in use
+    @param principal: The principal name
+    @param signed_data: The data the client signed
+    @param signature: The base64 encoded signature provided by the client
 
-    @return: The security config for the endpoint, else None
+    @return: True if the signature is valid, False otherwise
     """
-    sec_cfg = app.config["api_config"]["security"]
+    key_cache = app.config.get("key_cache")
+    if key_cache is None:
+        vault = app.config["vault_fetcher"]()
+        if vault is None:
+            flask.abort(500, "Authentication requires Vault, which is not enabled")
 
-    prelim_cfg = sec_cfg["endpoint_control"][url_rule] if ("endpoint_control" in sec_cfg and
-                                                      url_rule in sec_cfg["endpoint_control"]) else {}
+        try:
+            return vault.verify_hmac_signature(principal, signed_data, signature)
+        except VaultUnavailableError as e:
+            flask.abort(503, f"Authentication is temporarily unavailable: {e}")
+
+    key = key_cache.get_key(principal)
+    if key is None:
+        return False
+
+    expected = create_hmac_signature(key, signed_data)
+    return hmac.compare_digest(expected.encode("utf-8"), signature.encode("utf-8"))
 
-    return prelim_cfg[method] if method in prelim_cfg else None
+
+def _request_replay_elements(auth_dict:dict) -> list:
+    """
+    Gets the signed replay protection elements from the Authorization header
+
+    @param auth_dict: The parsed Authorization header
+
+    @return: [Date, Nonce], or an empty list if the client did not send them
+    """
+    if "Date" not in auth_dict and "Nonce" not in auth_dict:
+        return []
+
+    missing_keys = check_required_args(("Date", "Nonce"), auth_dict)
+    if missing_keys:
+        flask.abort(403, f"Invalid Authentication header, missing required keys: {missing_keys}")
+
+    return [auth_dict["Date"], auth_dict["Nonce"]]
+
+
+def _check_replay(app:flask.app, auth_dict:dict):
+    """
+    Rejects requests that have been seen before, or whose timestamp is outside the allowed window.  Only run this once
+    the signature has been verified, so unsigned junk can't fill the replay cache.
+
+    @param app: The Flask application
+    @param auth_dict: The parsed Authorization header
+    """
+    replay_cache = app.config.get("replay_cache")
+    if replay_cache is None:
+        return
+
+    if "Date" not in auth_dict:
+        if replay_cache.required:
+            flask.abort(403, "Authorization header must include the Date and Nonce elements")
+        return
+
+    try:
+        timestamp = int(auth_dict["Date"])
+    except ValueError:
+        flask.abort(403, "Invalid Authentication header, Date must be unix epoch seconds")
+
+    result = replay_cache.check(auth_dict["Principal"], timestamp, auth_dict["Nonce"])
+    if result == replay.STALE:
+        flask.abort(403, "Request Date is outside the allowed clock skew window")
+    elif result == replay.REPLAYED:
+        flask.abort(403, "Request has already been used")
+    elif result == replay.OVERFLOW:
+        flask.abort(503, "Replay protection is at capacity, try again later")
 
 
 def _v1_authn_mechanism(app:flask.app, request:flask.Request, auth_dict:dict) -> bool:
@@ -69,10 +252,6 @@ def _v1_authn_mechanism(app:flask.app, request:flask.Request, auth_dict:dict) ->
 
     @return: True if authenticated, False otherwise
     """
-    vault = app.config["vault_fetcher"]()
-    if vault is None:
-        flask.abort(500, "Authentication requires Vault, which is not enabled")
-
     required_auth_keys = ("Version", "Hash", "Principal", "Signature")
 
     missing_keys = check_required_args(required_auth_keys, auth_dict)
@@ -84,9 +263,54 @@ def _v1_authn_mechanism(app:flask.app, request:flask.Request, auth_dict:dict) ->
     # has to be stripped, as we can't expect users to remember to add a ? on the end of all their paths they sign
     path = request.full_path.rstrip("?") if request.full_path.endswith("?") else request.full_path
     sig_elements = [request.method, request.headers["Host"], path,
-                    base64.encodebytes(request.data).decode("utf-8")]
+                    base64.encodebytes(request.data).decode("utf-8")] + _request_replay_elements(auth_dict)
+
+    return _verify_signature(app, auth_dict["Principal"], "\n".join(sig_elements), auth_dict["Signature"])
+
+
+def _v2_authn_mechanism(app:flask.app, request:flask.Request, auth_dict:dict) -> bool:
+    """
+    The v2 authentication mechanism, which signs a digest of the body so it can be verified in constant memory
+    Authorization: Version:v2;Hash:sha256;Principal:<principal name>;Signature:<sig>
+
+    @return: True if authenticated, False otherwise
+    """
+    required_auth_keys = ("Version", "Hash", "Principal", "Signature")
+
+    missing_keys = check_required_args(required_auth_keys, auth_dict)
+    if missing_keys:
+        flask.abort(403, f"Invalid Authentication header, missing required keys: {missing_keys}")
+
+    if auth_dict["Hash"] != "sha256":
+        flask.abort(403, "Invalid Authentication header, v2 only supports the sha256 hash")
+
+    path = request.full_path.rstrip("?") if request.full_path.endswith("?") else request.full_path
+    sig_elements = [request.method, request.headers["Host"], path,
+                    _spool_request_body(request)] + _request_replay_elements(auth_dict)
+
+    return _verify_signature(app, auth_dict["Principal"], "\n".join(sig_elements), auth_dict["Signature"])
 
-    return vault.verify_hmac_signature(auth_dict["Principal"], "\n".join(sig_elements), auth_dict["Signature"])
+
+def _t1_authn_mechanism(app:flask.app, request:flask.Request, auth_dict:dict) -> bool:
+    """
+    Session token authentication, the token is verified locally (see rapidrest.security.tokens)
+    Authorization: Version:t1;Token:<token>
+
+    @return: True if authenticated, False otherwise
+    """
+    issuer = app.config.get("token_issuer")
+    if issuer is None:
+        flask.abort(403, "Session tokens are not enabled")
+
+    if "Token" not in auth_dict:
+        flask.abort(403, "Invalid Authentication header, missing required keys: {'Token'}")
+
+    principal = issuer.verify(auth_dict["Token"])
+    if principal is None:
+        return False
+
+    auth_dict["Principal"] = principal
+    return True
 
 
 def authenticate_endpoint(app:flask.app, request:flask.request) -> bool:
@@ -101,13 +325,19 @@ def authenticate_endpoint(app:flask.app, request:flask.request) -> bool:
     if not app.config["api_config"]["security"]["whitelist"]:
         return True
 
-    sec_cfg = _get_endpoint_sec_cfg(app, str(request.url_rule), request.method)
+    sec_cfg = app.config["security_policy"].lookup(request.url_rule, request.method)
     if sec_cfg is None:
         flask.abort(403, "This endpoint has no security configuration and whitelisting is enabled")
     # Auth is disabled for this endpoint
     elif not sec_cfg["authentication"]:
         return True
 
+    # Environ keys can't be set by clients, only by RapidRest dispatching a sub-request in-process
+    delegated_principal = request.environ.get(DELEGATED_PRINCIPAL_KEY)
+    if delegated_principal is not None:
+        flask.g.principal = delegated_principal
+        return True
+
     # Check for auth header
     if "Authorization" not in request.headers:
         flask.abort(403, "Authorization header is missing")
@@ -134,5 +364,13 @@ def authenticate_endpoint(app:flask.app, request:flask.request) -> bool:
     if auth_method is None:
         flask.abort(400, f"There is no {auth_ver} authentication mechanism")
 
-    return auth_method(app, request, auth_dict)
+    if not auth_method(app, request, auth_dict):
+        return False
+
+    # Tokens are bearer credentials with their own expiry, replay protection only applies to signed requests
+    if auth_ver in HMAC_AUTH_VERSIONS:
+        _check_replay(app, auth_dict)
+
+    flask.g.principal = Principal(name=auth_dict["Principal"], auth_version=auth_ver)
+    return True
 
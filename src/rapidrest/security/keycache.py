@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Principal signing key cache, used to verify HMAC signatures locally instead of asking Vault for every request.
+
+This is opt-in, and is enabled through the `security.key_cache` section of `api_config.yml`:
+
+    security:
+      key_cache:
+        enabled: true
+        max_keys: 1024          # LRU capacity
+        ttl: 300                # Seconds a key is trusted before it is re-fetched
+        stale_ttl: 0            # Seconds past `ttl` an old key is still used while Vault is unavailable
+        negative_ttl: 30        # Seconds an unknown principal is remembered, so it isn't looked up on every request
+        key_path: "principals/{principal}"
+        key_field: "key"        # Field holding the base64 encoded key in the KV secret
+        secrets_mount: kv       # Defaults to the VAULT_SECRETS_MOUNT environment variable
+
+"""
+import base64
+import logging
+import os
+import threading
+import time
+
+from rapidrest import deadlines
+from rapidrest.cache import LruTtlCache
+from rapidrest.vault_access import VaultUnavailableError
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_KEYS = 1024
+DEFAULT_KEY_TTL = 300.0
+DEFAULT_STALE_TTL = 0.0
+DEFAULT_NEGATIVE_TTL = 30.0
+
+
+class PrincipalKeyCache:
+    """
+    Holds principal signing keys in a bounded LRU+TTL cache, fetching them through `loader` on a miss
+    """
+
+    def __init__(self, loader, max_keys:int=DEFAULT_MAX_KEYS, ttl:float=DEFAULT_KEY_TTL,
+                 stale_ttl:float=DEFAULT_STALE_TTL, negative_ttl:float=DEFAULT_NEGATIVE_TTL, clock=time.monotonic):
+        """
+        :param loader: Callable taking a principal name and returning the key as bytes (or None if unknown)
+        :param max_keys: Maximum number of keys to hold
+        :param ttl: How long (in seconds) a fetched key is used before it is fetched again
+        :param stale_ttl: How long past `ttl` a key may still be used if the loader reports Vault is unavailable
+        :param negative_ttl: How long (in seconds) a principal without a key is remembered, 0 to look it up every time
+        :param clock: Monotonic clock (overridable for tests)
+        """
+        self._loader = loader
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._clock = clock
+        # Entries are kept for the stale window too, freshness is checked against `ttl` here
+        self._cache = LruTtlCache(max_entries=max_keys, ttl=ttl + stale_ttl, clock=clock)
+        self._revoked = set()
+        self._revoked_lock = threading.Lock()
+        self.load_failures = 0
+        self.stale_served = 0
+
+
+    def get_key(self, principal:str) -> bytes or None:
+        """
+        Gets the signing key for a principal, loading it on a cache miss
+
+        :param principal: The principal name
+
+        :return: The key, or None if the principal is unknown or revoked
+        """
+        if principal in self._revoked:
+            return None
+
+        cached = self._cache.get(principal)
+        # Unknown principals are only cached for `negative_ttl`, so they are fresh for as long as they are cached
+        if cached is not None and (cached[1] is None or self._clock() - cached[0] < self._ttl):
+            return cached[1]
+
+        try:
+            key = self._loader(principal)
+        except deadlines.DeadlineExceeded:
+            # The request ran out of time rather than Vault failing, a stale key still beats a 504
+            if cached is not None:
+                self.stale_served += 1
+                return cached[1]
+            raise
+        except VaultUnavailableError as e:
+            self.load_failures += 1
+            if cached is not None:
+                self.stale_served += 1
+                _LOGGER.warning("Vault is unavailable (%s), using the stale key for principal '%s'", e, principal)
+                return cached[1]
+            _LOGGER.error("Failed to load the signing key for principal '%s': %s", principal, e)
+            return None
+        except Exception as e:
+            self.load_failures += 1
+            _LOGGER.error("Failed to load the signing key for principal '%s': %s", principal, e)
+            return None
+
+        # Revocation may have raced with the load, do not resurrect the key
+        if principal in self._revoked:
+            return None
+        if key is None:
+            if self._negative_ttl > 0:
+                self._cache.put(principal, (self._clock(), None), ttl=self._negative_ttl)
+            return None
+
+        self._cache.put(principal, (self._clock(), key))
+        return key
+
+
+    def evict(self, principal:str) -> bool:
+        """
+        Drops a principal's key from the cache, it will be re-fetched on the next request
+
+        :param principal: The principal name
+
+        :return: True if a key was cached for the principal
+        """
+        return self._cache.evict(principal)
+
+
+    def revoke(self, principal:str):
+        """
+        Drops a principal's key and refuses to load it again until `reinstate` is called
+
+        :param principal: The principal name
+        """
+        with self._revoked_lock:
+            self._revoked.add(principal)
+        self._cache.evict(principal)
+        _LOGGER.info("Revoked signing key for principal '%s'", principal)
+
+
+    def reinstate(self, principal:str):
+        """
+        Allows a previously revoked principal's key to be loaded again
+
+        :param principal: The principal name
+        """
+        with self._revoked_lock:
+            self._revoked.discard(principal)
+
+
+    def clear(self):
+        """
+        Drops every cached key (revocations are kept)
+        """
+        self._cache.clear()
+
+
+    def stats(self) -> dict:
+        """
+        Gets the cache counters, useful for sizing `max_keys` and `ttl`
+
+        :return: Mapping of counter names to values
+        """
+        stats = self._cache.stats()
+        stats["load_failures"] = self.load_failures
+        stats["stale_served"] = self.stale_served
+        stats["revoked"] = len(self._revoked)
+        return stats
+
+
+def vault_kv_key_loader(vault_fetcher, key_path:str, key_field:str="key", secrets_mount:str=None):
+    """
+    Creates a key loader which reads principal keys out of a Vault KV store
+
+    :param vault_fetcher: Callable returning the Vault client
+    :param key_path: KV path of a principal's key, `{principal}` is substituted with the principal name
+    :param key_field: The field in the secret that holds the base64 encoded key
+    :param secrets_mount: The KV mount point
+
+    :return: Key loader callable
+    """
+    def _loader(principal:str) -> bytes or None:
+        vault = vault_fetcher()
+        if not vault:
+            raise RuntimeError("Loading principal keys requires Vault, which is not enabled")
+
+        secret = vault.get_secrets(key_path.format(principal=principal), secrets_mount)
+        if not secret or key_field not in secret:
+            return None
+
+        return base64.b64decode(secret[key_field])
+
+    return _loader
+
+
+def from_api_config(api_config:dict, vault_fetcher) -> PrincipalKeyCache or None:
+    """
+    Creates the key cache described by the API config
+
+    :param api_config: The API configuration dictionary
+    :param vault_fetcher: Callable returning the Vault client
+
+    :return: The key cache, or None if local verification is not enabled
+    """
+    cache_cfg = api_config.get("security", {}).get("key_cache", {})
+    if not cache_cfg.get("enabled", False):
+        return None
+
+    loader = vault_kv_key_loader(
+        vault_fetcher,
+        cache_cfg.get("key_path", "principals/{principal}"),
+        key_field=cache_cfg.get("key_field", "key"),
+        secrets_mount=cache_cfg.get("secrets_mount", os.environ.get("VAULT_SECRETS_MOUNT")),
+    )
+
+    _LOGGER.info("Local HMAC verification enabled, caching up to %s principal keys",
+                 cache_cfg.get("max_keys", DEFAULT_MAX_KEYS))
+    return PrincipalKeyCache(
+        loader,
+        max_keys=cache_cfg.get("max_keys", DEFAULT_MAX_KEYS),
+        ttl=cache_cfg.get("ttl", DEFAULT_KEY_TTL),
+        stale_ttl=cache_cfg.get("stale_ttl", DEFAULT_STALE_TTL),
+        negative_ttl=cache_cfg.get("negative_ttl", DEFAULT_NEGATIVE_TTL),
+    )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Endpoint security policy table.
+
+The `security.endpoint_control` section of `api_config.yml` is compiled into an immutable table once the routes are
+built, so resolving an endpoint's security config during a request is a single dictionary lookup, and configuration
+mistakes are reported at boot rather than as 403s at runtime.
+
+"""
+import logging
+from types import MappingProxyType
+
+from rapidrest.exceptions import RapidRestError
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SecurityPolicyError(RapidRestError): pass
+
+
+class SecurityPolicy:
+    """
+    Immutable lookup of endpoint security configs, keyed by Werkzeug endpoint, URL rule and method
+    """
+
+    def __init__(self, table:dict):
+        """
+        :param table: Mapping of (endpoint, rule, method) to the method's security config
+        """
+        self._table = MappingProxyType(table)
+
+
+    def lookup(self, url_rule, method:str) -> MappingProxyType or None:
+        """
+        Gets the security config for the matched rule
+
+        :param url_rule: The matched werkzeug.routing.Rule
+        :param method: The HTTP method in use
+
+        :return: The security config for the endpoint, else None
+        """
+        return self._table.get((url_rule.endpoint, url_rule.rule, method))
+
+
+    def __len__(self):
+        return len(self._table)
+
+
+def _normalize_method_cfg(url_rule:str, method:str, method_cfg) -> MappingProxyType:
+    """
+    Validates a single method's security config
+
+    :param url_rule: The URL rule the config belongs to
+    :param method: The HTTP method the config belongs to
+    :param method_cfg: The raw config
+
+    :return: Read-only config
+    """
+    if not isinstance(method_cfg, dict):
+        raise SecurityPolicyError(f"Security config for {method} {url_rule} must be a mapping")
+    if "authentication" not in method_cfg:
+        raise SecurityPolicyError(f"Security config for {method} {url_rule} is missing 'authentication'")
+
+    authn = method_cfg["authentication"]
+    if isinstance(authn, dict):
+        # Any mapping used to be truthy, so `{required: false}` silently enforced authentication.  Rather than change
+        # what existing configs mean, make them say it.
+        raise SecurityPolicyError(f"'authentication' for {method} {url_rule} is a mapping, which has always enforced "
+                                  f"authentication whatever it holds; set it to true (or false) instead")
+    if not isinstance(authn, bool):
+        raise SecurityPolicyError(f"'authentication' for {method} {url_rule} must be a bool")
+
+    return MappingProxyType(dict(method_cfg, authentication=authn))
+
+
+def compile_security_policy(api_config:dict, registered_rules:list, log=_LOGGER) -> SecurityPolicy:
+    """
+    Compiles the endpoint security config against the registered routes
+
+    :param api_config: The API configuration dictionary
+    :param registered_rules: (endpoint, rule, methods) tuples recorded as the routes were added
+    :param log: The logger to report configuration problems to
+
+    :return: The compiled security policy
+    """
+    endpoint_control = api_config.get("security", {}).get("endpoint_control") or {}
+    if not isinstance(endpoint_control, dict):
+        raise SecurityPolicyError("'security.endpoint_control' must be a mapping of URL rules")
+
+    table = {}
+    uncovered = []
+    rule_methods = {}
+    for endpoint, url_rule, methods in registered_rules:
+        rule_methods.setdefault(url_rule, set()).update(methods)
+        rule_cfg = endpoint_control.get(url_rule) or {}
+        if not isinstance(rule_cfg, dict):
+            raise SecurityPolicyError(f"Security config for {url_rule} must be a mapping of HTTP methods")
+
+        for method in methods:
+            if method not in rule_cfg:
+                uncovered.append(f"{method} {url_rule}")
+                continue
+            table[(endpoint, url_rule, method)] = _normalize_method_cfg(url_rule, method, rule_cfg[method])
+
+    # Anything left over in the config can never match a request
+    for url_rule, rule_cfg in endpoint_control.items():
+        if url_rule not in rule_methods:
+            log.warning(f"Security config for '{url_rule}' does not match any registered route")
+            continue
+        for method in set(rule_cfg or ()).difference(rule_methods[url_rule]):
+            log.warning(f"Security config for {method} '{url_rule}' does not match a method the route accepts")
+
+    if uncovered and api_config.get("security", {}).get("whitelist", False):
+        log.info(f"Endpoints without a security config, these will be rejected while whitelisting is enabled: "
+                 f"{', '.join(uncovered)}")
+
+    return SecurityPolicy(table)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Replay protection for signed requests.
+
+Clients that add the signed `Date` (unix epoch seconds) and `Nonce` elements to their Authorization header can only
+use a given nonce once within the allowed clock skew window.  Nonces are remembered in a fixed size, time bucketed ring
+of sets, so memory use is bounded and each check is O(1).
+
+Configured through the `security.replay_protection` section of `api_config.yml`:
+
+    security:
+      replay_protection:
+        enabled: true
+        required: false             # Reject requests that do not carry Date/Nonce
+        skew_window: 300            # Seconds a request's Date may differ from the server clock
+        bucket_seconds: 10
+        max_nonces_per_bucket: 100000
+
+"""
+import logging
+import math
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Check results
+ACCEPTED = "accepted"
+REPLAYED = "replayed"
+STALE = "stale"
+OVERFLOW = "overflow"
+
+
+class ReplayCache:
+    """
+    Remembers (principal, nonce) pairs for as long as their timestamp is inside the skew window
+    """
+
+    def __init__(self, skew_window:int=300, bucket_seconds:int=10, max_nonces_per_bucket:int=100000,
+                 required:bool=False, clock=time.time):
+        """
+        :param skew_window: Seconds a request timestamp may be in the past or future
+        :param bucket_seconds: Width of each time bucket
+        :param max_nonces_per_bucket: Nonces held per bucket, a full bucket rejects new requests
+        :param required: Whether requests without a Date/Nonce are rejected
+        :param clock: Wall clock, as unix epoch seconds (overridable for tests)
+        """
+        self.skew_window = skew_window
+        self.bucket_seconds = bucket_seconds
+        self.max_nonces_per_bucket = max_nonces_per_bucket
+        self.required = required
+        self._clock = clock
+
+        # Enough buckets to span the whole window on either side of now, plus the partially filled ones at each end
+        self._ring_size = math.ceil(2 * skew_window / bucket_seconds) + 2
+        self._ring_ids = [None] * self._ring_size
+        self._ring = [set() for _ in range(self._ring_size)]
+        self._lock = threading.Lock()
+
+        self.counters = {ACCEPTED: 0, REPLAYED: 0, STALE: 0, OVERFLOW: 0}
+
+
+    def check(self, principal:str, timestamp:int, nonce:str) -> str:
+        """
+        Checks a request's timestamp and nonce, recording the nonce if the request is accepted
+
+        :param principal: The authenticated principal
+        :param timestamp: The signed request timestamp (unix epoch seconds)
+        :param nonce: The signed request nonce
+
+        :return: ACCEPTED, or the reason the request was rejected (REPLAYED, STALE, OVERFLOW)
+        """
+        if abs(self._clock() - timestamp) > self.skew_window:
+            with self._lock:
+                self.counters[STALE] += 1
+            return STALE
+
+        bucket_id = int(timestamp // self.bucket_seconds)
+        slot = bucket_id % self._ring_size
+        key = hash((principal, nonce))
+
+        with self._lock:
+            nonces = self._ring[slot]
+            if self._ring_ids[slot] != bucket_id:
+                # Whatever was in this slot is now outside the window
+                nonces.clear()
+                self._ring_ids[slot] = bucket_id
+            elif key in nonces:
+                self.counters[REPLAYED] += 1
+                return REPLAYED
+            elif len(nonces) >= self.max_nonces_per_bucket:
+                self.counters[OVERFLOW] += 1
+                return OVERFLOW
+
+            nonces.add(key)
+            self.counters[ACCEPTED] += 1
+
+        return ACCEPTED
+
+
+    def stats(self) -> dict:
+        """
+        Gets the check counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        stats["buckets"] = self._ring_size
+        stats["capacity"] = self._ring_size * self.max_nonces_per_bucket
+        return stats
+
+
+def from_api_config(api_config:dict) -> ReplayCache or None:
+    """
+    Creates the replay cache described by the API config
+
+    :param api_config: The API configuration dictionary
+
+    :return: The replay cache, or None if replay protection is not enabled
+    """
+    replay_cfg = api_config.get("security", {}).get("replay_protection", {})
+    if not replay_cfg.get("enabled", False):
+        return None
+
+    cache = ReplayCache(
+        skew_window=replay_cfg.get("skew_window", 300),
+        bucket_seconds=replay_cfg.get("bucket_seconds", 10),
+        max_nonces_per_bucket=replay_cfg.get("max_nonces_per_bucket", 100000),
+        required=replay_cfg.get("required", False),
+    )
+    _LOGGER.info("Replay protection enabled, with a %s second skew window", cache.skew_window)
+    return cache
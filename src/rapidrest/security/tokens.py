@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Short-lived session tokens.
+
+A client that authenticates once with an HMAC signed request (v1 or v2) can POST to `/_token` to get a token which it
+then sends as `Authorization: Version:t1;Token:<token>`.  Tokens carry the principal and an expiry and are MAC'd with a
+server-side key, so they are verified locally without contacting Vault.
+
+Configured through the `security.session_tokens` section of `api_config.yml`:
+
+    security:
+      session_tokens:
+        enabled: true
+        ttl: 300                        # Token lifetime in seconds
+        keys_path: session_token_keys   # KV path of the signing keyring (see vault_integration)
+        secrets_mount: kv               # Defaults to the VAULT_SECRETS_MOUNT environment variable
+
+The keyring is re-read along with the API's secrets (`vault.secrets_refresh_interval`), so a new `current` key is picked
+up without a restart.
+
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+
+import flask
+
+from rapidrest import vault_integration
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.security import authentication
+
+_LOGGER = logging.getLogger(__name__)
+
+TOKEN_ENDPOINT = "/_token"
+DEFAULT_TOKEN_TTL = 300
+
+
+def _b64encode(data:bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data:str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionTokenIssuer:
+    """
+    Issues and verifies session tokens, formatted as `<base64url payload>.<base64url HMAC-SHA256>`, where the payload is
+    `<key id>|<expiry>|<principal>`
+    """
+
+    def __init__(self, keys:dict, current_kid:str, ttl:int=DEFAULT_TOKEN_TTL, clock=time.time):
+        """
+        :param keys: Mapping of key ID to signing key
+        :param current_kid: The key ID new tokens are signed with
+        :param ttl: Token lifetime in seconds
+        :param clock: Wall clock, as unix epoch seconds (overridable for tests)
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._keyring = None
+        self.rotate(keys, current_kid)
+
+
+    def rotate(self, keys:dict, current_kid:str):
+        """
+        Swaps in a new keyring.  Keep the previous key in `keys` for at least one TTL, or tokens it signed will stop
+        working early.
+
+        :param keys: Mapping of key ID to signing key
+        :param current_kid: The key ID new tokens are signed with
+        """
+        if current_kid not in keys:
+            raise ValueError(f"The current key ID '{current_kid}' is not in the keyring")
+
+        # A single attribute assignment, so verifying threads see either the old or the new keyring
+        self._keyring = (dict(keys), current_kid)
+
+
+    @property
+    def keyring(self) -> tuple:
+        """
+        :return: (dict of key ID to key, current key ID)
+        """
+        return self._keyring
+
+
+    def issue(self, principal:str) -> tuple:
+        """
+        Issues a token for a principal
+
+        :param principal: The authenticated principal name
+
+        :return: (token, expiry as unix epoch seconds)
+        """
+        keys, kid = self._keyring
+        expires = int(self._clock()) + self.ttl
+
+        payload = _b64encode(f"{kid}|{expires}|{principal}".encode("utf-8"))
+        mac = hmac.new(keys[kid], payload.encode("ascii"), hashlib.sha256).digest()
+
+        return f"{payload}.{_b64encode(mac)}", expires
+
+
+    def verify(self, token:str) -> str or None:
+        """
+        Verifies a token
+
+        :param token: The token provided by the client
+
+        :return: The principal name, or None if the token is invalid or expired
+        """
+        try:
+            payload, mac = token.split(".")
+            kid, expires, principal = _b64decode(payload).decode("utf-8").split("|", 2)
+            expires = int(expires)
+            mac = _b64decode(mac)
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            return None
+
+        keys, _ = self._keyring
+        if kid not in keys:
+            return None
+
+        expected = hmac.new(keys[kid], payload.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, mac):
+            return None
+
+        if expires <= self._clock():
+            return None
+
+        return principal
+
+
+class SessionToken(ApiResource):
+    """
+    Exchanges an HMAC authenticated request for a session token
+    """
+    endpoint_name = "_token"
+    description = "Session token endpoint"
+
+    def post(self):
+        """
+        Issues a session token for the principal that signed this request
+
+        :return: ApiResponse with the token and its expiry
+        """
+        principal = flask.g.get("principal")
+        if principal is None or principal.auth_version not in authentication.HMAC_AUTH_VERSIONS:
+            flask.abort(403, "Session tokens can only be issued to HMAC authenticated requests")
+
+        token, expires = flask.current_app.config["token_issuer"].issue(principal.name)
+        return ApiResponse(
+            body={
+                "token": token,
+                "expires": expires,
+                "auth_version": authentication.TOKEN_AUTH_VERSION,
+            },
+            status_code=200
+        )
+
+
+def create_token_auth_header(token:str) -> str:
+    """
+    Creates a session token auth header
+
+    :param token: The token issued by the token endpoint
+
+    :return: The auth header
+    """
+    return f"Version:{authentication.TOKEN_AUTH_VERSION};Token:{token}"
+
+
+def from_api_config(api_config:dict, vault_fetcher) -> SessionTokenIssuer or None:
+    """
+    Creates the session token issuer described by the API config
+
+    :param api_config: The API configuration dictionary
+    :param vault_fetcher: Callable returning the Vault client
+
+    :return: The token issuer, or None if session tokens are not enabled
+    """
+    token_cfg = api_config.get("security", {}).get("session_tokens", {})
+    if not token_cfg.get("enabled", False):
+        return None
+
+    keys, current_kid = dict(), None
+    vault = vault_fetcher()
+    if vault:
+        keys, current_kid = vault_integration.load_token_signing_keys(
+            vault, token_cfg.get("keys_path", "session_token_keys"), token_cfg.get("secrets_mount"))
+
+    if not keys:
+        _LOGGER.warning("No session token keys could be loaded from Vault, using a key local to this process, tokens "
+                        "will not be accepted by other workers")
+        keys, current_kid = {"local": secrets.token_bytes(32)}, "local"
+
+    _LOGGER.info("Session tokens enabled, signing with key '%s'", current_kid)
+    return SessionTokenIssuer(keys, current_kid, ttl=token_cfg.get("ttl", DEFAULT_TOKEN_TTL))
+
+
+def reload_keys(issuer:SessionTokenIssuer or None, api_config:dict, vault) -> bool:
+    """
+    Re-reads the signing keyring from Vault, and rotates the issuer onto it if it changed.  A keyring that can't be
+    loaded leaves the current one in use.
+
+    :param issuer: The token issuer, None if session tokens are not enabled
+    :param api_config: The API configuration dictionary
+    :param vault: The Vault client
+
+    :return: True if the issuer was rotated
+    """
+    if issuer is None or not vault:
+        return False
+
+    token_cfg = api_config.get("security", {}).get("session_tokens", {})
+    keys, current_kid = vault_integration.load_token_signing_keys(
+        vault, token_cfg.get("keys_path", "session_token_keys"), token_cfg.get("secrets_mount"))
+    if not keys or (keys, current_kid) == issuer.keyring:
+        return False
+
+    issuer.rotate(keys, current_kid)
+    _LOGGER.info("Session token keyring changed in Vault, now signing with key '%s'", current_kid)
+    return True
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Startup tracing, to find out where a slow boot spends its time.
+
+Tracing is opt-in, enabled per deploy with the API_STARTUP_TRACE environment variable: `log` (or `1`) logs the trace
+as a single JSON line, anything else is taken as the path of a file to write it to.  The trace has the wall time, CPU
+time and traced memory delta of each startup phase, of each imported API module and of each integration module's
+bootstrap.  Module times include the modules they import themselves.  Memory is traced with tracemalloc, which slows
+imports down noticeably, so leave tracing off unless you are looking at a trace.
+
+A startup budget can be set in `api_config.yml`, or with API_STARTUP_BUDGET, whether tracing is on or not:
+
+    startup:
+      budget: 20          # Seconds, the boot fails if startup takes longer
+
+"""
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StartupTracer:
+    """
+    Records how long startup phases and spans (module imports, integration bootstraps) take
+    """
+
+    def __init__(self, enabled:bool=False, clock=time.perf_counter, cpu_clock=time.process_time):
+        """
+        :param enabled: Whether to record phases and spans, the total startup time is always tracked
+        :param clock: Wall clock (overridable for tests)
+        :param cpu_clock: CPU clock (overridable for tests)
+        """
+        self.enabled = enabled
+        self._clock = clock
+        self._cpu_clock = cpu_clock
+        self._started = clock()
+        self._cpu_started = cpu_clock()
+        self._owns_tracemalloc = False
+        self.phases = []
+        self.spans = {}
+
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+
+
+    @contextmanager
+    def phase(self, name:str):
+        """
+        Records a startup phase
+
+        :param name: The phase name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._measure(self.phases, name):
+            yield
+
+
+    @contextmanager
+    def span(self, kind:str, name:str):
+        """
+        Records a span, such as a module import, within the current phase
+
+        :param kind: The kind of span (e.g. "modules"), spans are grouped by kind in the report
+        :param name: The span name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._measure(self.spans.setdefault(kind, []), name):
+            yield
+
+
+    @property
+    def elapsed(self) -> float:
+        return self._clock() - self._started
+
+
+    def report(self) -> dict:
+        """
+        Builds the trace report, and stops memory tracing if this tracer started it
+
+        :return: The report
+        """
+        report = {
+            "wall_s": round(self.elapsed, 6),
+            "cpu_s": round(self._cpu_clock() - self._cpu_started, 6),
+            "phases": self.phases,
+        }
+        report.update(self.spans)
+
+        if self._owns_tracemalloc:
+            report["memory_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+
+        return report
+
+
+    @contextmanager
+    def _measure(self, records:list, name:str):
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        wall = self._clock()
+        cpu = self._cpu_clock()
+        try:
+            yield
+        finally:
+            record = {
+                "name": name,
+                "wall_s": round(self._clock() - wall, 6),
+                "cpu_s": round(self._cpu_clock() - cpu, 6),
+            }
+            if memory is not None and tracemalloc.is_tracing():
+                record["memory_delta_bytes"] = tracemalloc.get_traced_memory()[0] - memory
+            records.append(record)
+
+
+# Used wherever no tracer has been set up, e.g. when routes are loaded outside of `application.start`
+NULL_TRACER = StartupTracer(enabled=False)
+
+
+def tracer_for(app) -> StartupTracer:
+    """
+    Gets the startup tracer of an application
+
+    :param app: The application
+
+    :return: The tracer, a disabled one if the application has none
+    """
+    return app.config.get("startup_tracer") or NULL_TRACER
+
+
+def from_environment() -> StartupTracer:
+    """
+    Creates the startup tracer, which has to exist before the API config is loaded
+
+    :return: The tracer, enabled if API_STARTUP_TRACE is set
+    """
+    return StartupTracer(enabled=bool(os.environ.get("API_STARTUP_TRACE")))
+
+
+def startup_budget(api_config:dict) -> float or None:
+    """
+    Gets the configured startup budget
+
+    :param api_config: The API configuration dictionary
+
+    :return: The budget in seconds, or None if startup time is not limited
+    """
+    budget = os.environ.get("API_STARTUP_BUDGET") or api_config.get("startup", {}).get("budget")
+    return float(budget) if budget else None
+
+
+def finish(tracer:StartupTracer, api_config:dict) -> bool:
+    """
+    Emits the startup trace (if tracing is enabled) and checks the startup budget
+
+    :param tracer: The startup tracer
+    :param api_config: The API configuration dictionary
+
+    :return: False if startup took longer than its budget
+    """
+    budget = startup_budget(api_config)
+    elapsed = tracer.elapsed
+
+    if tracer.enabled:
+        report = tracer.report()
+        report["budget_s"] = budget
+        destination = os.environ.get("API_STARTUP_TRACE")
+        if destination.lower() in ("1", "true", "log"):
+            _LOGGER.info("Startup trace: %s", json.dumps(report))
+        else:
+            with open(destination, "w") as trace_file:
+                json.dump(report, trace_file, indent=2)
+            _LOGGER.info("Wrote startup trace to %s", destination)
+
+    if budget is not None and elapsed > budget:
+        _LOGGER.error("Startup took %.3fs, which is over its budget of %ss", elapsed, budget)
+        return False
+
+    return True
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Streams collections to the client as they are produced, instead of building the whole body first.
+
+A handler streams by returning an iterator (typically a generator) as an `ApiResponse` body, or as a
+`JSONAPIResponse`'s `data`.  Items are serialized one at a time and written in chunks of about STREAM_FLUSH_SIZE bytes,
+as a JSON array, or as newline delimited JSON if the client prefers `application/x-ndjson` in its Accept header.
+
+The first item is fetched while the handler is still running, so a generator that fails straight away gets a normal
+error response.  Once the first bytes are out the status can't change, so a failure mid-stream is logged, signalled
+with a final error record in NDJSON streams (shaped like RapidRest's error responses), and then re-raised so the
+server aborts the response; JSON array clients are left with a truncated document they can't mistake for a complete
+one.
+
+"""
+import contextvars
+from collections.abc import Iterator
+
+import flask
+
+STREAM_FLUSH_SIZE = 64 * 1024
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+_NOTHING = object()
+
+
+def is_stream(body) -> bool:
+    """
+    Checks whether a response body should be streamed
+
+    :param body: The body a handler returned
+
+    :return: True for iterators (e.g. generators), dicts, lists and prebuilt bodies are sent as they are
+    """
+    return isinstance(body, Iterator)
+
+
+class StreamedItems:
+    """
+    Iterates a handler's items in the context the handler ran in, so generators can keep using the request state
+    (`self._current_request`, `flask.request`...) after the handler has returned
+    """
+    __slots__ = ("_context", "_iterator", "_first")
+
+    def __init__(self, items):
+        """
+        Must be created while the handler's request is being dispatched, this fetches the first item
+
+        :param items: The handler's iterable
+        """
+        self._context = contextvars.copy_context()
+        self._iterator = iter(items)
+        self._first = self._context.run(next, self._iterator, _NOTHING)
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        if self._first is not _NOTHING:
+            item, self._first = self._first, _NOTHING
+            return item
+
+        return self._context.run(next, self._iterator)
+
+
+def negotiate_mimetype(request:flask.Request) -> str:
+    """
+    Picks the stream format from the request's Accept header
+
+    :param request: The current request
+
+    :return: JSON_MIMETYPE or NDJSON_MIMETYPE
+    """
+    return request.accept_mimetypes.best_match((JSON_MIMETYPE, NDJSON_MIMETYPE), default=JSON_MIMETYPE)
+
+
+def stream_items(items, json_codec, ndjson:bool=False, prefix:bytes=b"[", suffix:bytes=b"]",
+                 flush_size:int=STREAM_FLUSH_SIZE):
+    """
+    Serializes items into body chunks
+
+    :param items: The items to serialize
+    :param json_codec: The codec to serialize them with
+    :param ndjson: Write newline delimited JSON rather than a JSON array
+    :param prefix: Bytes written before the first item of a JSON array
+    :param suffix: Bytes written after the last item of a JSON array
+    :param flush_size: Chunk size to aim for
+
+    :return: Generator of body chunks
+    """
+    if ndjson:
+        prefix = suffix = b""
+
+    buffer = bytearray(prefix)
+    first = True
+    try:
+        for item in items:
+            if ndjson:
+                buffer += json_codec.dumps(item)
+                buffer += b"\n"
+            else:
+                if not first:
+                    buffer += b","
+                buffer += json_codec.dumps(item)
+            first = False
+
+            if len(buffer) >= flush_size:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception as e:
+        flask.current_app.logger.exception(f"Response stream failed: {e}")
+        if ndjson:
+            buffer += json_codec.dumps({
+                "err": True,
+                "err_type": f"Unknown:{e.__class__.__name__}",
+                "err_detail": str(e),
+            })
+            buffer += b"\n"
+        yield bytes(buffer)
+        raise
+
+    buffer += suffix
+    yield bytes(buffer)
+
+
+def stream_body(chunks):
+    """
+    Keeps the request context around while the body is streamed, if there is one
+
+    :param chunks: Generator of body chunks
+
+    :return: The response body
+    """
+    return flask.stream_with_context(chunks) if flask.has_request_context() else chunks
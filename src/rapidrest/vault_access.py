@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Thread-safe access layer around the Vault client.
+
+Every Vault call made through `VaultAccess` runs on a small, bounded worker pool with a deadline, and is guarded by a
+circuit breaker, so a slow or failing Vault makes requests fail fast instead of tying up every worker thread.  The pool
+multiplexes the single logged in client (the wrapped secret-id can only be used once), whose HTTP session keeps its
+connections to Vault alive between calls.
+
+Configured through the `vault` section of `api_config.yml`:
+
+    vault:
+      max_concurrency: 8          # Vault calls in flight at once
+      max_queued: 32              # Calls allowed to wait for a free worker, beyond that calls fail immediately
+      call_timeout: 5             # Seconds a call (including time spent queued) may take, less if the request it
+                                  # is made for has less time left (see rapidrest.deadlines)
+      circuit_breaker:
+        failure_threshold: 5      # Consecutive failures that open the breaker
+        reset_timeout: 30         # Seconds the breaker stays open before a probe call is allowed through
+
+Only failures that say Vault is unhealthy (connection errors, timeouts and 5xx responses) count towards the breaker;
+an error Vault answered with, such as a missing secret or a denied request, counts as a success.
+
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from rapidrest import deadlines
+from rapidrest.exceptions import RapidRestVaultError
+
+try:
+    from hvac import exceptions as hvac_exceptions
+except ImportError:
+    hvac_exceptions = None
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class VaultUnavailableError(RapidRestVaultError): pass
+class VaultTimeoutError(VaultUnavailableError): pass
+
+
+def is_vault_failure(error:Exception) -> bool:
+    """
+    Checks whether an exception raised by a Vault call means Vault itself is failing
+
+    :param error: The exception
+
+    :return: True for transport errors, timeouts and 5xx responses
+    """
+    # Connection errors and timeouts, including requests' own, are OSErrors
+    if isinstance(error, OSError):
+        return True
+    if hvac_exceptions is not None and isinstance(error, (hvac_exceptions.InternalServerError,
+                                                          hvac_exceptions.VaultDown, hvac_exceptions.BadGateway)):
+        return True
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class CircuitBreaker:
+    """
+    Classic three state circuit breaker.  Closed lets everything through, open rejects everything until
+    `reset_timeout` has passed, then half-open lets a single probe call through to decide which way to go.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold:int=5, reset_timeout:float=30.0, clock=time.monotonic):
+        """
+        :param failure_threshold: Consecutive failures before the breaker opens
+        :param reset_timeout: Seconds to stay open before allowing a probe
+        :param clock: Monotonic clock (overridable for tests)
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+
+    def allow(self) -> bool:
+        """
+        Checks whether a call may go through
+
+        :return: True if the call is allowed
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+
+            # Half-open, only one probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+
+    def release_probe(self):
+        """
+        Ends a call that neither succeeded nor failed (e.g. abandoned by its caller), so if it was the half-open probe
+        another call can take its place
+        """
+        with self._lock:
+            self._probing = False
+
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.trips += 1
+                    _LOGGER.warning("Vault circuit breaker opened after %s failure(s)", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class VaultAccess:
+    """
+    Wraps a Vault client so that its methods run on a bounded worker pool, with per-call deadlines and a circuit
+    breaker.  Attribute access is forwarded to the client, so this can be used wherever the client was.
+    """
+
+    def __init__(self, client, max_concurrency:int=8, max_queued:int=32, call_timeout:float=5.0,
+                 breaker:CircuitBreaker=None):
+        """
+        :param client: The logged in Vault client
+        :param max_concurrency: Maximum number of Vault calls in flight
+        :param max_queued: Maximum number of calls waiting for a free worker
+        :param call_timeout: Default deadline for a call, in seconds
+        :param breaker: The circuit breaker, a default one is created if not provided
+        """
+        self._client = client
+        self.call_timeout = call_timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vault-access")
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queued)
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "deadline_exceeded": 0,
+            "rejected": 0,
+            "saturated": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+        }
+
+
+    def call(self, method_name:str, *args, timeout:float=None, **kwargs):
+        """
+        Calls a method on the Vault client
+
+        :param method_name: The client method to call
+        :param timeout: Overrides the default deadline for this call
+        :param args: Positional arguments for the method
+        :param kwargs: Keyword arguments for the method
+
+        :raises VaultUnavailableError: The breaker is open or the pool is saturated
+        :raises VaultTimeoutError: The call did not complete before its deadline
+        :raises deadlines.DeadlineExceeded: The request the call is made for ran out of time
+
+        :return: Whatever the client method returns
+        """
+        timeout = self.call_timeout if timeout is None else timeout
+        method = getattr(self._client, method_name)
+
+        deadline = deadlines.current()
+        if deadline is not None:
+            deadline.check(deadlines.VAULT)
+            timeout = min(timeout, deadline.remaining())
+
+        if not self._slots.acquire(blocking=False):
+            self._count("saturated")
+            raise VaultUnavailableError("Too many Vault calls are waiting")
+
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count("rejected")
+            raise VaultUnavailableError("Vault circuit breaker is open")
+
+        self._track_in_flight(1)
+        try:
+            future = self._executor.submit(method, *args, **kwargs)
+        except RuntimeError:
+            self._release()
+            self.breaker.release_probe()
+            raise VaultUnavailableError("The Vault access layer has been shut down")
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            if deadline is not None and deadline.expired():
+                # The request gave up on Vault, which isn't necessarily slow, so the breaker isn't told
+                self._count("deadline_exceeded")
+                self.breaker.release_probe()
+                deadline.check(deadlines.VAULT)
+            self._count("timeouts")
+            self.breaker.record_failure()
+            raise VaultTimeoutError(f"Vault call '{method_name}' did not complete within {timeout}s")
+        except Exception as e:
+            if not is_vault_failure(e):
+                # Vault answered, it just didn't like the call
+                self.breaker.record_success()
+                raise
+            self._count("failures")
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        return result
+
+
+    def stats(self) -> dict:
+        """
+        Gets the pool and breaker counters
+
+        :return: Mapping of counter names to values
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats["max_concurrency"] = self.max_concurrency
+        stats["utilisation"] = min(stats["in_flight"], self.max_concurrency) / self.max_concurrency
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_trips"] = self.breaker.trips
+        return stats
+
+
+    def shutdown(self):
+        """
+        Stops the worker pool, calls made afterwards fail with VaultUnavailableError
+        """
+        self._executor.shutdown(wait=False)
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def _proxy(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+
+        return _proxy
+
+
+    def __str__(self):
+        return str(self._client)
+
+
+    def _release(self):
+        self._track_in_flight(-1)
+        self._slots.release()
+
+
+    def _track_in_flight(self, delta:int):
+        with self._lock:
+            self._counters["in_flight"] += delta
+            if delta > 0:
+                self._counters["calls"] += 1
+                self._counters["peak_in_flight"] = max(self._counters["peak_in_flight"],
+                                                       self._counters["in_flight"])
+
+
+    def _count(self, counter:str):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+def from_api_config(api_config:dict, client):
+    """
+    Wraps a Vault client in the access layer described by the API config
+
+    :param api_config: The API configuration dictionary
+    :param client: The Vault client, as returned by vault_integration.enable_vault
+
+    :return: VaultAccess, or `client` unchanged if Vault is not enabled
+    """
+    if not client:
+        return client
+
+    vault_cfg = api_config.get("vault", {})
+    breaker_cfg = vault_cfg.get("circuit_breaker", {})
+
+    return VaultAccess(
+        client,
+        max_concurrency=vault_cfg.get("max_concurrency", 8),
+        max_queued=vault_cfg.get("max_queued", 32),
+        call_timeout=vault_cfg.get("call_timeout", 5.0),
+        breaker=CircuitBreaker(
+            failure_threshold=breaker_cfg.get("failure_threshold", 5),
+            reset_timeout=breaker_cfg.get("reset_timeout", 30.0),
+        ),
+    )
@@ -3,27 +3,119 @@
 Provides Vault integration functionality for RapidRest
 
 """
+import base64
 import importlib
 import logging
 import os
+import re
+import threading
+import time
+import weakref
+from types import MappingProxyType
 
-from rapidrest import utils
+from rapidrest import utils, vault_access
+
+try:
+    import hvac
+except ImportError:
+    hvac = None
 
 _LOGGER = logging.getLogger("vault_integration")
 
+DEFAULT_SECRETS_RETRY_INTERVAL = 30
+# Share of the token's lease that may go by before it is renewed
+TOKEN_RENEW_FRACTION = 2 / 3
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+class VaultHandle:
+    """
+    Per-process handle on the application's Vault access layer.  Vault is resolved (logged into) the first time the
+    handle is used in a process, after which getting it is just a flag check.  Forked children (e.g. gunicorn workers
+    under `--preload`) drop the parent's client, whose worker threads don't survive the fork and whose connections
+    must not be shared, and resolve their own on first use.
+    """
+
+    def __init__(self, app):
+        """
+        :param app: The Flask application
+        """
+        self._app = app
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._parent_vault = None
+        _HANDLES.add(self)
+
+
+    def get(self):
+        """
+        Gets the Vault access layer for this process
+
+        :return: vault_access.VaultAccess, or None if Vault is not enabled
+        """
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self._resolve()
+                    self._resolved = True
+
+        return self._app.config.get("_vault")
+
+
+    def _resolve(self):
+        load_vault(self._app)
+        if self._parent_vault is None:
+            return
+
+        vault = self._app.config.get("_vault")
+        if not vault:
+            # The wrapped secret-id is single use, so a child may not be able to log in again.  Fall back to the
+            # parent's token, with a client (and connections) of its own, rather than running without Vault.
+            _LOGGER.warning("Could not log into Vault after fork, reusing the parent process' Vault token")
+            client = _client_from_token(getattr(self._parent_vault, "_client", self._parent_vault))
+            vault = self._app.config["_vault"] = vault_access.from_api_config(self._app.config["api_config"], client)
+
+        refresher = self._app.config.get("secrets_refresher")
+        if refresher is not None and vault:
+            refresher.restart(vault)
+        self._parent_vault = None
+
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._resolved:
+            self._parent_vault = self._app.config.get("_vault")
+            self._app.config["_vault"] = None
+            self._resolved = False
+
+
+_HANDLES = weakref.WeakSet()
+
+
+def _reset_handles_after_fork():
+    for handle in list(_HANDLES):
+        handle._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_handles_after_fork)
+
+
 def load_vault(app):
     """
+    Gets the application's Vault access layer, logging into Vault the first time it's needed
 
-    :return:
+    :return: vault_access.VaultAccess, or None if Vault is not enabled
     """
     if "_vault" in app.config and app.config["_vault"] is not None:
         return app.config["_vault"]
 
     if "VAULT_URL" in os.environ and os.environ["VAULT_URL"] != "":
-        app.config["_vault"] = enable_vault()
-        app.config["api_config"]["secrets"] = load_secrets_from_vault()
+        app.config["_vault"] = vault_access.from_api_config(app.config["api_config"], enable_vault())
+        secrets = load_secrets_from_vault(app.config["_vault"])
+        # A forked child that could not log in (or read them) keeps the secrets its parent loaded
+        if secrets or "secrets" not in app.config["api_config"]:
+            app.config["api_config"]["secrets"] = MappingProxyType(secrets)
 
-    return app.config["_vault"]
+    return app.config.get("_vault")
 
 
 def enable_vault():
@@ -75,19 +167,275 @@ def enable_vault():
     return vc
 
 
-def load_secrets_from_vault() -> dict:
+def _client_from_token(parent_client):
+    """
+    Creates a Vault client logged in with another client's token, for forked children that can't log in themselves.
+    The new client opens its own connections instead of sharing the parent's sockets.
+
+    :param parent_client: The parent process' Vault client
+
+    :return: vaultclient.VaultClient or None on failure
+    """
+    token = getattr(parent_client, "token", None)
+    if not token:
+        _LOGGER.error("The parent process' Vault client has no token to reuse")
+        return None
+
+    try:
+        vaultclient = importlib.import_module("vaultclient")
+        vc = vaultclient.VaultClient(
+            os.environ["VAULT_URL"],
+            os.environ["VAULT_ROLE_ID"],
+            os.environ["VAULT_WRAPPED_SECRET"]
+        )
+        vc.token = token
+    except Exception as e:
+        _LOGGER.error(f"Failed to create a Vault client from the parent's token: {e}")
+        return None
+
+    if not vc.logged_in:
+        _LOGGER.error("The parent process' Vault token is no longer valid")
+        return None
+
+    return vc
+
+
+def load_secrets_from_vault(vault) -> dict:
     """
     Loads the API's secrets from Vault
 
+    :param vault: The Vault client
+
     :return Dictionary of secrets on success, empty dict otherwise
     """
+    if not vault:
+        return dict()
 
     # If Vault is enabled, we will fetch the application's keys from Vault storage
     try:
-        secrets = _VAULT_CLIENT.get_secrets(os.environ["VAULT_SECRETS_PATH"], os.environ["VAULT_SECRETS_MOUNT"])
+        secrets = vault.get_secrets(os.environ["VAULT_SECRETS_PATH"], os.environ["VAULT_SECRETS_MOUNT"])
     except Exception as e:
         _LOGGER.error("Could not load secrets from Vault: %s", e)
         return dict()
 
     _LOGGER.info("Loaded secrets from Vault")
-    return secrets
+    return secrets if secrets else dict()
+
+
+def _parse_duration(duration) -> int or None:
+    """
+    Parses a Vault style duration, either seconds or a string such as '90s', '5m' or '1h'
+
+    :param duration: The duration
+
+    :return: Seconds, or None if the duration could not be parsed
+    """
+    if isinstance(duration, int):
+        return duration
+
+    match = re.fullmatch(r"(\d+)([smh]?)", str(duration).strip())
+    if match is None:
+        return None
+
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+class SecretsRefresher:
+    """
+    Re-reads the API's secrets from Vault in the background.  Each refresh builds a new read-only mapping and swaps it
+    into `api_config["secrets"]` with a single assignment, so request threads never need a lock to read secrets.
+
+    The refresh interval comes from the secret's own `ttl` field when it has one (Vault's KV refresh hint), otherwise
+    from `vault.secrets_refresh_interval` in `api_config.yml`.  The refresher also keeps the Vault token alive: it renews
+    it (renew-self, which needs the `hvac` package) once two thirds of its lease have gone by, and logs in again if it
+    can't be renewed.
+    """
+
+    def __init__(self, api_config:dict, vault, interval:int, on_refresh=None, reloaders=()):
+        """
+        :param api_config: The API configuration dictionary, its `secrets` key is replaced on each refresh
+        :param vault: The Vault client
+        :param interval: Default seconds between refreshes
+        :param on_refresh: Optional callable, invoked with the new secrets mapping whenever the secrets change
+        :param reloaders: Callables invoked after every successful refresh, whether or not the secrets changed, to
+                          re-read what is kept at other paths (such as the session token keyring)
+        """
+        self._api_config = api_config
+        self._vault = vault
+        self.interval = interval
+        self._on_refresh = on_refresh
+        self._reloaders = tuple(reloaders)
+        self._token_client = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.failures = 0
+        self.renewals = 0
+        self.renewal_failures = 0
+
+
+    def start(self):
+        """
+        Starts the background refresh thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vault-secrets-refresher", daemon=True)
+        self._thread.start()
+        _LOGGER.info("Refreshing secrets from Vault every %ss", self.interval)
+
+
+    def stop(self):
+        """
+        Stops the background refresh thread
+        """
+        self._stop.set()
+
+
+    def restart(self, vault):
+        """
+        Restarts refreshing with a different Vault client, used in forked children where the thread is gone
+
+        :param vault: The Vault client
+        """
+        self._vault = vault
+        self._token_client = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
+
+
+    def refresh(self) -> int:
+        """
+        Re-reads the secrets and swaps them in if they changed
+
+        :return: Seconds until the next refresh should happen
+        """
+        retry_interval = min(self.interval, DEFAULT_SECRETS_RETRY_INTERVAL)
+        if not getattr(self._vault, "logged_in", True):
+            self.failures += 1
+            _LOGGER.error("Vault client is no longer logged in, secrets cannot be refreshed")
+            return retry_interval
+
+        try:
+            secrets = self._vault.get_secrets(os.environ["VAULT_SECRETS_PATH"], os.environ["VAULT_SECRETS_MOUNT"])
+        except Exception as e:
+            self.failures += 1
+            _LOGGER.error("Could not refresh secrets from Vault: %s", e)
+            return retry_interval
+
+        secrets = secrets if secrets else dict()
+        self.refreshes += 1
+        if secrets != dict(self._api_config.get("secrets", {})):
+            snapshot = MappingProxyType(dict(secrets))
+            self._api_config["secrets"] = snapshot
+            _LOGGER.info("Secrets changed in Vault, swapped in the new secrets")
+
+            if self._on_refresh is not None:
+                try:
+                    self._on_refresh(snapshot)
+                except Exception as e:
+                    _LOGGER.error("Secrets refresh callback failed: %s", e)
+
+        for reloader in self._reloaders:
+            try:
+                reloader()
+            except Exception as e:
+                _LOGGER.error("Reloading from Vault failed: %s", e)
+
+        ttl = _parse_duration(secrets.get("ttl")) if "ttl" in secrets else None
+        return ttl if ttl else self.interval
+
+
+    def renew_token(self) -> float or None:
+        """
+        Renews the Vault token, logging in again if it can't be renewed
+
+        :return: Seconds until it should be renewed again, or None if it doesn't need (or can't get) renewing
+        """
+        token = getattr(self._vault, "token", None)
+        if hvac is None or not token:
+            return None
+
+        try:
+            if self._token_client is None:
+                self._token_client = hvac.Client(url=os.environ["VAULT_URL"])
+            # The token changes when the client logs in again
+            self._token_client.token = token
+            lease = self._token_client.auth.token.renew_self()["auth"]["lease_duration"]
+        except Exception as e:
+            self.renewal_failures += 1
+            _LOGGER.error("Could not renew the Vault token, logging in again: %s", e)
+            try:
+                self._vault.login()
+            except Exception as e:
+                _LOGGER.error("Could not log into Vault again: %s", e)
+            return min(self.interval, DEFAULT_SECRETS_RETRY_INTERVAL)
+
+        self.renewals += 1
+        # A lease of 0 is a token that never expires
+        return lease * TOKEN_RENEW_FRACTION if lease else None
+
+
+    def _run(self):
+        now = time.monotonic()
+        renew_at = now
+        refresh_at = now + self.interval
+        while not self._stop.wait(max(0.0, min(renew_at, refresh_at) - now)):
+            now = time.monotonic()
+            if now >= renew_at:
+                renew_in = self.renew_token()
+                renew_at = now + renew_in if renew_in is not None else float("inf")
+            if now >= refresh_at:
+                refresh_at = now + self.refresh()
+            now = time.monotonic()
+
+
+def start_secrets_refresher(app, on_refresh=None, reloaders=()) -> SecretsRefresher or None:
+    """
+    Starts refreshing the API's secrets in the background, if Vault is enabled and a refresh interval is configured
+
+    :param app: The Flask application
+    :param on_refresh: Optional callable, invoked with the new secrets mapping whenever the secrets change
+    :param reloaders: Callables invoked after every successful refresh, see SecretsRefresher
+
+    :return: The refresher, or None if secrets are not being refreshed
+    """
+    vault = app.config["vault_fetcher"]()
+    interval = _parse_duration(app.config["api_config"].get("vault", {}).get("secrets_refresh_interval", 0))
+    if not vault or not interval:
+        return None
+
+    refresher = SecretsRefresher(app.config["api_config"], vault, interval, on_refresh=on_refresh, reloaders=reloaders)
+    refresher.start()
+    return refresher
+
+
+def load_token_signing_keys(vault, keys_path:str, secrets_mount:str=None) -> tuple:
+    """
+    Loads the session token signing keyring from Vault.  The KV secret holds one base64 encoded key per key ID, plus
+    a `current` field naming the key ID new tokens are signed with; older keys are kept so tokens they signed remain
+    valid until they expire.
+
+    :param vault: The Vault client
+    :param keys_path: The KV path of the keyring
+    :param secrets_mount: The KV mount point, defaults to VAULT_SECRETS_MOUNT
+
+    :return: (dict of key ID to key bytes, current key ID), or (empty dict, None) on failure
+    """
+    mount = secrets_mount if secrets_mount is not None else os.environ.get("VAULT_SECRETS_MOUNT")
+    try:
+        secret = vault.get_secrets(keys_path, mount)
+    except Exception as e:
+        _LOGGER.error("Could not load session token keys from Vault: %s", e)
+        return dict(), None
+
+    if not secret or secret.get("current") not in secret:
+        _LOGGER.error("Session token keyring at '%s' must have a 'current' field naming one of its keys", keys_path)
+        return dict(), None
+
+    keys = {kid: base64.b64decode(key) for kid, key in secret.items() if kid != "current"}
+    return keys, secret["current"]
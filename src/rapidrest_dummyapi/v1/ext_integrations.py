@@ -15,3 +15,12 @@ def initialize_ext_resources(cfg):
     :param cfg: The external integrations config
     """
     INTEGRATION_MAP["API_ROOT"] = cfg["API_ROOT"]
+
+
+def on_secrets_refreshed(cfg):
+    """
+    Called when the API's secrets change in Vault, so integrations can pick up new credentials without a restart
+
+    :param cfg: The external integrations config
+    """
+    INTEGRATION_MAP["API_ROOT"] = cfg["API_ROOT"]
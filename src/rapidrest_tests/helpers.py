@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the test modules
+
+"""
+import flask
+
+from rapidrest import application, errorhandlers, routebuilder
+
+
+class FakeClock:
+    """
+    A clock that only moves when a test moves it
+    """
+
+    def __init__(self, now:float=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# Opens the dummy API's `POST /v1` and `GET /v1/pants` to unauthenticated requests
+OPEN_PANTS = {
+    "/v1": {"POST": {"authentication": False}},
+    "/v1/pants": {"GET": {"authentication": False}},
+}
+
+# Token authenticated `GET /v1/pants/<obj_id>`, open `GET /v1/recursive`
+TOKEN_PANTS = {
+    "/v1/pants/<obj_id>": {"GET": {"authentication": True}},
+    "/v1/recursive": {"GET": {"authentication": False}},
+}
+
+
+def dummy_api_app(endpoint_control:dict=None, api_config:dict=None, **app_config) -> flask.Flask:
+    """
+    Builds the dummy API from its shipped config
+
+    :param endpoint_control: Security config entries added to the shipped ones
+    :param api_config: Config sections merged into the shipped ones
+    :param app_config: Flask config set before the routes are loaded, `vault_fetcher` defaults to no Vault
+
+    :return: The application
+    """
+    app = flask.Flask(__name__)
+    errorhandlers.register_handlers(app)
+
+    shipped = application.load_api_config("rapidrest_dummyapi.v1")
+    shipped["security"]["endpoint_control"].update(endpoint_control or {})
+    for section, section_cfg in (api_config or {}).items():
+        if isinstance(shipped.get(section), dict) and isinstance(section_cfg, dict):
+            shipped[section].update(section_cfg)
+        else:
+            shipped[section] = section_cfg
+    app.config["api_config"] = shipped
+    app.config["vault_fetcher"] = lambda: None
+    app.config.update(app_config)
+    routebuilder.load_api(app, "rapidrest_dummyapi.v1")
+    return app
+
+
+def resource_app(routes:list, name:str=__name__, **app_config) -> flask.Flask:
+    """
+    Builds an application serving only the given resources, without security whitelisting
+
+    :param routes: (URL rule, view function) or (URL rule, view function, methods) tuples
+    :param name: The application's import name
+    :param app_config: Flask config, set before the routes are added
+
+    :return: The application
+    """
+    app = flask.Flask(name)
+    errorhandlers.register_handlers(app)
+    app.config["api_config"] = {"security": {"whitelist": False}}
+    app.config.update(app_config)
+    for url_rule, view_func, *methods in routes:
+        app.add_url_rule(url_rule, view_func=view_func, methods=methods[0] if methods else None)
+    return app
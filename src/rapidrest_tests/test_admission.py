@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Tests rate limiting and load shedding
+
+"""
+import os
+import tempfile
+import unittest
+
+import flask
+
+from rapidrest import admission, httperrors
+from rapidrest.security import tokens
+from rapidrest.security.authentication import Principal
+from rapidrest_tests.helpers import TOKEN_PANTS, dummy_api_app, FakeClock
+
+
+def _admission_app(admission_cfg:dict) -> flask.Flask:
+    return dummy_api_app(TOKEN_PANTS, {"admission": dict(admission_cfg, enabled=True)},
+                         token_issuer=tokens.SessionTokenIssuer({"test": b"k" * 32}, "test"))
+
+
+class TestTokenBuckets(unittest.TestCase):
+
+    def test_take(self):
+        clock = FakeClock(1000.0)
+        buckets = admission.TokenBuckets(clock=clock)
+        self.assertEqual(buckets.take("a", 2, 2), 0)
+        self.assertEqual(buckets.take("a", 2, 2), 0)
+        self.assertAlmostEqual(buckets.take("a", 2, 2), 0.5)
+        self.assertEqual(buckets.take("b", 2, 2), 0)
+
+        clock.now += 0.5
+        self.assertEqual(buckets.take("a", 2, 2), 0)
+        clock.now += 60
+        self.assertEqual([buckets.take("a", 2, 2) for _ in range(3)][:2], [0, 0])
+
+
+    def test_bounded(self):
+        clock = FakeClock(1000.0)
+        buckets = admission.TokenBuckets(clock=clock, max_buckets=admission._STRIPES)
+        for i in range(10 * admission._STRIPES):
+            buckets.take(f"principal:{i}", 1, 5)
+        self.assertLessEqual(len(buckets), admission._STRIPES)
+
+        # Refilled buckets are dropped as their stripe is next used
+        clock.now += 10
+        for i in range(10 * admission._STRIPES):
+            buckets.take(f"endpoint:{i}", 1, 5)
+        for stripe in buckets._buckets:
+            if any(key.startswith("endpoint:") for key in stripe):
+                self.assertFalse(any(key.startswith("principal:") for key in stripe))
+
+        # A dropped bucket starts full again, a kept one hasn't refilled
+        buckets = admission.TokenBuckets(clock=clock, max_buckets=admission._STRIPES)
+        self.assertEqual(buckets.take("a", 1, 1), 0)
+        self.assertEqual(buckets.take("a", 1, 1), 1)
+        clock.now += 1
+        self.assertEqual(buckets.take("a", 1, 1), 0)
+        self.assertEqual(len(buckets), 1)
+
+
+    def test_shared(self):
+        clock = FakeClock(1000.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "admission")
+            # Two workers mapping the same file share their buckets
+            first = admission.SharedTokenBuckets(path, slots=16, clock=clock)
+            second = admission.SharedTokenBuckets(path, slots=16, clock=clock)
+            self.assertEqual(first.take("a", 1, 2), 0)
+            self.assertEqual(second.take("a", 1, 2), 0)
+            self.assertAlmostEqual(first.take("a", 1, 2), 1.0)
+            self.assertEqual(second.take("b", 1, 2), 0)
+
+            clock.now += 1
+            self.assertEqual(second.take("a", 1, 2), 0)
+
+            # Keys that don't fit in their neighbourhood get a bucket in the worker
+            crowded = admission.SharedTokenBuckets(os.path.join(tmp, "crowded"), slots=1, clock=clock)
+            self.assertEqual(crowded.take("a", 1, 1), 0)
+            self.assertEqual(crowded.take("b", 1, 1), 0)
+            self.assertAlmostEqual(crowded.take("b", 1, 1), 1.0)
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_principal_limit(self):
+        app = _admission_app({"principal": {"rate": 0.5, "burst": 2}, "principals": {"bob": {"rate": 1, "burst": 1}}})
+        client = app.test_client()
+
+        def _get(principal:str):
+            token, _ = app.config["token_issuer"].issue(principal)
+            return client.get("/v1/pants/1", headers={"Authorization": tokens.create_token_auth_header(token)})
+
+        self.assertEqual([_get("alice").status_code for _ in range(2)], [200, 200])
+        resp = _get("alice")
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "2")
+        self.assertEqual(resp.json["err_type"], "Client")
+
+        self.assertEqual([_get("bob").status_code for _ in range(2)], [200, 429])
+        # Unauthenticated requests are rejected before they use up anything
+        self.assertEqual(client.get("/v1/pants/1").status_code, 403)
+
+        stats = app.config["admission"].stats()
+        self.assertEqual(stats["throttled_principal"], 2)
+        self.assertEqual(stats["admitted"], 3)
+        self.assertEqual(stats["in_flight"], 0)
+
+
+    def test_endpoint_limit(self):
+        app = _admission_app({"endpoint_control": {"/v1/recursive": {"GET": {"rate": 1, "burst": 1}}}})
+        client = app.test_client()
+
+        self.assertEqual(client.get("/v1/recursive").status_code, 200)
+        self.assertEqual(client.get("/v1/recursive").status_code, 429)
+        self.assertEqual(app.config["admission"].stats()["throttled_endpoint"], 1)
+
+
+    def test_shedding(self):
+        clock = FakeClock(1700000000.0)
+        controller = admission.AdmissionController(max_in_flight=1, max_queue_latency=2, retry_after=3, clock=clock)
+        app = flask.Flask(__name__)
+
+        with app.test_request_context("/"):
+            controller.admit(flask.request)
+            with self.assertRaises(httperrors.ServiceUnavailable) as ctx:
+                controller.admit(flask.request)
+            self.assertIn(("Retry-After", "3"), ctx.exception.get_headers())
+            controller.release()
+            controller.admit(flask.request)
+            controller.release()
+
+        for header, shed in (("t=1699999997.5", True), ("1699999999500", False), ("1699999997500000", True),
+                              ("garbage", False)):
+            with app.test_request_context("/", headers={admission.REQUEST_START_HEADER: header}):
+                flask.g.principal = Principal("alice", "t1")
+                if shed:
+                    self.assertRaises(httperrors.ServiceUnavailable, controller.admit, flask.request)
+                else:
+                    controller.admit(flask.request)
+                    controller.release()
+
+        stats = controller.stats()
+        self.assertEqual((stats["shed_concurrency"], stats["shed_latency"], stats["in_flight"]), (1, 2, 0))
+
+
+    def test_from_api_config(self):
+        rules = [("pants", "/v1/pants", {"GET", "POST"})]
+        self.assertIsNone(admission.from_api_config({}, rules))
+
+        for bad_cfg in ({"principal": {"burst": 1}}, {"principals": {"bob": {"rate": 0}}},
+                        {"endpoint_control": {"/v1/pants": {"POST": 5}}}, {"endpoint_control": ["/v1/pants"]}):
+            with self.assertRaises(admission.AdmissionError):
+                admission.from_api_config({"admission": dict(bad_cfg, enabled=True)}, rules)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the per-request state handed to resources, with and without singleton resources
+
+"""
+import threading
+import unittest
+
+import flask
+
+from rapidrest.apiresource import ApiRequest, ApiResource, ApiResponse
+from rapidrest_dummyapi.v1 import V1
+from rapidrest_tests.helpers import OPEN_PANTS, dummy_api_app, resource_app
+
+
+def _pants_app(singleton:bool) -> flask.Flask:
+    return dummy_api_app(OPEN_PANTS, {"routing": {"singleton_resources": singleton}},
+                         vault_fetcher=lambda: "fake-vault")
+
+
+class TestApiResource(unittest.TestCase):
+
+    def test_request_state(self):
+        for singleton in (False, True):
+            app = _pants_app(singleton)
+            self.assertEqual(app.view_functions["v1"].view_class.init_every_request, not singleton)
+            self.assertTrue(issubclass(app.view_functions["v1"].view_class, V1))
+
+            resp = app.test_client().post("/v1", json={"pants": 1})
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(resp.json["body"], {"pants": 1})
+            self.assertEqual(resp.json["vault"], "fake-vault")
+            self.assertEqual(resp.json["api_config"]["api_name"], "RapidRest Dummy API")
+
+
+    def test_api_request_tuple_interface(self):
+        api_request = ApiRequest({"X-Pants": "1"}, {"pants": 1}, None)
+        headers, body, flask_request = api_request
+        self.assertEqual((headers, body, flask_request), ({"X-Pants": "1"}, {"pants": 1}, None))
+        self.assertEqual(api_request[1], {"pants": 1})
+        self.assertEqual(api_request._asdict()["body"], {"pants": 1})
+        self.assertEqual(api_request._replace(body=None).body, None)
+        self.assertEqual(api_request, ApiRequest(headers={"X-Pants": "1"}, body={"pants": 1}, flask_request=None))
+        with self.assertRaises(ValueError):
+            api_request._replace(pants=1)
+
+
+    def test_assigned_current_request(self):
+        class Legacy(ApiResource):
+            def __init__(self, *args, **kwargs):
+                self._current_request = None
+                self._vault = None
+                super().__init__(*args, **kwargs)
+
+            def get(self):
+                self._current_request = self._current_request._replace(body={"replaced": True})
+                return ApiResponse(body={"body": self._current_request.body}, status_code=200)
+
+        app = resource_app([("/legacy", Legacy.as_view("legacy"))], vault_fetcher=lambda: None)
+        self.assertEqual(app.test_client().get("/legacy").json["body"], {"replaced": True})
+
+
+    def test_singleton_concurrent_requests(self):
+        app = _pants_app(True)
+        results = {}
+
+        def _post(idx):
+            results[idx] = app.test_client().post("/v1", json={"idx": idx}).json["body"]
+
+        threads = [threading.Thread(target=_post, args=(idx,)) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {idx: {"idx": idx} for idx in range(8)})
+
+
+    def test_max_body_size(self):
+        app = _pants_app(False)
+        app.config["MAX_CONTENT_LENGTH"] = 32
+        client = app.test_client()
+
+        self.assertEqual(client.post("/v1", json={"pants": 1}).status_code, 201)
+
+        resp = client.post("/v1", json={"pants": "x" * 64})
+        self.assertEqual(resp.status_code, 413)
+        self.assertTrue(resp.json["err"])
+
+        # Handlers that never read the body don't pay for it, or get rejected for it
+        self.assertEqual(client.get("/v1/pants", data=b"x" * 64).status_code, 200)
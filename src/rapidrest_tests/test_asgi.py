@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests async handlers and the ASGI adapter
+
+"""
+import asyncio
+import json
+import threading
+import time
+import types
+import unittest
+
+import flask
+
+from rapidrest import asgi, errorhandlers, routebuilder
+from rapidrest.apiresource import ApiResource, ApiResponse
+
+
+class Boots(ApiResource):
+    endpoint_name = "boots"
+
+    async def get(self, boot_id=""):
+        await asyncio.sleep(0.05)
+        return ApiResponse(body={"id": boot_id, "thread": threading.current_thread().name}, status_code=200)
+
+
+    async def post(self):
+        await asyncio.sleep(0)
+        return ApiResponse(body={"received": self._current_request.body}, status_code=201)
+
+
+class Laces(ApiResource):
+    endpoint_name = "laces"
+
+    def get(self, lace_id=""):
+        if lace_id == "stream":
+            return ApiResponse(body=({"id": idx} for idx in range(3)), status_code=200)
+        return ApiResponse(body={"thread": threading.current_thread().name}, status_code=200)
+
+
+def _boots_app():
+    app = flask.Flask(__name__)
+    errorhandlers.register_handlers(app)
+    app.config["api_config"] = {"security": {"whitelist": False}, "routing": {}}
+    for resource_class in (Boots, Laces):
+        module = types.ModuleType(f"rapidrest_tests.fakeapi.{resource_class.endpoint_name}")
+        setattr(module, resource_class.__name__, resource_class)
+        routebuilder._resource_initializer(app, "v1", module, app.logger)
+    return app
+
+
+async def _request(asgi_app, method:str, path:str, body:bytes=b"", headers=()) -> tuple:
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers)}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def _receive():
+        return messages.pop(0)
+
+    async def _send(message):
+        sent.append(message)
+
+    await asgi_app(scope, _receive, _send)
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return sent[0]["status"], dict((k.decode(), v.decode()) for k, v in sent[0]["headers"]), body
+
+
+class TestAsyncHandlers(unittest.TestCase):
+
+    def test_detected(self):
+        app = _boots_app()
+        self.assertCountEqual(app.config["route_specs"][0].method_map["async"], ["GET", "POST"])
+        self.assertIn(("boots", "HEAD"), app.config["async_routes"])
+        self.assertNotIn(("laces", "GET"), app.config["async_routes"])
+
+
+    def test_wsgi(self):
+        client = _boots_app().test_client()
+
+        resp = client.get("/v1/boots/1")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["id"], "1")
+        self.assertEqual(client.post("/v1/boots", json={"a": 1}).json["received"], {"a": 1})
+
+
+    def test_asgi_concurrency(self):
+        asgi_app = asgi.AsgiApplication(_boots_app(), max_threads=2)
+
+        async def _run():
+            return await asyncio.gather(*(_request(asgi_app, "GET", f"/v1/boots/{idx}") for idx in range(20)))
+
+        started = time.monotonic()
+        results = asyncio.run(_run())
+        # 20 handlers sleeping 50ms each, with only 2 worker threads
+        self.assertLess(time.monotonic() - started, 0.5)
+        for idx, (status, _, body) in enumerate(results):
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)["id"], str(idx))
+            self.assertEqual(json.loads(body)["thread"], threading.main_thread().name)
+
+
+    def test_asgi_mixed(self):
+        asgi_app = asgi.AsgiApplication(_boots_app())
+
+        status, _, body = asyncio.run(_request(asgi_app, "POST", "/v1/boots", b'{"a": 1}',
+                                               [(b"content-type", b"application/json")]))
+        self.assertEqual(status, 201)
+        self.assertEqual(json.loads(body)["received"], {"a": 1})
+
+        status, _, body = asyncio.run(_request(asgi_app, "GET", "/v1/laces"))
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)["thread"].startswith("rapidrest-asgi"))
+
+        status, headers, body = asyncio.run(_request(asgi_app, "GET", "/v1/laces/stream"))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [{"id": 0}, {"id": 1}, {"id": 2}])
+
+        status, _, body = asyncio.run(_request(asgi_app, "GET", "/v1/nothing"))
+        self.assertEqual(status, 404)
+        self.assertTrue(json.loads(body)["err"])
@@ -7,11 +7,24 @@ import json
 import os
 import unittest
 import webtest
+from contextlib import contextmanager
 from unittest.mock import patch
 
 from rapidrest import application, vault_integration
 from vaultutilscommon import vaultinstance
-from rapidrest.security.authentication import create_v1_auth_header
+from rapidrest.security import policy
+from rapidrest.security.authentication import create_v1_auth_header, create_v2_auth_header
+
+
+@contextmanager
+def patch_endpoint_control(app, endpoint_patch):
+    """
+    Patches the endpoint security config, and recompiles the security policy so the patch takes effect
+    """
+    with patch.dict(app.config["api_config"]["security"]["endpoint_control"], endpoint_patch):
+        compiled = policy.compile_security_policy(app.config["api_config"], app.config["route_registry"])
+        with patch.dict(app.config, {"security_policy": compiled}):
+            yield
 
 
 class TestRapidRestAuthentication(unittest.TestCase):
@@ -81,7 +94,7 @@ class TestRapidRestAuthentication(unittest.TestCase):
             }
         }
 
-        with patch.dict(self.app.config["api_config"]["security"]["endpoint_control"], endpoint_patch):
+        with patch_endpoint_control(self.app, endpoint_patch):
             resp = self.srv.post("/v1/pants", headers={"Authorization":""})
 
         self.assertEqual(resp.status_code, 200)
@@ -110,7 +123,7 @@ class TestRapidRestAuthentication(unittest.TestCase):
         key_name = "auth_test_key"
         key = vaultinstance.create_transit_key(key_name, self.v_url, self.v_root)
 
-        with patch.dict(self.app.config["api_config"]["security"]["endpoint_control"], endpoint_patch):
+        with patch_endpoint_control(self.app, endpoint_patch):
 
             # POST with body data
             auth_header = create_v1_auth_header(key_name, key, "POST", "localhost:80", "/v1/pants",
@@ -128,6 +141,38 @@ class TestRapidRestAuthentication(unittest.TestCase):
             self.assertDictEqual(resp.json_body, {"pants_post": True})
 
 
+    def test_authentication_v2(self):
+        """
+        This tests that the v2 (body digest) authn mechanism works
+
+        """
+        endpoint_patch = {
+            "/v1/pants": {
+                "POST": {
+                    "authentication": True
+                }
+            }
+        }
+
+        body_data = {
+            "Testing": 123
+        }
+        key_name = "auth_test_key"
+        key = vaultinstance.create_transit_key(key_name, self.v_url, self.v_root)
+
+        with patch_endpoint_control(self.app, endpoint_patch):
+            auth_header = create_v2_auth_header(key_name, key, "POST", "localhost:80", "/v1/pants",
+                                                json.dumps(body_data))
+            resp = self.srv.post_json("/v1/pants", body_data, headers={"Authorization": auth_header})
+            self.assertEqual(resp.status_code, 200)
+            self.assertDictEqual(resp.json_body, {"pants_post": True})
+
+            # Body does not match the signed digest
+            resp = self.srv.post_json("/v1/pants", {"Testing": 456}, headers={"Authorization": auth_header},
+                                      expect_errors=True)
+            self.assertEqual(resp.status_code, 403)
+
+
     def test_bad_authentication_v1(self):
         endpoint_patch = {
             "/v1/pants": {
@@ -144,7 +189,7 @@ class TestRapidRestAuthentication(unittest.TestCase):
         key = vaultinstance.create_transit_key(key_name, self.v_url, self.v_root)
 
 
-        with patch.dict(self.app.config["api_config"]["security"]["endpoint_control"], endpoint_patch):
+        with patch_endpoint_control(self.app, endpoint_patch):
             # Missing body (in sig)
             auth_header = create_v1_auth_header(key_name, key, "POST", "localhost:80", "/v1/pants")
             resp = self.srv.post_json("/v1/pants", body_data, headers={"Authorization": auth_header},
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the batch endpoint
+
+"""
+import unittest
+
+from rapidrest import batch
+from rapidrest.security import tokens
+from rapidrest_tests.helpers import TOKEN_PANTS, dummy_api_app
+
+
+def _batch_app(max_workers:int):
+    return dummy_api_app(TOKEN_PANTS, token_issuer=tokens.SessionTokenIssuer({"test": b"k" * 32}, "test"),
+                         batch=batch.BatchSettings(max_items=10, max_workers=max_workers))
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_batch(self):
+        for max_workers in (1, 4):
+            app = _batch_app(max_workers)
+            token, _ = app.config["token_issuer"].issue("alice")
+            headers = {"Authorization": tokens.create_token_auth_header(token)}
+            client = app.test_client()
+
+            resp = client.post("/_batch", headers=headers, json=[
+                {"method": "GET", "path": "/v1/pants/1"},
+                {"method": "GET", "path": "/v1/recursive/2?x=1"},
+                {"method": "POST", "path": "/v1/pants", "body": {"size": 32}},
+                {"method": "GET", "path": "/v1/nothing"},
+                {"path": "relative"},
+                {"method": "POST", "path": "/_batch", "body": []},
+            ])
+            self.assertEqual(resp.status_code, 200)
+            results = resp.json
+            self.assertEqual([result["status"] for result in results], [200, 403, 403, 404, 400, 400])
+            self.assertEqual(results[0]["body"], {"pants_get": True, "id": "1"})
+            self.assertIn("ETag", results[0]["headers"])
+            self.assertIn("no security configuration", results[2]["body"]["err_detail"])
+
+
+    def test_envelope(self):
+        app = _batch_app(1)
+        client = app.test_client()
+        token, _ = app.config["token_issuer"].issue("alice")
+        headers = {"Authorization": tokens.create_token_auth_header(token)}
+
+        self.assertEqual(client.post("/_batch", json=[{"path": "/v1/pants/1"}]).status_code, 403)
+        self.assertEqual(client.post("/_batch", headers=headers, json={"path": "/v1/pants/1"}).status_code, 400)
+        self.assertEqual(client.post("/_batch", headers=headers, json=[{"path": "/v1"}] * 11).status_code, 413)
+        self.assertEqual(client.post("/_batch", headers=headers, json=[]).json, [])
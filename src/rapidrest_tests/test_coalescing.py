@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Tests coalescing of identical concurrent requests
+
+"""
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+from werkzeug.routing import Rule
+
+from rapidrest import coalescing
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest_tests.helpers import resource_app
+
+THREADS = 8
+
+
+class _SlowResource(ApiResource):
+    endpoint_name = "slow"
+    coalesce_requests = True
+    calls = 0
+    release = None
+    fail = False
+    status_code = 200
+
+    def get(self):
+        type(self).calls += 1
+        type(self).release.wait(5)
+        if type(self).fail:
+            raise ValueError("leader failed")
+        return ApiResponse(body={"calls": type(self).calls}, status_code=type(self).status_code)
+
+
+def _app(timeout:float=coalescing.DEFAULT_TIMEOUT) -> flask.Flask:
+    return resource_app([("/slow", _SlowResource.as_view(_SlowResource.endpoint_name))],
+                        single_flight=coalescing.SingleFlight({}, timeout=timeout))
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        _SlowResource.calls = 0
+        _SlowResource.release = threading.Event()
+        _SlowResource.fail = False
+        _SlowResource.status_code = 200
+
+
+    def _concurrent_gets(self, app:flask.Flask, path:str="/slow") -> list:
+        def _get(_):
+            # A new client per request, test clients are not thread-safe
+            return app.test_client().get(path)
+
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            futures = [pool.submit(_get, i) for i in range(THREADS)]
+            # Let every request join the flight before the leader finishes
+            while sum(1 for future in futures if future.running()) < THREADS:
+                threading.Event().wait(0.01)
+            threading.Event().wait(0.1)
+            _SlowResource.release.set()
+            return [future.result() for future in futures]
+
+
+    def test_coalesced(self):
+        app = _app()
+        responses = self._concurrent_gets(app)
+
+        self.assertEqual(_SlowResource.calls, 1)
+        self.assertTrue(all(resp.status_code == 200 for resp in responses))
+        self.assertTrue(all(resp.json == {"calls": 1} for resp in responses))
+        self.assertEqual(len({resp.headers["ETag"] for resp in responses}), 1)
+        stats = app.config["single_flight"].stats()
+        self.assertEqual(stats["leaders"], 1)
+        self.assertEqual(stats["coalesced"], THREADS - 1)
+        self.assertEqual(stats["in_flight"], 0)
+
+
+    def test_query_string_is_part_of_the_key(self):
+        app = _app()
+        _SlowResource.release.set()
+        client = app.test_client()
+        client.get("/slow?page=1")
+        client.get("/slow?page=2")
+        self.assertEqual(_SlowResource.calls, 2)
+
+
+    def test_timeout(self):
+        app = _app(timeout=0.01)
+        responses = self._concurrent_gets(app)
+
+        self.assertTrue(all(resp.status_code == 200 for resp in responses))
+        stats = app.config["single_flight"].stats()
+        self.assertEqual(stats["timeouts"], THREADS - 1)
+        self.assertEqual(_SlowResource.calls, THREADS)
+
+
+    def test_leader_failure(self):
+        app = _app()
+        _SlowResource.fail = True
+        responses = self._concurrent_gets(app)
+
+        # Every request runs the handler itself, rather than being sent the leader's error
+        self.assertTrue(all(resp.status_code == 500 for resp in responses))
+        self.assertEqual(_SlowResource.calls, THREADS)
+        self.assertEqual(app.config["single_flight"].stats()["fallbacks"], THREADS - 1)
+
+
+    def test_error_response_not_shared(self):
+        app = _app()
+        _SlowResource.status_code = 503
+        responses = self._concurrent_gets(app)
+
+        self.assertTrue(all(resp.status_code == 503 for resp in responses))
+        self.assertEqual(_SlowResource.calls, THREADS)
+        self.assertEqual(app.config["single_flight"].stats()["fallbacks"], THREADS - 1)
+
+
+    def test_from_api_config(self):
+        rules = [("slow", "/slow", {"GET", "HEAD"}), ("fast", "/fast", {"GET", "POST"})]
+        single_flight = coalescing.from_api_config({"coalescing": {"timeout": 2, "endpoint_control": {
+            "/fast": {"GET": {"per_principal": False}},
+            "/slow": {"GET": {"enabled": False}},
+        }}}, rules)
+        self.assertEqual(single_flight.timeout, 2)
+
+        self.assertEqual(single_flight.settings(ApiResource, Rule("/fast", endpoint="fast")), (True, False))
+        self.assertIsNone(single_flight.settings(_SlowResource, Rule("/slow", endpoint="slow")))
+        self.assertIsNone(single_flight.settings(ApiResource, Rule("/other", endpoint="other")))
+        self.assertEqual(single_flight.settings(_SlowResource, Rule("/other", endpoint="other")), (True, True))
+
+        with self.assertRaises(coalescing.CoalescingError):
+            coalescing.from_api_config({"coalescing": {"endpoint_control": ["/slow"]}}, rules)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the JSON codecs and the responses built with them
+
+"""
+import dataclasses
+import decimal
+import json
+import unittest
+import uuid
+from datetime import datetime, timezone
+
+import flask
+
+from rapidrest import codec, errorhandlers
+from rapidrest.jsonapi_v1 import JSONAPIResponse
+
+
+@dataclasses.dataclass
+class Pants:
+    size: int
+    colour: str
+
+
+PAYLOAD = {
+    "when": datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    "price": decimal.Decimal("9.99"),
+    "id": uuid.UUID(int=1),
+    "pants": [Pants(32, "blue")],
+    "text": "snowman ☃",
+    "huge": 2 ** 70,
+}
+
+
+class TestCodecs(unittest.TestCase):
+
+    @unittest.skipIf(codec.orjson is None, "orjson is not installed")
+    def test_backends_agree(self):
+        stdlib = codec.create_codec("stdlib", sort_keys=True)
+        fast = codec.create_codec("orjson", sort_keys=True)
+
+        self.assertEqual(fast.dumps(PAYLOAD), stdlib.dumps(PAYLOAD))
+        self.assertEqual(fast.loads(fast.dumps(PAYLOAD)), stdlib.loads(stdlib.dumps(PAYLOAD)))
+
+
+    def test_stdlib_output(self):
+        payload = dict(PAYLOAD)
+        payload[1] = "non-string key"
+        body = json.loads(codec.create_codec("stdlib").dumps(payload))
+        self.assertEqual(body["when"], "Thu, 02 Jan 2020 03:04:05 GMT")
+        self.assertEqual(body["pants"], [{"size": 32, "colour": "blue"}])
+        self.assertEqual(body["1"], "non-string key")
+
+        with self.assertRaises(TypeError):
+            codec.create_codec("stdlib").dumps({"nope": object()})
+
+
+    def test_invalid_backend(self):
+        with self.assertRaises(codec.CodecError):
+            codec.create_codec("simplejson")
+
+
+class TestCodecResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        errorhandlers.register_handlers(self.app)
+        self.codec = codec.create_codec("stdlib", sort_keys=True)
+        codec.install(self.app, self.codec)
+
+        @self.app.route("/jsonify")
+        def _jsonify():
+            return flask.jsonify({"b": 1, "a": 2})
+
+        self.client = self.app.test_client()
+
+
+    def test_flask_uses_codec(self):
+        resp = self.client.get("/jsonify")
+        self.assertEqual(resp.data, b'{"a":2,"b":1}')
+
+        resp = self.client.get("/missing")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.content_type, "application/json")
+        self.assertTrue(resp.json["err"])
+
+
+    def test_jsonapi_response(self):
+        with self.app.app_context():
+            resp = JSONAPIResponse(data=[{"type": "pants", "id": "1"}], meta={"count": 1}, status=200)
+            self.assertEqual(json.loads(resp.data), {"data": [{"type": "pants", "id": "1"}], "meta": {"count": 1}})
+            self.assertEqual(resp.content_type, "application/vnd.api+json")
+
+            # A response without data, errors or meta describes its own misconfiguration
+            resp = JSONAPIResponse()
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn("errors", json.loads(resp.data))
+
+            # An explicit status is kept, as it was before documents were emitted
+            resp = JSONAPIResponse(status=200)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("errors", json.loads(resp.data))
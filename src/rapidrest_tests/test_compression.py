@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Tests response compression and compressed request bodies
+
+"""
+import gzip
+import json
+import unittest
+import zlib
+from unittest import mock
+
+from rapidrest import application, compression
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest_tests.helpers import resource_app
+
+
+class Socks(ApiResource):
+    endpoint_name = "socks"
+
+    def get(self, sock_id=""):
+        if sock_id == "stream":
+            return ApiResponse(body=({"id": idx, "colour": "blue"} for idx in range(1000)), status_code=200)
+        count = 1 if sock_id == "small" else 200
+        return ApiResponse(body={"socks": [{"id": idx, "colour": "blue"} for idx in range(count)]}, status_code=200)
+
+
+    def post(self):
+        return ApiResponse(body={"received": self._current_request.body}, status_code=201)
+
+
+def _socks_app(**settings):
+    view = Socks.as_view("socks")
+    app = resource_app([("/socks", view, ["GET", "POST"]), ("/socks/<sock_id>", view, ["GET"])])
+    compression.install(app, compression.CompressionSettings(**settings))
+    return app
+
+
+class TestResponseCompression(unittest.TestCase):
+
+    def test_negotiation(self):
+        client = _socks_app().test_client()
+
+        resp = client.get("/socks", headers={"Accept-Encoding": "deflate;q=0.5, gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(len(json.loads(gzip.decompress(resp.data))["socks"]), 200)
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+
+        resp = client.get("/socks", headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "deflate")
+        self.assertEqual(len(json.loads(zlib.decompress(resp.data))["socks"]), 200)
+
+        for accept_encoding in ("identity", "gzip;q=0"):
+            resp = client.get("/socks", headers={"Accept-Encoding": accept_encoding})
+            self.assertNotIn("Content-Encoding", resp.headers)
+            self.assertEqual(len(resp.json["socks"]), 200)
+
+
+    def test_threshold_and_opt_out(self):
+        client = _socks_app(endpoint_control={"/socks/<sock_id>": {"GET": {"compress": False}}}).test_client()
+
+        resp = client.get("/socks/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertNotIn("Accept-Encoding", resp.headers.get("Vary", ""))
+
+        client = _socks_app(min_size=100).test_client()
+        resp = client.get("/socks/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+
+
+    def test_etag_becomes_weak(self):
+        client = _socks_app().test_client()
+
+        resp = client.get("/socks", headers={"Accept-Encoding": "gzip"})
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(etag[2:], client.get("/socks").headers["ETag"])
+
+        resp = client.get("/socks", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+
+    def test_streamed(self):
+        client = _socks_app().test_client()
+
+        resp = client.get("/socks/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(len(json.loads(gzip.decompress(resp.data))), 1000)
+
+
+class TestRequestDecompression(unittest.TestCase):
+
+    def test_gzip_body(self):
+        client = _socks_app().test_client()
+        body = gzip.compress(json.dumps({"colour": "red"}).encode("utf-8"))
+
+        resp = client.post("/socks", data=body, headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json["received"], {"colour": "red"})
+
+
+    def test_limits(self):
+        client = _socks_app(max_request_size=1024).test_client()
+        bomb = gzip.compress(b"[" + b"0," * 100000 + b"0]")
+        headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+
+        self.assertEqual(client.post("/socks", data=bomb, headers=headers).status_code, 413)
+        self.assertEqual(client.post("/socks", data=bomb[:-20], headers=headers).status_code, 413)
+        self.assertEqual(client.post("/socks", data=b"not gzip", headers=headers).status_code, 400)
+        self.assertEqual(client.post("/socks", data=gzip.compress(b"{}")[:-10], headers=headers).status_code, 400)
+
+        headers["Content-Encoding"] = "compress"
+        self.assertEqual(client.post("/socks", data=b"{}", headers=headers).status_code, 415)
+
+
+    def test_from_api_config(self):
+        self.assertIsNone(compression.from_api_config({}))
+        api_config = application.load_api_config("rapidrest_dummyapi.v1")
+        self.assertIsNone(compression.from_api_config(api_config))
+
+        api_config["compression"]["enabled"] = True
+        settings = compression.from_api_config(api_config)
+        # The shipped config leaves max_request_size empty, which falls back to the body limit
+        self.assertEqual(settings.max_request_size, api_config["requests"]["max_body_size"])
+
+        rules = [("socks", "/socks", {"GET", "POST"})]
+        settings = compression.CompressionSettings(endpoint_control={
+            "/socks": {"GET": {"compress": False}, "PUT": {"compress": False}}, "/shoes": {"GET": {"compress": False}}})
+        log = mock.Mock()
+        compression.check_endpoint_control(settings, rules, log)
+        self.assertEqual(log.warning.call_count, 2)
+
+        with self.assertRaises(compression.CompressionError):
+            compression.check_endpoint_control(
+                compression.CompressionSettings(endpoint_control={"/socks": {"GET": {"compress": "no"}}}), rules)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Tests request deadlines
+
+"""
+import threading
+import time
+import unittest
+
+import flask
+
+from rapidrest import admission, deadlines
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.vault_access import CircuitBreaker, VaultAccess
+from rapidrest_tests.helpers import FakeClock, resource_app
+
+
+class _SlowClient:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def slow_call(self):
+        self.release.wait(5)
+
+    def fast_call(self):
+        return True
+
+
+class _Timed(ApiResource):
+    endpoint_name = "timed"
+    clock = None
+    etag_delay = 0
+    handler_delay = 0
+
+    def get_etag(self, **kwargs):
+        type(self).clock.now += type(self).etag_delay
+        return None
+
+    def get(self):
+        remaining = self._current_request.time_remaining
+        type(self).clock.now += type(self).handler_delay
+        return ApiResponse(body={"remaining": remaining}, status_code=200)
+
+
+def _deadline_app(clock:FakeClock, **policy_kwargs) -> flask.Flask:
+    return resource_app([("/timed", _Timed.as_view(_Timed.endpoint_name)), ("/other", _Timed.as_view("other"))],
+                        deadlines=deadlines.DeadlinePolicy({("timed", "/timed", "GET"): 10}, clock=clock,
+                                                           **policy_kwargs))
+
+
+class TestDeadlines(unittest.TestCase):
+
+    def setUp(self):
+        _Timed.clock = FakeClock()
+        _Timed.etag_delay = _Timed.handler_delay = 0
+
+
+    def test_timeout(self):
+        app = _deadline_app(_Timed.clock, default_timeout=30, max_timeout=60)
+        client = app.test_client()
+
+        def _remaining(path:str, **headers):
+            return client.get(path, headers=headers).json["remaining"]
+
+        # The endpoint's timeout is both its default and its cap
+        self.assertEqual(_remaining("/timed"), 10)
+        self.assertEqual(_remaining("/timed", **{deadlines.TIMEOUT_HEADER: "2.5"}), 2.5)
+        self.assertEqual(_remaining("/timed", **{deadlines.TIMEOUT_HEADER: "20"}), 10)
+        self.assertEqual(_remaining("/other"), 30)
+        self.assertEqual(_remaining("/other", **{deadlines.TIMEOUT_HEADER: "600"}), 60)
+        self.assertEqual(client.get("/other", headers={deadlines.TIMEOUT_HEADER: "soon"}).status_code, 400)
+        self.assertEqual(client.head("/timed", headers={deadlines.TIMEOUT_HEADER: "20"}).status_code, 200)
+
+        app = _deadline_app(_Timed.clock)
+        self.assertIsNone(app.test_client().get("/other").json["remaining"])
+        self.assertIsNone(deadlines.current())
+
+
+    def test_expired(self):
+        app = _deadline_app(_Timed.clock)
+        client = app.test_client()
+
+        _Timed.handler_delay = 11
+        resp = client.get("/timed")
+        self.assertEqual(resp.status_code, 504)
+        self.assertIn(deadlines.SERIALIZATION, resp.json["err_detail"])
+
+        _Timed.etag_delay = 11
+        self.assertEqual(client.get("/timed").status_code, 504)
+
+        stats = app.config["deadlines"].stats()
+        self.assertEqual(stats["started"], 2)
+        self.assertEqual(stats["expired"], 2)
+        self.assertEqual(stats["expired_before_handler"], 1)
+        self.assertEqual(stats["expired_before_serialization"], 1)
+
+
+    def test_counts_from_arrival(self):
+        app = _deadline_app(_Timed.clock, wall_clock=lambda: 1700000004.0)
+        client = app.test_client()
+
+        def _get(received_at:str):
+            return client.get("/timed", headers={admission.REQUEST_START_HEADER: received_at})
+
+        # Spent 4 of its 10 seconds waiting for a worker
+        self.assertEqual(_get("t=1700000000.0").json["remaining"], 6)
+        self.assertEqual(_get("1700000000000").json["remaining"], 6)
+        # A proxy clock running ahead doesn't give it more time
+        self.assertEqual(_get("t=1700000010.0").json["remaining"], 10)
+
+        resp = _get("t=1699999990.0")
+        self.assertEqual(resp.status_code, 504)
+        self.assertIn(deadlines.AUTHENTICATION, resp.json["err_detail"])
+
+
+    def test_vault_calls(self):
+        client = _SlowClient()
+        vault = VaultAccess(client, call_timeout=5)
+        policy = deadlines.DeadlinePolicy({}, default_timeout=0.05)
+        app = flask.Flask(__name__)
+
+        with app.test_request_context("/"):
+            token = policy.start(flask.request)
+            try:
+                started = time.monotonic()
+                with self.assertRaises(deadlines.DeadlineExceeded):
+                    vault.slow_call()
+                # Waited for what the request had left, not the call timeout
+                self.assertLess(time.monotonic() - started, 1)
+                with self.assertRaises(deadlines.DeadlineExceeded):
+                    vault.slow_call()
+            finally:
+                deadlines.reset(token)
+                client.release.set()
+
+        stats = vault.stats()
+        self.assertEqual((stats["deadline_exceeded"], stats["timeouts"], stats["breaker_state"]),
+                         (1, 0, "closed"))
+        self.assertEqual(policy.stats()["expired_before_vault"], 1)
+        vault.shutdown()
+
+
+    def test_expired_probe(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        client = _SlowClient()
+        vault = VaultAccess(client, call_timeout=5, breaker=breaker)
+        policy = deadlines.DeadlinePolicy({}, default_timeout=0.05)
+        app = flask.Flask(__name__)
+
+        breaker.record_failure()
+        clock.now += 30
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with app.test_request_context("/"):
+            token = policy.start(flask.request)
+            try:
+                # The probe's request gives up on it, which says nothing about Vault
+                with self.assertRaises(deadlines.DeadlineExceeded):
+                    vault.slow_call()
+            finally:
+                deadlines.reset(token)
+                client.release.set()
+
+        # The next call probes instead, and closes the breaker
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(vault.fast_call())
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        vault.shutdown()
+
+
+    def test_from_api_config(self):
+        rules = [("timed", "/timed", ("GET",))]
+        self.assertIsNone(deadlines.from_api_config({}, rules))
+
+        policy = deadlines.from_api_config({"deadlines": {"enabled": True, "max_timeout": 5, "endpoint_control": {
+            "/timed": {"GET": {"timeout": 2}, "POST": {"timeout": 2}}}}}, rules)
+        self.assertEqual(policy.max_timeout, 5)
+        self.assertIsNone(policy.default_timeout)
+
+        with self.assertRaises(deadlines.DeadlineError):
+            deadlines.from_api_config({"deadlines": {"enabled": True, "endpoint_control": {
+                "/timed": {"GET": {"timeout": 0}}}}}, rules)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Tests ETags, conditional requests and per-endpoint Cache-Control
+
+"""
+import unittest
+from datetime import datetime, timezone
+
+from werkzeug.routing import Rule
+
+from rapidrest import http_caching
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest_tests.helpers import OPEN_PANTS, dummy_api_app, resource_app
+
+
+class Versioned(ApiResource):
+    endpoint_name = "versioned"
+    calls = 0
+
+    def get_etag(self, obj_id=""):
+        return f"{obj_id}-v7" if obj_id != "unversioned" else None
+
+
+    def get_last_modified(self, obj_id=""):
+        return datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+    def get(self, obj_id=""):
+        Versioned.calls += 1
+        return ApiResponse(body={"id": obj_id}, status_code=200)
+
+
+class TestHttpCaching(unittest.TestCase):
+
+    def test_body_etag_and_cache_control(self):
+        client = dummy_api_app(OPEN_PANTS).test_client()
+
+        resp = client.get("/v1/pants")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Cache-Control"], "private, max-age=0, must-revalidate")
+        etag = resp.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        resp = client.get("/v1/pants", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        resp = client.get("/v1/pants/1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 403)
+
+
+    def test_resource_hooks_skip_handler(self):
+        client = resource_app([("/versioned/<obj_id>", Versioned.as_view("versioned"))]).test_client()
+
+        resp = client.get("/versioned/1")
+        self.assertEqual(resp.headers["ETag"], '"1-v7"')
+        self.assertEqual(Versioned.calls, 1)
+
+        resp = client.get("/versioned/1", headers={"If-None-Match": '"1-v7"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(Versioned.calls, 1)
+
+        resp = client.get("/versioned/unversioned", headers={"If-Modified-Since": "Wed, 01 Jan 2020 00:00:00 GMT"})
+        self.assertEqual(resp.status_code, 304)
+        self.assertNotIn("ETag", resp.headers)
+        self.assertEqual(Versioned.calls, 1)
+
+        resp = client.get("/versioned/unversioned", headers={"If-Modified-Since": "Tue, 31 Dec 2019 00:00:00 GMT"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("ETag", resp.headers)
+        self.assertEqual(Versioned.calls, 2)
+
+
+    def test_policy(self):
+        registry = [("pants", "/v1/pants", ("GET", "POST"))]
+        api_config = {"http_caching": {"etags": False, "endpoint_control": {
+            "/v1/pants": {"GET": {"cache_control": "no-store", "etag": True}},
+        }}}
+        compiled = http_caching.compile_cache_policy(api_config, registry)
+
+        rule = Rule("/v1/pants", endpoint="pants")
+        self.assertEqual(dict(compiled.lookup(rule, "HEAD")), {"cache_control": "no-store", "etag": True})
+        self.assertFalse(compiled.lookup(rule, "POST")["etag"])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tests asynchronous jobs
+
+"""
+import threading
+import time
+import unittest
+
+import flask
+
+from rapidrest import jobs
+from rapidrest.apiresource import ApiResource
+from rapidrest_tests.helpers import resource_app
+
+
+def _square(x):
+    return x * x
+
+
+def _wait(release:threading.Event):
+    release.wait(5)
+    if jobs.cancel_requested():
+        raise jobs.JobCancelled()
+    return flask.current_app.name
+
+
+class _ThreadJob(ApiResource):
+    endpoint_name = "thread_job"
+    release = None
+
+    def post(self):
+        return self._start_job(_wait, type(self).release)
+
+
+class _ProcessJob(ApiResource):
+    endpoint_name = "process_job"
+    job_executor = "process"
+
+    def post(self):
+        return self._start_job(_square, self._current_request.body["x"])
+
+
+def _jobs_app(**manager_kwargs) -> flask.Flask:
+    return resource_app([
+        ("/thread", _ThreadJob.as_view(_ThreadJob.endpoint_name)),
+        ("/process", _ProcessJob.as_view(_ProcessJob.endpoint_name)),
+        (jobs.JOBS_ENDPOINT, jobs.Jobs.as_view(jobs.Jobs.endpoint_name), ["GET", "DELETE"]),
+    ], name="jobs_app", jobs=jobs.JobManager(**manager_kwargs))
+
+
+def _poll(client, url:str, status:str) -> dict:
+    for _ in range(200):
+        job = client.get(url).json
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job never got to {status}: {job}")
+
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        _ThreadJob.release = threading.Event()
+
+
+    def test_thread_job(self):
+        app = _jobs_app()
+        client = app.test_client()
+
+        resp = client.post("/thread")
+        self.assertEqual(resp.status_code, 202)
+        url = resp.headers["Location"]
+        self.assertEqual(url, resp.json["href"])
+        _poll(client, url, jobs.RUNNING)
+
+        _ThreadJob.release.set()
+        self.assertEqual(_poll(client, url, jobs.SUCCEEDED)["result"], "jobs_app")
+        self.assertEqual(client.delete(url).status_code, 409)
+        self.assertEqual(client.get("/_jobs/nothing").status_code, 404)
+
+        with app.app_context():
+            job_id = url.rsplit("/", 1)[1]
+            self.assertIsNotNone(app.config["jobs"].get(job_id, None))
+            # Jobs are only visible to the principal that started them
+            self.assertIsNone(app.config["jobs"].get(job_id, "bob"))
+        app.config["jobs"].shutdown()
+
+
+    def test_process_job(self):
+        app = _jobs_app(max_processes=1)
+        client = app.test_client()
+
+        url = client.post("/process", json={"x": 12}).headers["Location"]
+        self.assertEqual(_poll(client, url, jobs.SUCCEEDED)["result"], 144)
+        app.config["jobs"].shutdown()
+
+
+    def test_backpressure_and_cancel(self):
+        app = _jobs_app(max_threads=1, max_queued=1, retry_after=7)
+        client = app.test_client()
+
+        running = client.post("/thread").headers["Location"]
+        _poll(client, running, jobs.RUNNING)
+        queued = client.post("/thread").headers["Location"]
+        resp = client.post("/thread")
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "7")
+
+        # A queued job is cancelled outright, a running one is asked to stop
+        resp = client.delete(queued)
+        self.assertEqual((resp.status_code, resp.json["status"]), (200, jobs.CANCELLED))
+        resp = client.delete(running)
+        self.assertEqual((resp.status_code, resp.json["cancel_requested"]), (202, True))
+        _ThreadJob.release.set()
+        _poll(client, running, jobs.CANCELLED)
+
+        app.config["jobs"].shutdown()
+        stats = app.config["jobs"].stats()
+        self.assertEqual((stats["submitted"], stats["rejected"], stats["active_thread"]), (2, 1, 0))
+
+
+    def test_result_ttl(self):
+        app = _jobs_app(result_ttl=0.05)
+        client = app.test_client()
+        _ThreadJob.release.set()
+
+        url = client.post("/thread").headers["Location"]
+        _poll(client, url, jobs.SUCCEEDED)
+        time.sleep(0.1)
+        self.assertEqual(client.get(url).status_code, 404)
+        app.config["jobs"].shutdown()
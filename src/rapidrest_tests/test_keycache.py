@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the principal key cache and local HMAC verification
+
+"""
+import json
+import unittest
+
+import flask
+
+from rapidrest.cache import LruTtlCache
+from rapidrest.security import authentication
+from rapidrest.security.keycache import PrincipalKeyCache
+from rapidrest_tests.helpers import FakeClock
+
+
+class TestLruTtlCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = LruTtlCache(max_entries=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = LruTtlCache(max_entries=2, ttl=10, clock=clock)
+        cache.put("a", 1)
+
+        clock.now = 9.9
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["size"], 0)
+
+
+    def test_max_bytes(self):
+        cache = LruTtlCache(max_entries=10, ttl=60, max_bytes=10, sizeof=len)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.put("c", b"1234")
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.stats()["bytes"], 8)
+
+        cache.put("d", b"x" * 11)
+        self.assertNotIn("d", cache)
+        self.assertEqual(len(cache), 2)
+
+
+class TestPrincipalKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = []
+        self.keys = {"alice": b"alice-key"}
+
+        def loader(principal):
+            self.loads.append(principal)
+            return self.keys.get(principal)
+
+        self.cache = PrincipalKeyCache(loader, max_keys=4, ttl=60)
+
+
+    def test_loads_once(self):
+        self.assertEqual(self.cache.get_key("alice"), b"alice-key")
+        self.assertEqual(self.cache.get_key("alice"), b"alice-key")
+        self.assertEqual(self.loads, ["alice"])
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+
+    def test_unknown_principal(self):
+        self.assertIsNone(self.cache.get_key("mallory"))
+        self.assertIsNone(self.cache.get_key("mallory"))
+        self.assertEqual(self.loads, ["mallory"])
+
+        # Remembered for negative_ttl only, so a principal created since is found
+        clock = FakeClock()
+        cache = PrincipalKeyCache(self.keys.get, ttl=60, negative_ttl=5, clock=clock)
+        self.assertIsNone(cache.get_key("mallory"))
+        self.keys["mallory"] = b"mallory-key"
+        self.assertIsNone(cache.get_key("mallory"))
+        clock.now += 5
+        self.assertEqual(cache.get_key("mallory"), b"mallory-key")
+
+
+    def test_evict_refetches(self):
+        self.cache.get_key("alice")
+        self.assertTrue(self.cache.evict("alice"))
+        self.cache.get_key("alice")
+        self.assertEqual(self.loads, ["alice", "alice"])
+
+
+    def test_revoke(self):
+        self.cache.get_key("alice")
+        self.cache.revoke("alice")
+        self.assertIsNone(self.cache.get_key("alice"))
+        self.assertEqual(self.loads, ["alice"])
+
+        self.cache.reinstate("alice")
+        self.assertEqual(self.cache.get_key("alice"), b"alice-key")
+
+
+    def test_loader_failure(self):
+        def loader(_):
+            raise RuntimeError("Vault is down")
+
+        cache = PrincipalKeyCache(loader)
+        self.assertIsNone(cache.get_key("alice"))
+        self.assertEqual(cache.stats()["load_failures"], 1)
+
+
+class TestLocalVerification(unittest.TestCase):
+
+    def setUp(self):
+        self.key = b"super-secret"
+        self.app = flask.Flask(__name__)
+        self.app.config["key_cache"] = PrincipalKeyCache({"alice": self.key}.get)
+        self.app.config["vault_fetcher"] = lambda: self.fail("Vault should not be used")
+
+
+    def _authenticate(self, auth_header, method="POST", path="/v1/pants", data=b""):
+        auth_dict = dict(token.split(":") for token in auth_header.split(";"))
+        mechanism = getattr(authentication, f"_{auth_dict['Version']}_authn_mechanism")
+        with self.app.test_request_context(path, method=method, data=data, headers={"Host": "localhost:80"}):
+            authenticated = mechanism(self.app, flask.request, auth_dict)
+            # The handler must still be able to read the body after authentication
+            self.assertEqual(flask.request.get_data(), data)
+            return authenticated
+
+
+    def test_valid_signature(self):
+        body = json.dumps({"Testing": 123})
+        header = authentication.create_v1_auth_header("alice", self.key, "POST", "localhost:80", "/v1/pants", body)
+        self.assertTrue(self._authenticate(header, data=body.encode("utf-8")))
+
+
+    def test_invalid_signature(self):
+        header = authentication.create_v1_auth_header("alice", b"wrong", "POST", "localhost:80", "/v1/pants")
+        self.assertFalse(self._authenticate(header))
+
+        header = authentication.create_v1_auth_header("bob", self.key, "POST", "localhost:80", "/v1/pants")
+        self.assertFalse(self._authenticate(header))
+
+        header = authentication.create_v1_auth_header("alice", self.key, "GET", "localhost:80", "/v1/pants")
+        self.assertFalse(self._authenticate(header))
+
+
+    def test_v2_streamed_body(self):
+        body = b"0123456789abcdef" * (authentication.V2_SPOOL_MAX_MEMORY // 8)
+        chunks = (body[i:i + 4096] for i in range(0, len(body), 4096))
+        header = authentication.create_v2_auth_header("alice", self.key, "POST", "localhost:80", "/v1/pants", chunks)
+        self.assertTrue(self._authenticate(header, data=body))
+
+        header = authentication.create_v2_auth_header("alice", self.key, "POST", "localhost:80", "/v1/pants", b"x")
+        self.assertFalse(self._authenticate(header, data=body))
+
+
+    def test_v2_spool_closed_with_request(self):
+        body = b"x" * (authentication.V2_SPOOL_MAX_MEMORY + 1)
+        with self.app.test_request_context("/v1/pants", method="POST", data=body):
+            authentication._spool_request_body(flask.request)
+            spool = flask.request.stream
+            self.assertFalse(spool.closed)
+        self.assertTrue(spool.closed)
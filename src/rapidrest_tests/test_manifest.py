@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the route manifest
+
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import flask
+
+from rapidrest import application, manifest, routebuilder
+
+API_ROOT = "rapidrest_dummyapi.v1"
+
+
+def _app():
+    app = flask.Flask(__name__)
+    app.config["api_config"] = application.load_api_config(API_ROOT)
+    return app
+
+
+def _routes(app):
+    return sorted((rule.rule, rule.endpoint, tuple(sorted(rule.methods))) for rule in app.url_map.iter_rules())
+
+
+class TestRouteManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.discovered = _app()
+        self.integrations = routebuilder.load_api(self.discovered, API_ROOT)
+        self.manifest = manifest.build_manifest(self.discovered, API_ROOT, self.integrations)
+
+
+    def test_same_routes_as_discovery(self):
+        self.assertTrue(manifest.is_fresh(self.manifest, API_ROOT))
+
+        app = _app()
+        integration_modules = routebuilder.load_api_from_manifest(app, json.loads(json.dumps(self.manifest)))
+
+        self.assertEqual(_routes(app), _routes(self.discovered))
+        self.assertEqual(integration_modules, self.integrations)
+        self.assertEqual(len(app.config["security_policy"]), len(self.discovered.config["security_policy"]))
+
+
+    def test_stale_source(self):
+        path = next(iter(self.manifest["sources"]))
+
+        touched = json.loads(json.dumps(self.manifest))
+        touched["sources"][path]["mtime_ns"] -= 1
+        self.assertTrue(manifest.is_fresh(touched, API_ROOT))
+
+        touched["sources"][path]["sha256"] = "0" * 64
+        self.assertFalse(manifest.is_fresh(touched, API_ROOT))
+
+        removed = json.loads(json.dumps(self.manifest))
+        del removed["sources"][path]
+        self.assertFalse(manifest.is_fresh(removed, API_ROOT))
+
+
+    def test_load_configured_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "routes.json")
+            with patch.dict(os.environ, {"API_ROUTE_MANIFEST": path}):
+                self.assertIsNone(manifest.load_fresh_manifest(API_ROOT, {}))
+
+                self.assertEqual(manifest.main([API_ROOT]), 0)
+                self.assertEqual(manifest.load_fresh_manifest(API_ROOT, {})["routes"], self.manifest["routes"])
+
+
+    def test_lazy_and_eager_imports(self):
+        app = _app()
+        routebuilder.load_api_from_manifest(app, self.manifest)
+        lazy_view = app.view_functions["pants"]
+        self.assertIsInstance(lazy_view, routebuilder.LazyView)
+        self.assertFalse(lazy_view.resolved)
+
+        views = []
+        threads = [threading.Thread(target=lambda: views.append(lazy_view.resolve())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(lazy_view.resolved)
+        self.assertEqual(len(set(views)), 1)
+        self.assertEqual(views[0].view_class.__name__, "Pants")
+
+        app = _app()
+        app.config["api_config"].setdefault("routing", {})["eager_import"] = True
+        routebuilder.load_api_from_manifest(app, self.manifest)
+        self.assertNotIsInstance(app.view_functions["pants"], routebuilder.LazyView)
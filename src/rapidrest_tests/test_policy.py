@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the compiled endpoint security policy
+
+"""
+import logging
+import unittest
+
+from werkzeug.routing import Rule
+
+from rapidrest.security import policy
+
+REGISTRY = [
+    ("pants", "/v1/pants", ("POST", "GET")),
+    ("pants", "/v1/pants/<obj_id>", ("GET",)),
+]
+
+
+def _rule(endpoint, rule):
+    return Rule(rule, endpoint=endpoint)
+
+
+class TestSecurityPolicy(unittest.TestCase):
+
+    def test_lookup(self):
+        api_config = {"security": {"whitelist": True, "endpoint_control": {
+            "/v1/pants": {"POST": {"authentication": True}},
+            "/v1/pants/<obj_id>": {"GET": {"authentication": False}},
+        }}}
+        compiled = policy.compile_security_policy(api_config, REGISTRY)
+
+        self.assertEqual(len(compiled), 2)
+        self.assertTrue(compiled.lookup(_rule("pants", "/v1/pants"), "POST")["authentication"])
+        self.assertFalse(compiled.lookup(_rule("pants", "/v1/pants/<obj_id>"), "GET")["authentication"])
+        self.assertIsNone(compiled.lookup(_rule("pants", "/v1/pants"), "GET"))
+
+
+    def test_dangling_entries_reported(self):
+        api_config = {"security": {"whitelist": True, "endpoint_control": {
+            "/health": {"GET": {"authentication": False}},
+            "/v1/pants": {"DELETE": {"authentication": False}},
+        }}}
+        log = logging.getLogger(self.id())
+        # application.start() reconfigures logging, which disables loggers that already exist
+        log.disabled = False
+        with self.assertLogs(log, "WARNING") as logs:
+            policy.compile_security_policy(api_config, REGISTRY, log)
+
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("/health", logs.output[0])
+        self.assertIn("DELETE", logs.output[1])
+
+
+    def test_invalid_config(self):
+        api_config = {"security": {"whitelist": True, "endpoint_control": {
+            "/v1/pants": {"POST": {"authorization": True}},
+        }}}
+        with self.assertRaises(policy.SecurityPolicyError):
+            policy.compile_security_policy(api_config, REGISTRY)
+
+        api_config["security"]["endpoint_control"]["/v1/pants"]["POST"] = {"authentication": "yes"}
+        with self.assertRaises(policy.SecurityPolicyError):
+            policy.compile_security_policy(api_config, REGISTRY)
+
+        # The mapping form always enforced authentication, even `required: false`
+        api_config["security"]["endpoint_control"]["/v1/pants"]["POST"] = {"authentication": {"required": False}}
+        with self.assertRaises(policy.SecurityPolicyError):
+            policy.compile_security_policy(api_config, REGISTRY)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the replay protection cache
+
+"""
+import unittest
+
+from rapidrest.security import authentication, replay
+from rapidrest_tests.helpers import FakeClock
+
+
+class TestReplayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000000.0)
+        self.cache = replay.ReplayCache(skew_window=30, bucket_seconds=10, max_nonces_per_bucket=2, clock=self.clock)
+
+
+    def test_replayed_nonce(self):
+        now = int(self.clock.now)
+        self.assertEqual(self.cache.check("alice", now, "n1"), replay.ACCEPTED)
+        self.assertEqual(self.cache.check("alice", now, "n1"), replay.REPLAYED)
+        # Nonces are scoped to the principal
+        self.assertEqual(self.cache.check("bob", now, "n1"), replay.ACCEPTED)
+
+
+    def test_skew_window(self):
+        now = int(self.clock.now)
+        self.assertEqual(self.cache.check("alice", now - 31, "n1"), replay.STALE)
+        self.assertEqual(self.cache.check("alice", now + 31, "n2"), replay.STALE)
+        self.assertEqual(self.cache.check("alice", now + 30, "n3"), replay.ACCEPTED)
+
+
+    def test_buckets_recycled(self):
+        now = int(self.clock.now)
+        self.assertEqual(self.cache.check("alice", now, "n1"), replay.ACCEPTED)
+
+        # Once the original bucket has left the window its slot is reused, and the memory with it
+        self.clock.now += 10 * self.cache._ring_size
+        later = int(self.clock.now)
+        self.assertEqual(self.cache.check("alice", later, "n1"), replay.ACCEPTED)
+        self.assertEqual(sum(len(nonces) for nonces in self.cache._ring), 1)
+
+
+    def test_overflow(self):
+        now = int(self.clock.now)
+        self.cache.check("alice", now, "n1")
+        self.cache.check("alice", now, "n2")
+        self.assertEqual(self.cache.check("alice", now, "n3"), replay.OVERFLOW)
+        self.assertEqual(self.cache.stats()["overflow"], 1)
+
+
+class TestReplayElements(unittest.TestCase):
+
+    def test_signed_elements(self):
+        header = authentication.create_v1_auth_header("alice", b"key", "GET", "localhost", "/v1/pants",
+                                                      date=1234, nonce="abc")
+        self.assertTrue(header.endswith(";Date:1234;Nonce:abc"))
+
+        unsigned = authentication.create_v1_auth_header("alice", b"key", "GET", "localhost", "/v1/pants")
+        self.assertNotEqual(header.split(";")[3], unsigned.split(";")[3])
+
+
+    def test_generated_elements(self):
+        date, nonce = authentication.replay_elements()
+        self.assertIsInstance(date, int)
+        self.assertNotEqual(nonce, authentication.replay_elements()[1])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the server-side GET response cache
+
+"""
+import unittest
+
+import flask
+from werkzeug.routing import Rule
+
+from rapidrest import response_cache
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.security.authentication import Principal
+from rapidrest_tests.helpers import OPEN_PANTS, FakeClock, dummy_api_app, resource_app
+
+
+class Shirts(ApiResource):
+    endpoint_name = "shirts"
+    response_cache_ttl = 30
+    calls = 0
+
+    def get(self, shirt_id=""):
+        Shirts.calls += 1
+        return ApiResponse(body={"id": shirt_id, "calls": Shirts.calls, "q": flask.request.args.get("q")},
+                           status_code=200)
+
+
+    def post(self):
+        return ApiResponse(body={}, status_code=201)
+
+
+def _shirts_app(clock=None):
+    view = Shirts.as_view("shirts")
+    return resource_app([("/shirts", view, ["GET", "POST"]), ("/shirts/<shirt_id>", view, ["GET"])],
+                        response_cache=response_cache.ResponseCache({}, clock=clock or FakeClock()))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        Shirts.calls = 0
+
+
+    def test_hits_and_keys(self):
+        app = _shirts_app()
+        client = app.test_client()
+
+        self.assertEqual(client.get("/shirts/1").json["calls"], 1)
+        self.assertEqual(client.get("/shirts/1").json["calls"], 1)
+        self.assertEqual(client.get("/shirts/2").json["calls"], 2)
+        self.assertEqual(client.get("/shirts/1?q=a").json["calls"], 3)
+        self.assertEqual(client.get("/shirts/1?q=a").json, {"id": "1", "calls": 3, "q": "a"})
+
+        stats = app.config["response_cache"].stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["stores"], 3)
+        self.assertEqual(stats["hit_ratio"], 0.4)
+
+
+    def test_hit_is_conditional(self):
+        client = _shirts_app().test_client()
+        etag = client.get("/shirts/1").headers["ETag"]
+
+        resp = client.get("/shirts/1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(Shirts.calls, 1)
+
+
+    def test_ttl(self):
+        clock = FakeClock()
+        client = _shirts_app(clock).test_client()
+
+        client.get("/shirts")
+        clock.now = 29
+        self.assertEqual(client.get("/shirts").json["calls"], 1)
+        clock.now = 30
+        self.assertEqual(client.get("/shirts").json["calls"], 2)
+
+
+    def test_write_invalidates(self):
+        client = _shirts_app().test_client()
+
+        client.get("/shirts")
+        client.get("/shirts/1")
+        self.assertEqual(client.post("/shirts").status_code, 201)
+        self.assertEqual(client.get("/shirts").json["calls"], 3)
+        self.assertEqual(client.get("/shirts/1").json["calls"], 4)
+
+
+    def test_per_principal(self):
+        app = _shirts_app()
+
+        def _get(principal):
+            with app.test_request_context("/shirts"):
+                flask.g.principal = principal
+                return app.full_dispatch_request().json["calls"]
+
+        self.assertEqual(_get(Principal(name="alice", auth_version="v2")), 1)
+        self.assertEqual(_get(Principal(name="bob", auth_version="v2")), 2)
+        self.assertEqual(_get(Principal(name="alice", auth_version="v2")), 1)
+
+
+    def test_config(self):
+        app = dummy_api_app(OPEN_PANTS)
+        self.assertIsNotNone(app.config["response_cache"])
+        client = app.test_client()
+        self.assertEqual(client.get("/v1/pants").status_code, 200)
+        self.assertEqual(app.config["response_cache"].stats()["stores"], 0)
+
+        registry = [("pants", "/v1/pants", ("GET", "POST")), ("pants", "/v1/pants/<obj_id>", ("GET",))]
+        cache = response_cache.from_api_config({"response_cache": {"endpoint_control": {
+            "/v1/pants": {"GET": {"ttl": 10, "per_principal": False}},
+        }}}, registry)
+        self.assertEqual(cache.settings(ApiResource, Rule("/v1/pants", endpoint="pants")), (10, False))
+        self.assertIsNone(cache.settings(ApiResource, Rule("/v1/pants/<obj_id>", endpoint="pants")))
+
+        self.assertIsNone(response_cache.from_api_config({"response_cache": {"enabled": False}}, registry))
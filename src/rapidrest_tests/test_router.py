@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the prefix tree URL matcher against Werkzeug's
+
+"""
+import unittest
+from unittest.mock import patch
+
+import flask
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, RequestRedirect, Rule
+
+from rapidrest import router
+from rapidrest_tests.helpers import OPEN_PANTS, dummy_api_app
+
+
+def _rules():
+    return [
+        Rule("/v1", endpoint="v1", methods=["GET", "POST"]),
+        Rule("/v1/pants", endpoint="pants", methods=["GET", "POST"]),
+        Rule("/v1/pants/<obj_id>", endpoint="pants", methods=["GET"]),
+        Rule("/v1/pants/<pants_id>", endpoint="pants", methods=["DELETE"]),
+        Rule("/v1/pants/special", endpoint="special", methods=["GET"]),
+        Rule("/v1/shirts/<int:shirt_id>", endpoint="shirts", methods=["GET"]),
+        Rule("/v1/shirts/<int:shirt_id>/buttons", endpoint="buttons", methods=["GET"]),
+        Rule("/v1/shirts/<name>/buttons", endpoint="named_buttons", methods=["GET"]),
+        Rule("/v1/hats/<string(length=2):size>", endpoint="hat_sizes", methods=["GET"]),
+        Rule("/v1/hats/<string(minlength=3):name>", endpoint="hat_names", methods=["GET"]),
+        Rule("/v1/socks/", endpoint="socks", methods=["GET"]),
+        Rule("/static/<path:filename>", endpoint="static", methods=["GET"]),
+    ]
+
+
+def _match(url_map, path, method):
+    try:
+        rule, args = url_map.bind("localhost").match(path, method, return_rule=True)
+        return rule.rule, rule.endpoint, args
+    except (MethodNotAllowed, NotFound, RequestRedirect) as e:
+        return type(e).__name__
+
+
+class TestRadixMap(unittest.TestCase):
+
+    def test_matches_like_werkzeug(self):
+        werkzeug_map = Map(_rules())
+        radix_map = router.RadixMap(_rules())
+
+        for path, method in [
+            ("/v1", "GET"), ("/v1", "HEAD"), ("/v1/pants", "POST"), ("/v1/pants/1", "GET"),
+            ("/v1/pants/1", "DELETE"), ("/v1/pants/special", "GET"), ("/v1/pants/special", "DELETE"),
+            ("/v1/pants/1", "PUT"), ("/v1/pants/", "GET"), ("/v1//pants", "GET"), ("/v1/shirts/12", "GET"),
+            ("/v1/shirts/x", "GET"), ("/v1/shirts/12/buttons", "GET"), ("/v1/shirts/blue/buttons", "GET"),
+            ("/v1/socks", "GET"), ("/static/a/b.css", "GET"), ("/nope", "GET"), ("/", "GET"),
+            ("/v1/hats/xl", "GET"), ("/v1/hats/fedora", "GET"), ("/v1/hats/x", "GET"),
+            ("//v1/pants", "GET"), ("//v1", "GET"), ("v1/pants", "GET"),
+        ]:
+            with self.subTest(path=path, method=method):
+                self.assertEqual(_match(radix_map, path, method), _match(werkzeug_map, path, method))
+
+
+    def test_tree_rebuilt_on_add(self):
+        radix_map = router.RadixMap(_rules())
+        self.assertEqual(_match(radix_map, "/v1/gloves", "GET"), "NotFound")
+        radix_map.add(Rule("/v1/gloves", endpoint="gloves", methods=["GET"]))
+        self.assertEqual(_match(radix_map, "/v1/gloves", "GET")[1], "gloves")
+
+
+    def test_installed_from_config(self):
+        app = dummy_api_app(OPEN_PANTS, {"routing": {"matcher": "radix"}})
+        self.assertIsInstance(app.url_map, router.RadixMap)
+
+        client = app.test_client()
+        self.assertEqual(client.post("/v1", json={"pants": 1}).status_code, 201)
+        self.assertEqual(client.get("/v1/recursive/1").status_code, 403)
+        self.assertEqual(client.delete("/v1").status_code, 405)
+
+        # Requests go through the tree, not just adapters bound by hand
+        with patch.object(router, "_match", wraps=router._match) as match:
+            self.assertEqual(client.post("/v1", json={"pants": 1}).status_code, 201)
+            self.assertEqual(client.get("/v1/recursive/1").status_code, 403)
+        self.assertGreater(match.call_count, 0)
+        with app.test_request_context("/v1"):
+            self.assertIsInstance(app.create_url_adapter(flask.request), router.RadixMapAdapter)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the startup tracer
+
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import flask
+
+from rapidrest import application, routebuilder, startup_trace
+from rapidrest_tests.helpers import FakeClock
+
+
+class TestStartupTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracer = startup_trace.StartupTracer(enabled=True, clock=self.clock, cpu_clock=self.clock)
+        self.addCleanup(self.tracer.report)
+
+
+    def test_phases_and_spans(self):
+        with self.tracer.phase("load_api"):
+            with self.tracer.span("modules", "pants"):
+                self.clock.now += 2
+            self.clock.now += 1
+
+        report = self.tracer.report()
+        self.assertEqual(report["wall_s"], 3)
+        self.assertEqual([(p["name"], p["wall_s"], p["cpu_s"]) for p in report["phases"]], [("load_api", 3, 3)])
+        self.assertEqual(report["modules"][0]["name"], "pants")
+        self.assertEqual(report["modules"][0]["wall_s"], 2)
+        self.assertIn("memory_delta_bytes", report["modules"][0])
+        self.assertIn("memory_peak_bytes", report)
+
+
+    def test_disabled_only_tracks_total(self):
+        tracer = startup_trace.StartupTracer(clock=self.clock)
+        with tracer.phase("load_api"):
+            self.clock.now += 1
+
+        self.assertEqual(tracer.phases, [])
+        self.assertEqual(tracer.elapsed, 1)
+
+
+    def test_budget(self):
+        self.clock.now = 5
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "trace.json")
+            with patch.dict(os.environ, {"API_STARTUP_TRACE": path}):
+                self.assertFalse(startup_trace.finish(self.tracer, {"startup": {"budget": 4}}))
+            with open(path) as trace_file:
+                self.assertEqual(json.load(trace_file)["budget_s"], 4)
+
+        self.assertTrue(startup_trace.finish(startup_trace.StartupTracer(clock=self.clock), {"startup": {}}))
+
+
+    def test_module_imports_traced(self):
+        app = flask.Flask(__name__)
+        app.config["api_config"] = application.load_api_config("rapidrest_dummyapi.v1")
+        app.config["startup_tracer"] = self.tracer
+        routebuilder.load_api(app, "rapidrest_dummyapi.v1")
+
+        modules = [span["name"] for span in self.tracer.spans["modules"]]
+        self.assertIn("rapidrest_dummyapi.v1.pants", modules)
+        self.assertIn("rapidrest_dummyapi.v1.ext_integrations", modules)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests streamed ApiResponse and JSONAPIResponse bodies
+
+"""
+import json
+import unittest
+
+from rapidrest import streaming
+from rapidrest.apiresource import ApiResource, ApiResponse
+from rapidrest.jsonapi_v1 import JSONAPIResponse
+from rapidrest_tests.helpers import resource_app
+
+
+class Rows(ApiResource):
+    endpoint_name = "rows"
+
+    def get(self):
+        return ApiResponse(body=self._rows(), status_code=200, headers={"X-Rows": "streamed"})
+
+
+    def _rows(self):
+        count = int(self._current_request.flask_request.args.get("count", 3))
+        fail_at = int(self._current_request.flask_request.args.get("fail_at", -1))
+        for idx in range(count):
+            if idx == fail_at:
+                raise RuntimeError("the database went away")
+            yield {"row": idx}
+
+
+class Documents(ApiResource):
+    endpoint_name = "documents"
+
+    def get(self):
+        rows = ({"type": "rows", "id": str(idx)} for idx in range(3))
+        return JSONAPIResponse(data=rows, meta={"streamed": True}, status=200)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.app = resource_app([("/rows", Rows.as_view("rows")),
+                                 ("/documents", Documents.as_view("documents"))])
+        self.client = self.app.test_client()
+
+
+    def test_json_array(self):
+        resp = self.client.get("/rows?count=1000")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.headers["X-Rows"], "streamed")
+        self.assertEqual(resp.json, [{"row": idx} for idx in range(1000)])
+
+        self.assertEqual(self.client.get("/rows?count=0").json, [])
+
+
+    def test_ndjson(self):
+        resp = self.client.get("/rows", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.mimetype, streaming.NDJSON_MIMETYPE)
+        self.assertEqual([json.loads(line) for line in resp.data.splitlines()], [{"row": idx} for idx in range(3)])
+
+
+    def test_failure_before_first_item(self):
+        resp = self.client.get("/rows?fail_at=0")
+        self.assertEqual(resp.status_code, 500)
+        self.assertIn("database", resp.json["err_detail"])
+
+
+    def test_failure_mid_stream(self):
+        resp = self.client.get("/rows?fail_at=2", headers={"Accept": "application/x-ndjson"})
+        chunks = []
+        with self.assertRaises(RuntimeError):
+            for chunk in resp.response:
+                chunks.append(chunk)
+
+        lines = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        self.assertEqual(lines[:2], [{"row": 0}, {"row": 1}])
+        self.assertTrue(lines[2]["err"])
+
+
+    def test_jsonapi_data(self):
+        resp = self.client.get("/documents")
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.json, {"meta": {"streamed": True},
+                                     "data": [{"type": "rows", "id": str(idx)} for idx in range(3)]})
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the session token issuer and the t1 authentication mechanism
+
+"""
+import base64
+import os
+import unittest
+from unittest.mock import patch
+
+import flask
+import yaml
+
+from rapidrest import application, errorhandlers, routebuilder, vault_integration
+from rapidrest.security import authentication, keycache, tokens
+from rapidrest_tests.helpers import FakeClock
+
+
+class TestSessionTokenIssuer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000000.0)
+        self.issuer = tokens.SessionTokenIssuer({"k1": b"first-key"}, "k1", ttl=60, clock=self.clock)
+
+
+    def test_issue_and_verify(self):
+        token, expires = self.issuer.issue("alice|ops")
+        self.assertEqual(expires, self.clock.now + 60)
+        self.assertEqual(self.issuer.verify(token), "alice|ops")
+
+
+    def test_expiry(self):
+        token, _ = self.issuer.issue("alice")
+        self.clock.now += 60
+        self.assertIsNone(self.issuer.verify(token))
+
+
+    def test_tampering(self):
+        token, _ = self.issuer.issue("alice")
+        forged = tokens._b64encode(f"k1|{int(self.clock.now) + 60}|bob".encode("utf-8"))
+        self.assertIsNone(self.issuer.verify(f"{forged}.{token.split('.')[1]}"))
+        self.assertIsNone(self.issuer.verify("garbage"))
+        self.assertIsNone(self.issuer.verify("a.b.c"))
+
+
+    def test_rotation(self):
+        old_token, _ = self.issuer.issue("alice")
+        self.issuer.rotate({"k1": b"first-key", "k2": b"second-key"}, "k2")
+        new_token, _ = self.issuer.issue("alice")
+
+        self.assertEqual(self.issuer.verify(old_token), "alice")
+        self.assertEqual(self.issuer.verify(new_token), "alice")
+
+        self.issuer.rotate({"k2": b"second-key"}, "k2")
+        self.assertIsNone(self.issuer.verify(old_token))
+        self.assertEqual(self.issuer.verify(new_token), "alice")
+
+
+    @patch.dict(os.environ, {"VAULT_SECRETS_PATH": "_dynamic", "VAULT_SECRETS_MOUNT": "kv"})
+    def test_reloaded_with_secrets(self):
+        keyring = {"current": "k1", "k1": base64.b64encode(b"first-key").decode("ascii")}
+
+        class FakeKV:
+            logged_in = True
+
+            def get_secrets(self, path, mount):
+                return dict(keyring) if path == "session_token_keys" else {}
+
+        api_config = {"secrets": {}, "security": {"session_tokens": {"enabled": True}}}
+        refresher = vault_integration.SecretsRefresher(api_config, FakeKV(), 300, reloaders=[
+            lambda: tokens.reload_keys(self.issuer, api_config, FakeKV())])
+        old_token, _ = self.issuer.issue("alice")
+
+        refresher.refresh()
+        self.assertEqual(self.issuer.keyring, ({"k1": b"first-key"}, "k1"))
+
+        # Rotated in Vault, the secrets themselves didn't change
+        keyring.update(current="k2", k2=base64.b64encode(b"second-key").decode("ascii"))
+        refresher.refresh()
+        new_token, _ = self.issuer.issue("alice")
+        self.assertEqual(self.issuer.keyring[1], "k2")
+        self.assertEqual((self.issuer.verify(old_token), self.issuer.verify(new_token)), ("alice", "alice"))
+
+        # A keyring that can't be used leaves the current one alone
+        keyring["current"] = "k3"
+        self.assertFalse(tokens.reload_keys(self.issuer, api_config, FakeKV()))
+        self.assertEqual(self.issuer.keyring[1], "k2")
+
+
+class TestTokenEndpoint(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = b"alice-key"
+        cls.app = flask.Flask(__name__)
+        errorhandlers.register_handlers(cls.app)
+
+        api_config = application.load_api_config("rapidrest_dummyapi.v1")
+        api_config["security"]["endpoint_control"]["/v1/pants"] = {"POST": {"authentication": True}}
+        cls.app.config["api_config"] = api_config
+        cls.app.config["vault_fetcher"] = lambda: None
+        cls.app.config["key_cache"] = keycache.PrincipalKeyCache({"alice": cls.key}.get)
+        cls.app.config["token_issuer"] = tokens.SessionTokenIssuer({"k1": b"token-key"}, "k1")
+        routebuilder.load_api(cls.app, "rapidrest_dummyapi.v1")
+
+        cls.client = cls.app.test_client()
+
+
+    def test_token_flow(self):
+        auth_header = authentication.create_v1_auth_header("alice", self.key, "POST", "localhost", "/_token")
+        resp = self.client.post("/_token", headers={"Authorization": auth_header})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["auth_version"], "t1")
+
+        token_header = tokens.create_token_auth_header(resp.json["token"])
+        resp = self.client.post("/v1/pants", headers={"Authorization": token_header})
+        self.assertEqual(resp.status_code, 200)
+
+        # A token can't be used to mint more tokens
+        resp = self.client.post("/_token", headers={"Authorization": token_header})
+        self.assertEqual(resp.status_code, 403)
+
+
+    def test_bad_token(self):
+        resp = self.client.post("/v1/pants", headers={"Authorization": tokens.create_token_auth_header("a.b")})
+        self.assertEqual(resp.status_code, 403)
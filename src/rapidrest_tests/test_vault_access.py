@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the Vault access layer
+
+"""
+import os
+import threading
+import unittest
+from types import MappingProxyType
+from unittest.mock import patch
+
+import flask
+
+from rapidrest import vault_integration
+from rapidrest.security.keycache import PrincipalKeyCache
+from rapidrest.vault_access import CircuitBreaker, VaultAccess, VaultTimeoutError, VaultUnavailableError
+from rapidrest_tests.helpers import FakeClock
+
+_LOAD_VAULT = vault_integration.load_vault
+
+
+class FakeVaultError(Exception):
+    def __init__(self, status_code:int):
+        super().__init__(f"Vault answered {status_code}")
+        self.status_code = status_code
+
+
+class FakeVaultClient:
+    logged_in = True
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.fail = False
+
+    def verify_hmac_signature(self, principal, data, signature):
+        if self.fail:
+            raise ConnectionError("Vault is down")
+        return signature == "good"
+
+    def slow_call(self):
+        self.release.wait(5)
+        return True
+
+    def get_secrets(self, path, mount):
+        raise FakeVaultError(int(path))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_recover(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        # A single probe is allowed once the reset timeout has passed
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.trips, 2)
+
+
+class TestVaultAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeVaultClient()
+        self.vault = VaultAccess(self.client, max_concurrency=1, max_queued=0, call_timeout=1,
+                                 breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    def tearDown(self):
+        self.client.release.set()
+        self.vault.shutdown()
+
+
+    def test_proxies_client(self):
+        self.assertTrue(self.vault.logged_in)
+        self.assertTrue(self.vault.verify_hmac_signature("alice", "data", "good"))
+        self.assertFalse(self.vault.verify_hmac_signature("alice", "data", "bad"))
+        self.assertEqual(self.vault.stats()["calls"], 2)
+
+
+    def test_failures_open_breaker(self):
+        self.client.fail = True
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.vault.verify_hmac_signature("alice", "data", "good")
+
+        self.client.fail = False
+        with self.assertRaises(VaultUnavailableError):
+            self.vault.verify_hmac_signature("alice", "data", "good")
+
+        stats = self.vault.stats()
+        self.assertEqual(stats["failures"], 2)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["breaker_state"], CircuitBreaker.OPEN)
+
+
+    def test_answered_errors_dont_open_breaker(self):
+        for _ in range(3):
+            with self.assertRaises(FakeVaultError):
+                self.vault.get_secrets("404", "kv")
+        self.assertEqual(self.vault.stats()["breaker_state"], CircuitBreaker.CLOSED)
+
+        for _ in range(2):
+            with self.assertRaises(FakeVaultError):
+                self.vault.get_secrets("503", "kv")
+        stats = self.vault.stats()
+        self.assertEqual((stats["failures"], stats["breaker_state"]), (2, CircuitBreaker.OPEN))
+
+
+    def test_deadline_and_saturation(self):
+        with self.assertRaises(VaultTimeoutError):
+            self.vault.call("slow_call", timeout=0.05)
+
+        # The timed out call still holds the only worker, so this is rejected rather than queued
+        with self.assertRaises(VaultUnavailableError):
+            self.vault.call("slow_call", timeout=0.05)
+
+        stats = self.vault.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["saturated"], 1)
+        self.assertEqual(stats["utilisation"], 1.0)
+
+
+class TestStaleKeys(unittest.TestCase):
+
+    def test_stale_key_served_while_vault_unavailable(self):
+        clock = FakeClock()
+        vault_up = [True]
+
+        def loader(_):
+            if not vault_up[0]:
+                raise VaultUnavailableError("Vault circuit breaker is open")
+            return b"key"
+
+        cache = PrincipalKeyCache(loader, ttl=10, stale_ttl=20, clock=clock)
+        self.assertEqual(cache.get_key("alice"), b"key")
+
+        vault_up[0] = False
+        clock.now = 15
+        self.assertEqual(cache.get_key("alice"), b"key")
+        self.assertEqual(cache.stats()["stale_served"], 1)
+
+        clock.now = 30
+        self.assertIsNone(cache.get_key("alice"))
+
+
+class TestSecretsRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.secrets = {"DB_PASSWORD": "one"}
+        self.refreshed = []
+
+        secrets = self.secrets
+
+        class FakeKV:
+            logged_in = True
+
+            def get_secrets(self, path, mount):
+                return dict(secrets)
+
+        self.api_config = {"secrets": MappingProxyType({"DB_PASSWORD": "one"})}
+        self.refresher = vault_integration.SecretsRefresher(self.api_config, FakeKV(), 300,
+                                                            on_refresh=self.refreshed.append)
+
+
+    @patch.dict(os.environ, {"VAULT_SECRETS_PATH": "_dynamic", "VAULT_SECRETS_MOUNT": "kv"})
+    def test_swaps_on_change(self):
+        original = self.api_config["secrets"]
+        self.assertEqual(self.refresher.refresh(), 300)
+        self.assertIs(self.api_config["secrets"], original)
+        self.assertEqual(self.refreshed, [])
+
+        self.secrets["DB_PASSWORD"] = "two"
+        self.refresher.refresh()
+        self.assertIsInstance(self.api_config["secrets"], MappingProxyType)
+        self.assertEqual(self.api_config["secrets"]["DB_PASSWORD"], "two")
+        self.assertEqual(original["DB_PASSWORD"], "one")
+        self.assertEqual(len(self.refreshed), 1)
+
+
+    @patch.dict(os.environ, {"VAULT_SECRETS_PATH": "_dynamic", "VAULT_SECRETS_MOUNT": "kv"})
+    def test_secret_ttl_schedule(self):
+        self.secrets["ttl"] = "2m"
+        self.assertEqual(self.refresher.refresh(), 120)
+
+
+    @patch.dict(os.environ, {"VAULT_URL": "http://vault"})
+    def test_token_renewal(self):
+        renewals = []
+
+        class FakeTokenAuth:
+            expired = False
+
+            def __init__(self, client):
+                self._client = client
+
+            def renew_self(self):
+                if FakeTokenAuth.expired:
+                    raise RuntimeError("permission denied")
+                renewals.append(self._client.token)
+                return {"auth": {"lease_duration": 3600}}
+
+        class FakeHvacClient:
+            def __init__(self, url):
+                self.token = None
+                self.auth = type("FakeAuth", (), {"token": FakeTokenAuth(self)})()
+
+        class FakeLoginClient:
+            token = "s.first"
+
+            def login(self):
+                self.token = "s.second"
+
+        refresher = vault_integration.SecretsRefresher(self.api_config, FakeLoginClient(), 300)
+        with patch.object(vault_integration, "hvac", type("FakeHvac", (), {"Client": FakeHvacClient})):
+            self.assertEqual(refresher.renew_token(), 2400)
+            self.assertEqual(renewals, ["s.first"])
+
+            # A token that can't be renewed is replaced by logging in again, and retried soon
+            FakeTokenAuth.expired = True
+            self.assertEqual(refresher.renew_token(), vault_integration.DEFAULT_SECRETS_RETRY_INTERVAL)
+            FakeTokenAuth.expired = False
+            refresher.renew_token()
+            self.assertEqual(renewals, ["s.first", "s.second"])
+
+        self.assertEqual((refresher.renewals, refresher.renewal_failures), (2, 1))
+        with patch.object(vault_integration, "hvac", None):
+            self.assertIsNone(refresher.renew_token())
+
+
+    def test_parse_duration(self):
+        self.assertEqual(vault_integration._parse_duration(30), 30)
+        self.assertEqual(vault_integration._parse_duration("90s"), 90)
+        self.assertEqual(vault_integration._parse_duration("1h"), 3600)
+        self.assertIsNone(vault_integration._parse_duration("soon"))
+
+
+class TestVaultHandle(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.config["api_config"] = {}
+        self.handle = vault_integration.VaultHandle(self.app)
+        self.logins = []
+
+        def fake_load_vault(app):
+            self.logins.append(os.getpid())
+            app.config["_vault"] = f"vault-{os.getpid()}"
+
+        patcher = patch.object(vault_integration, "load_vault", fake_load_vault)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def test_resolved_once(self):
+        self.assertEqual(self.handle.get(), f"vault-{os.getpid()}")
+        self.assertEqual(self.handle.get(), f"vault-{os.getpid()}")
+        self.assertEqual(self.logins, [os.getpid()])
+
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Requires fork()")
+    def test_reresolved_after_fork(self):
+        parent_vault = self.handle.get()
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, str(self.handle.get()).encode("utf-8"))
+            os._exit(0)
+
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as child_output:
+            self.assertEqual(child_output.read(), f"vault-{pid}")
+        self.assertEqual(self.handle.get(), parent_vault)
+
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Requires fork()")
+    def test_fallback_after_fork(self):
+        parent_client = FakeVaultClient()
+        parent_client.token = "s.parent"
+        self.app.config["_vault"] = VaultAccess(parent_client)
+        self.app.config["api_config"]["secrets"] = MappingProxyType({"db_password": "hunter2"})
+        self.handle._resolved = True
+
+        def _from_token(client):
+            child_client = FakeVaultClient()
+            child_client.token = client.token
+            return child_client
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            # The wrapped secret was used up by the parent, so logging in again fails
+            with patch.object(vault_integration, "load_vault", _LOAD_VAULT), \
+                    patch.object(vault_integration, "enable_vault", lambda: None), \
+                    patch.object(vault_integration, "_client_from_token", _from_token), \
+                    patch.dict(os.environ, {"VAULT_URL": "http://vault"}):
+                vault = self.handle.get()
+            os.write(write_fd, repr((vault._client is parent_client, vault._client.token,
+                                     dict(self.app.config["api_config"]["secrets"]))).encode("utf-8"))
+            vault.shutdown()
+            os._exit(0)
+
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as child_output:
+            self.assertEqual(child_output.read(), repr((False, "s.parent", {"db_password": "hunter2"})))
+        self.app.config["_vault"].shutdown()